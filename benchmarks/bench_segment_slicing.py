@@ -0,0 +1,73 @@
+"""
+Benchmark for splitting hex file segments into flash write blocks
+
+Builds images from a single contiguous segment of increasing size and reports the
+build time per MiB. With linear scaling the time per MiB stays roughly constant
+as the segment grows.
+
+Usage:
+    python benchmarks/bench_segment_slicing.py [--repeat N]
+"""
+import argparse
+import os
+import time
+from intelhex import IntelHex
+
+from pyfwimagebuilder.mcu32builder import FirmwareImageBuilderMcu32, Mcu32FirmwareImage
+
+SEGMENT_SIZES = [64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024]
+WRITE_BLOCK_SIZE = 0x40
+FLASH_START = 0x1000
+
+def make_config(segment_size):
+    """Create a M0+ configuration that covers a segment of the given size
+
+    :param segment_size: Segment size in bytes
+    :type segment_size: int
+    :return: Bootloader configuration
+    :rtype: dict
+    """
+    return {
+        "bootloader": {
+            "IMAGE_FORMAT_VERSION": "1.0.0",
+            "DEVICE_ID": 0x11070000,
+            "WRITE_BLOCK_SIZE": WRITE_BLOCK_SIZE,
+            "FLASH_START": FLASH_START,
+            "FLASH_END": FLASH_START + segment_size,
+            "ARCH": "M0+",
+        }
+    }
+
+def make_hexfile(segment_size):
+    """Create a hex file with one segment of random data
+
+    :param segment_size: Segment size in bytes
+    :type segment_size: int
+    :return: Hex file
+    :rtype: IntelHex
+    """
+    hexfile = IntelHex()
+    hexfile.frombytes(os.urandom(segment_size), offset=FLASH_START)
+    return hexfile
+
+def main():
+    """Run the benchmark and print the results"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3, help="Number of builds per segment size")
+    args = parser.parse_args()
+
+    print(f"{'Segment size':>14} {'Blocks':>8} {'Build time (s)':>15} {'s/MiB':>8}")
+    for segment_size in SEGMENT_SIZES:
+        builder = FirmwareImageBuilderMcu32(make_config(segment_size), Mcu32FirmwareImage)
+        hexfile = make_hexfile(segment_size)
+        best = None
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            image = builder.build(hexfile)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        per_mib = best / (segment_size / (1024 * 1024))
+        print(f"{segment_size:>14} {len(image.blocks):>8} {best:>15.3f} {per_mib:>8.3f}")
+
+if __name__ == "__main__":
+    main()
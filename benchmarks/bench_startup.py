@@ -0,0 +1,62 @@
+"""
+Benchmark for the start-up time of the pyfwimagebuilder CLI
+
+Runs the CLI in a new interpreter for each invocation, the way make or a build script
+calls it, and reports the wall time of printing the version and of building a small
+image from the test data.
+
+Usage:
+    python benchmarks/bench_startup.py [--repeat N]
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+DATA_FOLDER = Path(__file__).parent.parent.absolute() / 'tests' / 'data' / 'MCU8'
+APPFILE = DATA_FOLDER / 'applications' / 'AVR128DA48_App_checksum.hex'
+CONFIGFILE = DATA_FOLDER / 'v0.3.0' / 'configs' / 'bootloader_config_avr.toml'
+
+CLI = "import sys; from pyfwimagebuilder.pyfwimagebuilder import main; sys.exit(main())"
+
+def time_cli(arguments, repeat):
+    """Run the CLI repeatedly and measure the wall time of each run
+
+    :param arguments: CLI arguments
+    :type arguments: list(str)
+    :param repeat: Number of runs
+    :type repeat: int
+    :return: Wall time of each run in seconds
+    :rtype: list(float)
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", CLI] + arguments, check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return times
+
+def main():
+    """Run the benchmark and print the results"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20, help="Number of runs per command")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        commands = {
+            "--version": ["--version"],
+            "build": ["build", "-i", str(APPFILE), "-c", str(CONFIGFILE), "-o", str(Path(tempdir) / "app.img"),
+                      "-v", "warning"],
+        }
+        print(f"{'Command':>10} {'Min (ms)':>10} {'Median (ms)':>12}")
+        for name, arguments in commands.items():
+            # One warm-up run so the file system caches and the logging config cache are populated
+            time_cli(arguments, 1)
+            times = time_cli(arguments, args.repeat)
+            print(f"{name:>10} {min(times) * 1000:>10.1f} {statistics.median(times) * 1000:>12.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""
+Scaling benchmark suite for the image builders
+
+Generates synthetic hex files from 16 KiB to 16 MiB for every supported architecture
+and times each stage of the image pipeline on its own:
+
+- load: loading the hex file with load_hexfile
+- build: FirmwareImageBuilder.build
+- to_bytes: FirmwareImage.to_bytes
+- decode: FirmwareImage.from_bytes, including decoding every block
+- dump: the text dump of str(FirmwareImage)
+
+Each hex file has one segment starting at the flash start address, as the builders only
+include the segment that contains it. Dense files have random data in every page, sparse
+files have random data in one of SPARSE_INTERVAL pages and the erased pattern of the
+architecture in the others.
+
+The results are saved as JSON and a previous result file can be given to compare with.
+
+Usage:
+    python benchmarks/bench_suite.py [--arch ARCH ...] [--size BYTES ...] [--layout dense|sparse ...]
+                                     [--repeat N] [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from pyfwimagebuilder import __version__ as VERSION
+from pyfwimagebuilder.avrbuilder import AVR_ARCH_LIST
+from pyfwimagebuilder.builder import builder_factory
+from pyfwimagebuilder.decoder import bytes_per_address, fwimage_factory, image_block_factory
+from pyfwimagebuilder.hexfile import HexFile, load_hexfile
+from pyfwimagebuilder.mcu32builder import MCU32_ARCH_LIST
+
+ARCHITECTURES = AVR_ARCH_LIST + ["PIC16", "PIC18"] + MCU32_ARCH_LIST
+SIZES = [16 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024]
+LAYOUTS = ["dense", "sparse"]
+STAGES = ["load", "build", "to_bytes", "decode", "dump"]
+# One of this many pages has data in sparse hex files
+SPARSE_INTERVAL = 8
+FLASH_START = 0x1000
+
+# Write block size in bytes and erased flash pattern of each architecture family
+MCU8_WRITE_BLOCK_SIZE = 0x200
+PIC18_WRITE_BLOCK_SIZE = 0x100
+PIC16_WRITE_BLOCK_SIZE = 0x40
+MCU32_WRITE_BLOCK_SIZE = 0x40
+ERASED_BYTE = b"\xff"
+PIC16_ERASED_WORD = b"\xff\x3f"
+
+def write_block_size(architecture):
+    """Flash write block size of an architecture in bytes
+
+    :param architecture: Architecture, e.g. PIC18 or M0+
+    :type architecture: str
+    :return: Write block size in bytes
+    :rtype: int
+    """
+    if architecture == "PIC16":
+        return PIC16_WRITE_BLOCK_SIZE
+    if architecture == "PIC18":
+        return PIC18_WRITE_BLOCK_SIZE
+    if architecture in MCU32_ARCH_LIST:
+        return MCU32_WRITE_BLOCK_SIZE
+    return MCU8_WRITE_BLOCK_SIZE
+
+def make_config(architecture, size):
+    """Create a configuration with a flash range that fits a hex file of the given size
+
+    :param architecture: Architecture, e.g. PIC18 or M0+
+    :type architecture: str
+    :param size: Size of the hex file data in bytes
+    :type size: int
+    :return: Bootloader configuration
+    :rtype: dict
+    """
+    # The configuration of word addressed architectures uses word addresses
+    unit = bytes_per_address(architecture)
+    config = {
+        "IMAGE_FORMAT_VERSION": "1.0.0" if architecture in MCU32_ARCH_LIST else "0.3.0",
+        "DEVICE_ID": 0x1234,
+        "WRITE_BLOCK_SIZE": write_block_size(architecture) // unit,
+        "FLASH_START": FLASH_START // unit,
+        "FLASH_END": (FLASH_START + size) // unit,
+        "ARCH": architecture,
+    }
+    if architecture not in MCU32_ARCH_LIST:
+        config.update({"PAGE_ERASE_KEY": 0xAA55, "PAGE_WRITE_KEY": 0xAA55, "BYTE_WRITE_KEY": 0xAA55,
+                       "PAGE_READ_KEY": 0x0000})
+    return {"bootloader": config}
+
+def make_data(architecture, size, layout):
+    """Create the data of a synthetic hex file
+
+    :param architecture: Architecture, e.g. PIC18 or M0+
+    :type architecture: str
+    :param size: Size of the data in bytes
+    :type size: int
+    :param layout: "dense" or "sparse"
+    :type layout: str
+    :return: Data starting at FLASH_START
+    :rtype: bytes
+    """
+    # Seeded so that every run benchmarks the same data
+    rng = random.Random(size)
+    if layout == "dense":
+        return rng.getrandbits(size * 8).to_bytes(size, "little")
+    page_size = write_block_size(architecture)
+    erased = PIC16_ERASED_WORD if architecture == "PIC16" else ERASED_BYTE
+    data = bytearray(erased * (size // len(erased)))
+    for offset in range(0, size, page_size * SPARSE_INTERVAL):
+        length = min(page_size, size - offset)
+        data[offset:offset + length] = rng.getrandbits(length * 8).to_bytes(length, "little")
+    return bytes(data)
+
+def best_time(function, repeat):
+    """Run a function repeatedly and return the shortest run time and the last result
+
+    :param function: Function to time
+    :type function: callable
+    :param repeat: Number of runs
+    :type repeat: int
+    :return: Shortest run time in seconds and the result of the function
+    :rtype: tuple(float, object)
+    """
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def run_case(architecture, size, layout, repeat, hexfilename):
+    """Time each stage of the image pipeline for one synthetic hex file
+
+    :param architecture: Architecture, e.g. PIC18 or M0+
+    :type architecture: str
+    :param size: Size of the hex file data in bytes
+    :type size: int
+    :param layout: "dense" or "sparse"
+    :type layout: str
+    :param repeat: Number of runs per stage
+    :type repeat: int
+    :param hexfilename: Path to write the synthetic hex file to
+    :type hexfilename: pathlib.Path
+    :return: Shortest time of each stage in seconds
+    :rtype: dict(str, float)
+    """
+    with hexfilename.open("w", encoding="ascii") as hex_output:
+        HexFile.fromdata([(FLASH_START, make_data(architecture, size, layout))]).write_hex(hex_output)
+    config = make_config(architecture, size)
+    builder = builder_factory(architecture, config)
+    firmware_image = fwimage_factory(architecture, config)
+    image_block = image_block_factory(architecture, config)
+
+    times = {}
+    times["load"], hexfile = best_time(lambda: load_hexfile(hexfilename), repeat)
+    times["build"], image = best_time(lambda: builder.build(hexfile), repeat)
+    times["to_bytes"], data = best_time(image.to_bytes, repeat)
+    data = bytes(data)
+    times["decode"], _ = best_time(lambda: list(firmware_image.from_bytes(image_block, data).blocks), repeat)
+    times["dump"], _ = best_time(lambda: str(image), repeat)
+    return times
+
+def compare(results, baseline):
+    """Print the ratio of each time to the same case in a baseline result
+
+    :param results: Benchmark results
+    :type results: list(dict)
+    :param baseline: Baseline benchmark results
+    :type baseline: list(dict)
+    """
+    baseline_times = {(entry["arch"], entry["size"], entry["layout"], entry["stage"]): entry["seconds"]
+                      for entry in baseline}
+    print(f"\n{'Arch':>8} {'Size':>10} {'Layout':>7} {'Stage':>9} {'Baseline (s)':>13} {'Now (s)':>10} {'Ratio':>7}")
+    for entry in results:
+        key = (entry["arch"], entry["size"], entry["layout"], entry["stage"])
+        if key not in baseline_times:
+            continue
+        ratio = entry["seconds"] / baseline_times[key] if baseline_times[key] else float("inf")
+        print(f"{entry['arch']:>8} {entry['size']:>10} {entry['layout']:>7} {entry['stage']:>9} "
+              f"{baseline_times[key]:>13.4f} {entry['seconds']:>10.4f} {ratio:>7.2f}")
+
+def main():
+    """Run the benchmark suite and print and save the results"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--arch", nargs="+", choices=ARCHITECTURES, default=ARCHITECTURES,
+                        help="Architectures to benchmark")
+    parser.add_argument("--size", nargs="+", type=int, default=SIZES, help="Hex file data sizes in bytes")
+    parser.add_argument("--layout", nargs="+", choices=LAYOUTS, default=LAYOUTS, help="Hex file layouts")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs per stage, the best run is reported")
+    parser.add_argument("--output", metavar="results.json", help="Save the results to a JSON file")
+    parser.add_argument("--compare", metavar="baseline.json", help="Compare with the results of a previous run")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'Arch':>8} {'Size':>10} {'Layout':>7} " + " ".join(f"{stage + ' (s)':>12}" for stage in STAGES))
+    with tempfile.TemporaryDirectory() as tempdir:
+        hexfilename = Path(tempdir) / "synthetic.hex"
+        for architecture in args.arch:
+            for size in args.size:
+                for layout in args.layout:
+                    times = run_case(architecture, size, layout, args.repeat, hexfilename)
+                    print(f"{architecture:>8} {size:>10} {layout:>7} " +
+                          " ".join(f"{times[stage]:>12.4f}" for stage in STAGES))
+                    results.extend({"arch": architecture, "size": size, "layout": layout, "stage": stage,
+                                    "seconds": times[stage]} for stage in STAGES)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump({"version": VERSION, "python": sys.version.split()[0], "platform": platform.platform(),
+                       "repeat": args.repeat, "results": results}, output, indent=2)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as baseline:
+            compare(results, json.load(baseline)["results"])
+
+if __name__ == "__main__":
+    main()
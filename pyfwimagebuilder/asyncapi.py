@@ -0,0 +1,130 @@
+"""
+asyncio API for building and decoding images
+
+The coroutines do not block the event loop. Files are read and written in the default
+executor of the event loop, and the CPU heavy stages (hex file parsing, image building,
+serialization and decoding) run in the executor given by the caller, e.g. a
+ProcessPoolExecutor to use several CPUs:
+
+    with ProcessPoolExecutor() as executor:
+        image = await build_async("app.hex", "config.toml", "app.img", executor=executor, timeout=30)
+
+Hex file parsing and building are separate executor calls, so a cancelled or timed out
+build stops before the image is built. A stage that is already running in an executor
+finishes, but its result is discarded. The image is serialized in the same call as it is
+built, as the blocks of a built image refer to the hex file data and cannot be sent back
+from a worker process.
+"""
+import asyncio
+from pathlib import Path
+
+import toml
+
+from .builder import builder_factory
+from .decoder import fwimage_factory, image_block_factory
+from .hexfile import parse_hexdata
+
+def _build_image(hexfile, config_text, include_empty_blocks):
+    """Build the image data from a parsed hex file and the contents of a configuration file
+
+    This can run in worker processes so it must be a module level function.
+
+    :param hexfile: Parsed hex file
+    :type hexfile: HexFile | intelhex.IntelHex
+    :param config_text: Contents of the configuration TOML file
+    :type config_text: str
+    :param include_empty_blocks: Include empty memory blocks in image
+    :type include_empty_blocks: bool
+    :return: Image data
+    :rtype: bytes
+    """
+    bootloader_config = toml.loads(config_text)
+    builder = builder_factory(bootloader_config['bootloader']['ARCH'], bootloader_config)
+    image = builder.build(hexfile, include_empty_blocks=include_empty_blocks)
+    return bytes(image.to_bytes())
+
+def _decode_image(image_data, config_text):
+    """Decode image data
+
+    This can run in worker processes so it must be a module level function.
+
+    :param image_data: Image data
+    :type image_data: bytes
+    :param config_text: Contents of the configuration TOML file
+    :type config_text: str
+    :return: Decoded firmware image
+    :rtype: FirmwareImage
+    """
+    bootloader_config = toml.loads(config_text)
+    architecture = bootloader_config['bootloader']['ARCH']
+    firmware_image = fwimage_factory(architecture, bootloader_config)
+    return firmware_image.from_bytes(image_block_factory(architecture, bootloader_config), image_data)
+
+async def _read_files(*filenames):
+    """Read files without blocking the event loop
+
+    :return: Contents of the files
+    :rtype: list(bytes)
+    """
+    loop = asyncio.get_running_loop()
+    return await asyncio.gather(*(loop.run_in_executor(None, Path(filename).read_bytes)
+                                  for filename in filenames))
+
+async def _build(input_filename, config_filename, output_filename, include_empty_blocks, executor):
+    """Build an image, see build_async"""
+    hex_data, config_data = await _read_files(input_filename, config_filename)
+    loop = asyncio.get_running_loop()
+    hexfile = await loop.run_in_executor(executor, parse_hexdata, hex_data)
+    data = await loop.run_in_executor(executor, _build_image, hexfile, config_data.decode("utf-8"),
+                                      include_empty_blocks)
+    if output_filename:
+        await loop.run_in_executor(None, Path(output_filename).write_bytes, data)
+    return data
+
+async def _decode(input_filename, config_filename, executor):
+    """Decode an image, see decode_async"""
+    image_data, config_data = await _read_files(input_filename, config_filename)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, _decode_image, image_data, config_data.decode("utf-8"))
+
+# pylint: disable-next=too-many-arguments,too-many-positional-arguments
+async def build_async(input_filename, config_filename, output_filename=None, include_empty_blocks=False,
+                      executor=None, timeout=None):
+    """Build a firmware image without blocking the event loop
+
+    :param input_filename: Path to hexfile to build the image from
+    :type input_filename: str
+    :param config_filename: Path to configuration TOML file
+    :type config_filename: str
+    :param output_filename: Image file name, defaults to None (image is only returned)
+    :type output_filename: str, optional
+    :param include_empty_blocks: Defines if empty blocks should be included, defaults to False
+    :type include_empty_blocks: bool, optional
+    :param executor: Executor for building the image, defaults to None (the default executor of the event loop)
+    :type executor: concurrent.futures.Executor, optional
+    :param timeout: Maximum time in seconds, defaults to None (no timeout)
+    :type timeout: float, optional
+    :return: Image data
+    :rtype: bytes
+    :raises asyncio.TimeoutError: If the build takes longer than the timeout
+    """
+    return await asyncio.wait_for(_build(input_filename, config_filename, output_filename, include_empty_blocks,
+                                         executor), timeout)
+
+async def decode_async(input_filename, config_filename, executor=None, timeout=None):
+    """Decode a firmware image without blocking the event loop
+
+    :param input_filename: Path to the image file
+    :type input_filename: str
+    :param config_filename: Path to configuration TOML file
+    :type config_filename: str
+    :param executor: Executor for decoding the image, defaults to None (the default executor of the event loop)
+    :type executor: concurrent.futures.Executor, optional
+    :param timeout: Maximum time in seconds, defaults to None (no timeout)
+    :type timeout: float, optional
+    :return: Decoded firmware image
+    :rtype: FirmwareImage
+    :raises asyncio.TimeoutError: If decoding takes longer than the timeout
+    :raises ImageDecodingError: For image decoding errors
+    """
+    return await asyncio.wait_for(_decode(input_filename, config_filename, executor), timeout)
@@ -0,0 +1,162 @@
+"""
+Batch building of firmware images
+
+Builds all images listed in a manifest file, optionally spread over several worker
+processes. The manifest is a TOML file with one [[image]] table per image:
+
+    [[image]]
+    input = "app.hex"
+    config = "bootloader_config.toml"
+    output = "app.img"
+    # Optional human readable dump of the image
+    dump = "app.txt"
+
+Relative paths are relative to the directory of the manifest file.
+"""
+import time
+from logging import getLogger
+from pathlib import Path
+import toml
+
+from .builder import build_with_config, load_config
+
+class BatchItem:
+    """Image to build in a batch
+
+    :param input_filename: Path to hexfile to build the image from
+    :type input_filename: str
+    :param config_filename: Path to configuration TOML file
+    :type config_filename: str
+    :param output_filename: Image file name
+    :type output_filename: str
+    :param dump_filename: Filename for a hexdump of the image, defaults to None
+    :type dump_filename: str, optional
+    """
+    def __init__(self, input_filename, config_filename, output_filename, dump_filename=None):
+        self.input_filename = input_filename
+        self.config_filename = config_filename
+        self.output_filename = output_filename
+        self.dump_filename = dump_filename
+
+class BatchResult:
+    """Result of building one image in a batch
+
+    :param item: Image that was built
+    :type item: BatchItem
+    :param elapsed: Build time in seconds
+    :type elapsed: float
+    :param error: Error description if the build failed, defaults to None
+    :type error: str, optional
+    """
+    def __init__(self, item, elapsed, error=None):
+        self.item = item
+        self.elapsed = elapsed
+        self.error = error
+
+    @property
+    def ok(self):
+        """Build status
+
+        :return: True if the image was built successfully
+        :rtype: bool
+        """
+        return self.error is None
+
+def load_manifest(manifest_filename):
+    """Load a batch manifest
+
+    :param manifest_filename: Path to the manifest TOML file
+    :type manifest_filename: str
+    :return: Images to build
+    :rtype: list(BatchItem)
+    :raises ValueError: If an image entry is missing a required key
+    """
+    manifest_dir = Path(manifest_filename).parent
+    manifest = toml.load(manifest_filename)
+    items = []
+    for index, entry in enumerate(manifest.get('image', [])):
+        missing = [key for key in ('input', 'config', 'output') if key not in entry]
+        if missing:
+            raise ValueError(f"Image entry {index} in '{manifest_filename}' is missing {', '.join(missing)}")
+        dump = entry.get('dump')
+        items.append(BatchItem(str(manifest_dir / entry['input']),
+                               str(manifest_dir / entry['config']),
+                               str(manifest_dir / entry['output']),
+                               str(manifest_dir / dump) if dump else None))
+    return items
+
+def _build_item(item, bootloader_config, include_empty_blocks, engine, cache_dir):
+    """Build one image, capturing any error
+
+    This runs in the worker processes so it must be a module level function.
+
+    :return: Build result
+    :rtype: BatchResult
+    """
+    start = time.perf_counter()
+    try:
+        build_with_config(item.input_filename, bootloader_config, item.output_filename, item.dump_filename,
+                          include_empty_blocks, engine, cache_dir)
+    except Exception as exc: # pylint: disable=broad-exception-caught
+        return BatchResult(item, time.perf_counter() - start, f"{type(exc).__name__}: {exc}")
+    return BatchResult(item, time.perf_counter() - start)
+
+def run_batch(items, jobs=None, include_empty_blocks=False, engine="python", cache_dir=None):
+    """Build a batch of images
+
+    Each configuration file is loaded once and shared by all images using it. A failing image
+    does not stop the batch, its error is reported in the result.
+
+    :param items: Images to build
+    :type items: list(BatchItem)
+    :param jobs: Number of worker processes, defaults to the number of CPUs. With 1 the images
+        are built in the calling process.
+    :type jobs: int, optional
+    :param include_empty_blocks: Defines if empty blocks should be included, defaults to False
+    :type include_empty_blocks: bool, optional
+    :param engine: Build engine, "python" or "numpy", defaults to "python"
+    :type engine: str, optional
+    :param cache_dir: Build cache directory, defaults to None (no caching)
+    :type cache_dir: str, optional
+    :return: Build results in the same order as the items
+    :rtype: list(BatchResult)
+    """
+    logger = getLogger(__name__)
+    configs = {}
+    config_errors = {}
+    for item in items:
+        if item.config_filename in configs or item.config_filename in config_errors:
+            continue
+        try:
+            configs[item.config_filename] = load_config(item.config_filename)
+        except Exception as exc: # pylint: disable=broad-exception-caught
+            config_errors[item.config_filename] = f"{type(exc).__name__}: {exc}"
+
+    results = [None] * len(items)
+    pending = []
+    for index, item in enumerate(items):
+        if item.config_filename in config_errors:
+            results[index] = BatchResult(item, 0.0, config_errors[item.config_filename])
+        else:
+            pending.append(index)
+
+    logger.debug("Building %d images with %s jobs", len(pending), jobs if jobs else "default number of")
+    if jobs == 1:
+        for index in pending:
+            item = items[index]
+            results[index] = _build_item(item, configs[item.config_filename], include_empty_blocks, engine,
+                                         cache_dir)
+    else:
+        from concurrent.futures import ProcessPoolExecutor # pylint: disable=import-outside-toplevel
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {index: executor.submit(_build_item, items[index], configs[items[index].config_filename],
+                                              include_empty_blocks, engine, cache_dir)
+                       for index in pending}
+            for index, future in futures.items():
+                # A worker dying (e.g. out of memory) breaks the pool and fails the remaining futures,
+                # report it for each affected image instead of aborting the batch
+                try:
+                    results[index] = future.result()
+                except Exception as exc: # pylint: disable=broad-exception-caught
+                    results[index] = BatchResult(items[index], 0.0, f"{type(exc).__name__}: {exc}")
+    return results
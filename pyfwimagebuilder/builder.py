@@ -2,14 +2,13 @@
 Main Builder Algorithm
 """
 from logging import getLogger
-import toml
-from intelhex import IntelHex
 
-from .mcu8builder import Mcu8FirmwareImage
-from .pic18builder import FirmwareImagebuilderPic18
-from .pic16builder import FirmwareImagebuilderPic16
-from .avrbuilder import FirmwareImagebuilderAVR, AVR_ARCH_LIST
-from .mcu32builder import FirmwareImageBuilderMcu32, Mcu32FirmwareImage, MCU32_ARCH_LIST
+from .hexfile import load_hexfile
+from .profiling import profile_phase
+
+# The architecture modules, the decoder, the build cache and toml are imported where they are
+# needed, so that importing the builder stays cheap for the CLI.
+# pylint: disable=import-outside-toplevel
 
 def firmware_image_factory(architecture: str):
     """Retrieve the required firmware image class
@@ -21,6 +20,9 @@ def firmware_image_factory(architecture: str):
     :return: FirmwareImage instance
     :rtype: Instance of FirmwareImage subclass
     """
+    from .mcu8builder import Mcu8FirmwareImage
+    from .avrbuilder import AVR_ARCH_LIST
+    from .mcu32builder import Mcu32FirmwareImage, MCU32_ARCH_LIST
     fwimage = None
     if architecture in ["PIC18", "PIC16"] or architecture in AVR_ARCH_LIST:
         fwimage = Mcu8FirmwareImage
@@ -41,6 +43,10 @@ def builder_factory(architecture: str, config):
     :return: Image builder instance
     :rtype: Instance of ImageBuilder subclass
     """
+    from .pic18builder import FirmwareImagebuilderPic18
+    from .pic16builder import FirmwareImagebuilderPic16
+    from .avrbuilder import FirmwareImagebuilderAVR, AVR_ARCH_LIST
+    from .mcu32builder import FirmwareImageBuilderMcu32, MCU32_ARCH_LIST
     version = config['bootloader']['IMAGE_FORMAT_VERSION']
     if architecture == "PIC18":
         builder = FirmwareImagebuilderPic18
@@ -59,7 +65,43 @@ def builder_factory(architecture: str, config):
     firmware_image_cls = firmware_image_factory(architecture)
     return builder(config, firmware_image_cls)
 
-def build(input_filename, config_filename, output_filename, hexdump_filename=None, include_empty_blocks=False):
+def load_config(config_filename):
+    """Load a bootloader configuration file
+
+    :param config_filename: Path to configuration TOML file
+    :type config_filename: str
+    :return: Bootloader configuration
+    :rtype: dict
+    """
+    import toml
+    logger = getLogger(__name__)
+    # Read in config which was generated when this bootloader was built
+    logger.debug("Loading bootloader config from %s", config_filename)
+    return toml.load(config_filename)
+
+def load_image(image_filename, bootloader_config):
+    """Load a previously built firmware image
+
+    :param image_filename: Image file name
+    :type image_filename: str
+    :param bootloader_config: Bootloader configuration the image was built with
+    :type bootloader_config: dict
+    :return: Decoded firmware image
+    :rtype: FirmwareImage
+    :raises ImageDecodingError: For image decoding errors.
+    """
+    from .decoder import fwimage_factory, image_block_factory
+    architecture = bootloader_config['bootloader']['ARCH']
+    firmware_image = fwimage_factory(architecture, bootloader_config)
+    image_block = image_block_factory(architecture, bootloader_config)
+    with open(image_filename, "rb") as image_file:
+        data = image_file.read()
+    return firmware_image.from_bytes(image_block, data)
+
+# pylint: disable=too-many-arguments,too-many-positional-arguments
+def build(input_filename, config_filename, output_filename, hexdump_filename=None, include_empty_blocks=False,
+          engine="python", cache_dir=None, previous_filename=None, baseline_filename=None, manifest_filename=None,
+          profiler=None):
     """Builds and saves a firmware image
 
     :param input_filename: Path to hexfile to build the image from
@@ -72,29 +114,127 @@ def build(input_filename, config_filename, output_filename, hexdump_filename=Non
     :type hexdump_filename: str, optional
     :param include_empty_blocks: Defines if empty blocks should be included, defaults to False
     :type include_empty_blocks: bool, optional
+    :param engine: Build engine used when streaming the image, "python" or "numpy", defaults to "python".
+        Only the python engine supports a hexdump, previous or baseline image.
+    :type engine: str, optional
+    :param cache_dir: Build cache directory, defaults to None (no caching)
+    :type cache_dir: str, optional
+    :param previous_filename: Previously built image to reuse unchanged blocks from, defaults to None
+    :type previous_filename: str, optional
+    :param baseline_filename: Image already on the device, only blocks that differ from it are included
+        in the output image, defaults to None
+    :type baseline_filename: str, optional
+    :param manifest_filename: Filename for a JSON manifest with the digests of the image, defaults to None
+    :type manifest_filename: str, optional
+    :param profiler: Profiler recording the build phases, defaults to None (no profiling)
+    :type profiler: pyfwimagebuilder.profiling.PhaseProfiler, optional
+    """
+    with profile_phase(profiler, "load config"):
+        bootloader_config = load_config(config_filename)
+    build_with_config(input_filename, bootloader_config, output_filename, hexdump_filename, include_empty_blocks,
+                      engine, cache_dir, previous_filename, baseline_filename, manifest_filename, profiler)
+
+# pylint: disable=too-many-arguments,too-many-positional-arguments
+def build_with_config(input_filename, bootloader_config, output_filename, hexdump_filename=None,
+                      include_empty_blocks=False, engine="python", cache_dir=None, previous_filename=None,
+                      baseline_filename=None, manifest_filename=None, profiler=None, builder=None):
+    """Builds and saves a firmware image for an already loaded configuration
+
+    :param input_filename: Path to hexfile to build the image from
+    :type input_filename: str
+    :param bootloader_config: Bootloader configuration
+    :type bootloader_config: dict
+    :param output_filename: Image file name
+    :type output_filename: str
+    :param hexdump_filename: Filename for a hexdump of the image, defaults to None
+    :type hexdump_filename: str, optional
+    :param include_empty_blocks: Defines if empty blocks should be included, defaults to False
+    :type include_empty_blocks: bool, optional
+    :param engine: Build engine used when streaming the image, "python" or "numpy", defaults to "python".
+        Only the python engine supports a hexdump, previous or baseline image.
+    :type engine: str, optional
+    :param cache_dir: Build cache directory, defaults to None (no caching)
+    :type cache_dir: str, optional
+    :param previous_filename: Previously built image to reuse unchanged blocks from, defaults to None
+    :type previous_filename: str, optional
+    :param baseline_filename: Image already on the device, only blocks that differ from it are included
+        in the output image, defaults to None
+    :type baseline_filename: str, optional
+    :param manifest_filename: Filename for a JSON manifest with the digests of the image, computed while
+        the image is written, defaults to None
+    :type manifest_filename: str, optional
+    :param profiler: Profiler recording the build phases, defaults to None (no profiling)
+    :type profiler: pyfwimagebuilder.profiling.PhaseProfiler, optional
+    :param builder: Image builder for the configuration, defaults to None (created from the configuration)
+    :type builder: FirmwareImageBuilder, optional
+    :raises ValueError: If the numpy engine is combined with a hexdump, previous or baseline image
     """
     logger = getLogger(__name__)
+    if engine != "python" and (hexdump_filename or previous_filename or baseline_filename):
+        raise ValueError(f"The {engine} engine can not be used together with a dump, previous or baseline image")
+    # The manifest describes the image file so it is only written together with it
+    artifacts = {"img": output_filename, "txt": hexdump_filename,
+                 "json": manifest_filename if output_filename else None}
+    artifacts = {artifact: filename for artifact, filename in artifacts.items() if filename}
+    cache = None
+    # A delta image depends on the baseline image which is not part of the cache key
+    if cache_dir and artifacts and not baseline_filename:
+        from .cache import BuildCache
+        cache = BuildCache(cache_dir)
+        with profile_phase(profiler, "cache lookup"):
+            with open(input_filename, "rb") as hex_input:
+                cache_key = cache.key(hex_input.read(), bootloader_config, include_empty_blocks)
+            cache_hit = cache.fetch(cache_key, artifacts)
+        if cache_hit:
+            logger.info("Image for '%s' retrieved from build cache", input_filename)
+            return
+
     # Read in hex file for conversion
-    hexfile = IntelHex()
-    hexfile.fromfile(input_filename, format='hex')
+    with profile_phase(profiler, "load hex"):
+        hexfile = load_hexfile(input_filename)
 
-    # Read in config which was generated when this bootloader was built
-    logger.debug("Loading bootloader config from %s", config_filename)
-    bootloader_config = toml.load(config_filename)
+    if builder is None:
+        # Find out which architecture is used
+        architecture = bootloader_config['bootloader']['ARCH']
+        builder = builder_factory(architecture, bootloader_config)
+    digest = None
+    if manifest_filename and output_filename:
+        from .digest import ImageDigest
+        digest = ImageDigest()
 
-    # Find out which architecture is used
-    architecture = bootloader_config['bootloader']['ARCH']
-    builder = builder_factory(architecture, bootloader_config)
-    image = builder.build(hexfile, include_empty_blocks=include_empty_blocks)
+    if hexdump_filename or previous_filename or baseline_filename:
+        # The human readable dump, the incremental and the delta build need the complete image
+        with profile_phase(profiler, "build"):
+            if baseline_filename:
+                baseline_image = load_image(baseline_filename, bootloader_config)
+                image = builder.build_delta(hexfile, baseline_image, include_empty_blocks=include_empty_blocks)
+            elif previous_filename:
+                previous_image = load_image(previous_filename, bootloader_config)
+                image = builder.build_incremental(hexfile, previous_image,
+                                                  include_empty_blocks=include_empty_blocks)
+            else:
+                image = builder.build(hexfile, include_empty_blocks=include_empty_blocks)
+        if output_filename:
+            with profile_phase(profiler, "write image"), open(output_filename, "wb") as outfile:
+                image.write(outfile, digest)
+            logger.info("Image written to '%s'", output_filename)
 
-    # Save to target image file
-    if output_filename:
-        with open(output_filename, "wb") as outfile:
-            outfile.write(image.to_bytes())
+        if hexdump_filename:
+            with profile_phase(profiler, "dump"), open(hexdump_filename, "w", encoding="utf-8") as dumpfile:
+                image.dump(dumpfile)
+            logger.info("Ascii version of image written to '%s'", hexdump_filename)
+    elif output_filename:
+        # Stream the blocks directly to the target image file
+        with profile_phase(profiler, "build and write image"), open(output_filename, "wb") as outfile:
+            builder.build_to_stream(hexfile, outfile, include_empty_blocks=include_empty_blocks, engine=engine,
+                                    digest=digest)
         logger.info("Image written to '%s'", output_filename)
 
-    # Return human readable form for display
-    if hexdump_filename:
-        with open(hexdump_filename, "w", encoding="utf-8") as dumpfile:
-            dumpfile.write(str(image))
-        logger.info("Ascii version of image written to '%s'", hexdump_filename)
+    if digest is not None:
+        with profile_phase(profiler, "write manifest"):
+            digest.write_manifest(manifest_filename)
+        logger.info("Image manifest written to '%s'", manifest_filename)
+
+    if cache:
+        with profile_phase(profiler, "cache store"):
+            cache.store(cache_key, artifacts)
@@ -0,0 +1,126 @@
+"""
+Content addressed cache for built images
+
+Images are stored under a key derived from everything that affects the build output:
+the hex file content, the bootloader configuration, the image format version, the
+empty block setting and the pyfwimagebuilder version. Each cache entry holds one file
+per artifact (the image and optionally its text dump and digest manifest). The least recently used entries
+are evicted when the total cache size exceeds its limit.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from logging import getLogger
+from pathlib import Path
+
+from . import __version__ as VERSION
+
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+class BuildCache:
+    """On-disk build cache
+
+    :param cache_dir: Directory to keep the cache entries in, created if it does not exist
+    :type cache_dir: str | pathlib.Path
+    :param max_size: Maximum total size of the cache in bytes, defaults to DEFAULT_MAX_SIZE
+    :type max_size: int, optional
+    """
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_SIZE):
+        self.logger = getLogger(__name__)
+        self.cache_dir = Path(cache_dir)
+        self.max_size = max_size
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(hex_data, bootloader_config, include_empty_blocks):
+        """Create the cache key of a build
+
+        :param hex_data: Content of the hex file
+        :type hex_data: bytes
+        :param bootloader_config: Bootloader configuration
+        :type bootloader_config: dict
+        :param include_empty_blocks: Defines if empty blocks are included
+        :type include_empty_blocks: bool
+        :return: Cache key
+        :rtype: str
+        """
+        digest = hashlib.sha256()
+        digest.update(hashlib.sha256(hex_data).digest())
+        # Normalize the configuration so formatting and ordering of the TOML file do not matter
+        digest.update(json.dumps(bootloader_config, sort_keys=True, default=str).encode())
+        digest.update(str(bootloader_config['bootloader']['IMAGE_FORMAT_VERSION']).encode())
+        digest.update(b"\x01" if include_empty_blocks else b"\x00")
+        digest.update(VERSION.encode())
+        return digest.hexdigest()
+
+    def _entry_path(self, key, artifact):
+        return self.cache_dir / f"{key}.{artifact}"
+
+    def fetch(self, key, artifacts):
+        """Copy the artifacts of a cache entry to their target files
+
+        :param key: Cache key
+        :type key: str
+        :param artifacts: Target file name for each requested artifact, e.g. {"img": "app.img"}
+        :type artifacts: dict(str, str)
+        :return: True on a cache hit, False if any of the artifacts is not in the cache
+        :rtype: bool
+        """
+        paths = {artifact: self._entry_path(key, artifact) for artifact in artifacts}
+        if not all(path.exists() for path in paths.values()):
+            self.logger.debug("Build cache miss for %s", key)
+            return False
+        try:
+            for artifact, target in artifacts.items():
+                shutil.copyfile(paths[artifact], target)
+                # Update the modification time to mark the entry as recently used
+                os.utime(paths[artifact])
+        except FileNotFoundError:
+            # Evicted by another process in the meantime
+            self.logger.debug("Build cache entry %s evicted while reading", key)
+            return False
+        self.logger.debug("Build cache hit for %s", key)
+        return True
+
+    def store(self, key, artifacts):
+        """Store build artifacts in the cache
+
+        :param key: Cache key
+        :type key: str
+        :param artifacts: Source file name for each artifact, e.g. {"img": "app.img"}
+        :type artifacts: dict(str, str)
+        """
+        for artifact, source in artifacts.items():
+            # Copy to a temporary file first so other processes never see a partial entry
+            handle, temp_name = tempfile.mkstemp(dir=self.cache_dir, prefix=f".{key}.")
+            os.close(handle)
+            try:
+                shutil.copyfile(source, temp_name)
+                os.replace(temp_name, self._entry_path(key, artifact))
+            except BaseException:
+                os.unlink(temp_name)
+                raise
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits within its size limit
+        """
+        entries = {}
+        for path in self.cache_dir.iterdir():
+            if path.name.startswith(".") or not path.is_file():
+                continue
+            key = path.name.split(".", 1)[0]
+            stat = path.stat()
+            size, last_used = entries.get(key, (0, 0))
+            entries[key] = (size + stat.st_size, max(last_used, stat.st_mtime))
+
+        total_size = sum(size for size, _ in entries.values())
+        for key, (size, _) in sorted(entries.items(), key=lambda entry: entry[1][1]):
+            if total_size <= self.max_size:
+                break
+            self.logger.debug("Evicting build cache entry %s", key)
+            for path in self.cache_dir.glob(f"{key}.*"):
+                path.unlink(missing_ok=True)
+            total_size -= size
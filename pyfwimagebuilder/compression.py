@@ -0,0 +1,89 @@
+"""
+Run-length compression of flash page payloads
+
+The stream format is PackBits, which is simple enough to be expanded by a bootloader
+without any buffer besides the flash page itself. The stream is a sequence of packets,
+each starting with a control byte n:
+
+- 0x00 - 0x7F: the next n + 1 bytes are copied literally
+- 0x81 - 0xFF: the next byte is repeated 257 - n times (2 - 128 times)
+- 0x80: not used
+"""
+import re
+
+# Longest literal and repeat run of a single packet
+MAX_PACKET_LENGTH = 128
+# Shorter runs are cheaper to store as part of a literal packet
+MIN_RUN_LENGTH = 3
+
+_RUN_PATTERN = re.compile(rb"(.)\1{%d,}" % (MIN_RUN_LENGTH - 1), re.DOTALL)
+
+def _literal_packets(data, packets):
+    """Append literal packets for data to the packet list"""
+    for offset in range(0, len(data), MAX_PACKET_LENGTH):
+        chunk = data[offset:offset + MAX_PACKET_LENGTH]
+        packets.append(bytes([len(chunk) - 1]))
+        packets.append(chunk)
+
+def compress(data):
+    """Compress data
+
+    :param data: Data to compress
+    :type data: bytes|memoryview
+    :return: Compressed data stream
+    :rtype: bytes
+    """
+    data = bytes(data)
+    packets = []
+    literal_start = 0
+    for run in _RUN_PATTERN.finditer(data):
+        _literal_packets(data[literal_start:run.start()], packets)
+        value = data[run.start()]
+        remaining = run.end() - run.start()
+        while remaining:
+            count = min(remaining, MAX_PACKET_LENGTH)
+            if count == 1:
+                # A single byte left over from a long run
+                packets.append(bytes([0, value]))
+            else:
+                packets.append(bytes([257 - count, value]))
+            remaining -= count
+        literal_start = run.end()
+    _literal_packets(data[literal_start:], packets)
+    return b"".join(packets)
+
+def decompress(data, length):
+    """Expand a compressed data stream
+
+    :param data: Compressed data stream
+    :type data: bytes|memoryview
+    :param length: Expected length of the expanded data
+    :type length: int
+    :return: Expanded data
+    :rtype: bytes
+    :raises ValueError: If the stream is corrupt or does not expand to the expected length
+    """
+    data = bytes(data)
+    expanded = bytearray()
+    offset = 0
+    while offset < len(data):
+        control = data[offset]
+        offset += 1
+        if control < 0x80:
+            count = control + 1
+            if offset + count > len(data):
+                raise ValueError("Compressed data ends inside a literal packet")
+            expanded += data[offset:offset + count]
+            offset += count
+        elif control > 0x80:
+            if offset >= len(data):
+                raise ValueError("Compressed data ends inside a repeat packet")
+            expanded += data[offset:offset + 1] * (257 - control)
+            offset += 1
+        else:
+            raise ValueError("Invalid control byte 0x80 in compressed data")
+        if len(expanded) > length:
+            break
+    if len(expanded) != length:
+        raise ValueError(f"Compressed data expands to {len(expanded)} bytes, expected {length}")
+    return bytes(expanded)
@@ -0,0 +1,356 @@
+"""
+Image building daemon
+
+pyfwimagebuilder serve runs a server on localhost that builds, decodes and verifies images
+for the build, decode and verify actions started with --daemon. The daemon keeps the
+interpreter, the imported modules and the parsed configuration files with their builders
+in memory, so each job only pays for the work on the image itself. Configurations are
+cached by path and modification time, so an edited configuration file is loaded again.
+
+The client posts the arguments of the action as JSON to /<action>, with all paths made
+absolute. The response is one JSON record per line: the standard output of the job in
+records that are sent while the job runs, so a decoded image is never held in memory,
+followed by the status and the messages of the job:
+
+    POST /decode {"input": "/work/app.img", "config": "/work/config.toml", "output": null, ...}
+    {"stdout": "Block size: 0x0210 (528)\nBlock type: METADATA (0x1)\n..."}
+    {"status": 0, "info": [], "errors": []}
+
+The server only listens on the loopback interface. Jobs read and write any file the user
+can access, so the daemon only runs jobs of clients that can read its token: a random
+token written to a file in TOKEN_DIRECTORY that only the user can read, and sent by the
+client in the X-Daemon-Token header. Requests with another content type than JSON or
+another Host header than the loopback address and port of the daemon are rejected too,
+so web pages cannot post jobs with simple cross-origin requests or DNS rebinding. Jobs run
+concurrently in server threads.
+"""
+import argparse
+import hmac
+import http.client
+import json
+import os
+import secrets
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging import getLogger
+from pathlib import Path
+
+from .builder import build_with_config, builder_factory, load_config
+from .decoder import decode_lazy_with_config
+from .hexfile import load_hexfile
+from .status_codes import STATUS_SUCCESS, STATUS_FAILURE
+
+DAEMON_HOST = "127.0.0.1"
+DEFAULT_PORT = 47810
+# Directory for the token files of the daemons, one file per port
+TOKEN_DIRECTORY = Path.home() / ".pyfwimagebuilder"
+TOKEN_HEADER = "X-Daemon-Token"
+
+# Path and value arguments that the client forwards for each action
+JOB_ARGUMENTS = {
+    "build": (("input", "config", "output", "dump", "manifest", "cache_dir", "previous", "baseline"),
+              ("include_empty_blocks", "engine")),
+    "decode": (("input", "config", "output", "to_hex", "to_bin"), ("format", "hash", "base")),
+    "verify": (("input", "hex", "config"), ("jobs",)),
+}
+
+logger = getLogger(__name__)
+
+def _write_record(wfile, record):
+    """Write a JSON record line to a response
+
+    :param wfile: Response stream
+    :type wfile: io.BufferedIOBase
+    :param record: Record to write
+    :type record: dict
+    """
+    wfile.write(json.dumps(record).encode("utf-8") + b"\n")
+
+class _StdoutRecords:
+    """Text stream that sends the standard output of a job to the client in stdout records
+
+    :param wfile: Response stream
+    :type wfile: io.BufferedIOBase
+    """
+    # Number of characters collected before they are sent
+    BUFFER_SIZE = 64 * 1024
+
+    def __init__(self, wfile):
+        self._wfile = wfile
+        self._buffer = []
+        self._size = 0
+
+    def write(self, text):
+        """Write text, sending it when the buffer is full
+
+        :param text: Text to write
+        :type text: str
+        :return: Number of characters written
+        :rtype: int
+        """
+        self._buffer.append(text)
+        self._size += len(text)
+        if self._size >= self.BUFFER_SIZE:
+            self.flush()
+        return len(text)
+
+    def writelines(self, lines):
+        """Write lines of text
+
+        :param lines: Text lines, including the line endings
+        :type lines: Iterable[str]
+        """
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        """Send the buffered text"""
+        if self._buffer:
+            _write_record(self._wfile, {"stdout": "".join(self._buffer)})
+            self._buffer = []
+            self._size = 0
+
+class WarmCache:
+    """Parsed configurations and their builders, by configuration path and modification time
+
+    Safe to use from several threads.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get(self, config_filename):
+        """Get the configuration and the builder for a configuration file
+
+        :param config_filename: Path to configuration TOML file
+        :type config_filename: str
+        :return: Bootloader configuration and image builder
+        :rtype: tuple(dict, FirmwareImageBuilder)
+        """
+        path = Path(config_filename).resolve()
+        mtime = path.stat().st_mtime_ns
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry is not None and entry[0] == mtime:
+            return entry[1], entry[2]
+        bootloader_config = load_config(path)
+        builder = builder_factory(bootloader_config['bootloader']['ARCH'], bootloader_config)
+        with self._lock:
+            self._entries[path] = (mtime, bootloader_config, builder)
+        return bootloader_config, builder
+
+def run_job(cache, action, params, stdout):
+    """Run a build, decode or verify job
+
+    :param cache: Configurations and builders to use
+    :type cache: WarmCache
+    :param action: "build", "decode" or "verify"
+    :type action: str
+    :param params: Arguments of the action, see JOB_ARGUMENTS
+    :type params: dict
+    :param stdout: Text stream for the standard output of the job
+    :type stdout: io.TextIOBase
+    :return: Job result with the status, info messages and errors
+    :rtype: dict
+    """
+    # pylint: disable=import-outside-toplevel
+    args = argparse.Namespace(**params)
+    result = {"status": STATUS_SUCCESS, "info": [], "errors": []}
+    try:
+        bootloader_config, builder = cache.get(args.config)
+        if action == "build":
+            build_with_config(args.input, bootloader_config, args.output, args.dump, args.include_empty_blocks,
+                              args.engine, args.cache_dir, args.previous, args.baseline, args.manifest,
+                              builder=builder)
+            result["info"].append(f"Image written to '{args.output}'")
+        elif action == "decode":
+            from .pyfwimagebuilder_main import write_decoded
+            with decode_lazy_with_config(args.input, bootloader_config) as fwimage:
+                write_decoded(fwimage, args, stdout)
+        elif action == "verify":
+            from .verifier import verify_with_config
+            verification = verify_with_config(args.input, load_hexfile(args.hex), bootloader_config, args.jobs,
+                                              args.hex)
+            result["errors"].extend(verification.errors)
+            if verification.ok:
+                result["info"].append(f"Image '{args.input}' matches '{args.hex}', "
+                                      f"{verification.pages_checked} pages verified")
+            else:
+                result["status"] = STATUS_FAILURE
+                result["errors"].append(f"Image '{args.input}' does not match '{args.hex}'")
+        else:
+            raise ValueError(f"Unknown action '{action}'")
+    except Exception as exc: # pylint: disable=broad-exception-caught
+        result["status"] = STATUS_FAILURE
+        result["errors"].append(f"Operation failed with {type(exc).__name__}: {exc}")
+    return result
+
+def token_path(port):
+    """Path of the token file of the daemon on a port
+
+    :param port: Port of the daemon
+    :type port: int
+    :return: Token file path
+    :rtype: Path
+    """
+    return TOKEN_DIRECTORY / f"daemon-{port}.token"
+
+class _JobRequestHandler(BaseHTTPRequestHandler):
+    """Runs the job posted to /<action>"""
+    def do_POST(self): # pylint: disable=invalid-name
+        """Handle a job request"""
+        if self.headers.get("Host") != f"{DAEMON_HOST}:{self.server.server_address[1]}":
+            self.send_error(403, "Invalid host")
+            return
+        if not hmac.compare_digest(self.headers.get(TOKEN_HEADER, ""), self.server.token):
+            self.send_error(403, "Invalid token")
+            return
+        if self.headers.get_content_type() != "application/json":
+            self.send_error(415, "Job parameters must be JSON")
+            return
+        action = self.path.strip("/")
+        if action not in JOB_ARGUMENTS:
+            self.send_error(404, f"Unknown action '{action}'")
+            return
+        try:
+            params = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        except ValueError:
+            self.send_error(400, "Invalid job parameters")
+            return
+        logger.info("Running %s job for '%s'", action, params.get("input"))
+        # The response ends when the connection is closed
+        self.send_response(200)
+        self.send_header("Content-Type", "application/jsonl")
+        self.end_headers()
+        stdout = _StdoutRecords(self.wfile)
+        try:
+            with self.server.job_slots:
+                result = run_job(self.server.cache, action, params, stdout)
+            stdout.flush()
+            _write_record(self.wfile, result)
+        except (BrokenPipeError, ConnectionResetError):
+            logger.info("Client of the %s job for '%s' disconnected", action, params.get("input"))
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        """Log requests with the package logger instead of stderr"""
+        logger.debug(format, *args)
+
+class DaemonServer(ThreadingHTTPServer):
+    """HTTP server running image jobs
+
+    Attributes:
+        cache : WarmCache
+            Configurations and builders shared by all jobs
+        job_slots : threading.BoundedSemaphore
+            Limits the number of jobs running at the same time
+        token : str
+            Token that clients must send, written to the token file of the port
+
+    :param port: Port to listen on, 0 for any free port
+    :type port: int
+    :param jobs: Maximum number of jobs running at the same time, defaults to the number of CPUs
+    :type jobs: int, optional
+    """
+    daemon_threads = True
+
+    def __init__(self, port, jobs=None):
+        super().__init__((DAEMON_HOST, port), _JobRequestHandler)
+        self.cache = WarmCache()
+        self.job_slots = threading.BoundedSemaphore(jobs or os.cpu_count() or 1)
+        self.token = secrets.token_hex(32)
+        self._token_path = token_path(self.server_address[1])
+        try:
+            TOKEN_DIRECTORY.mkdir(mode=0o700, parents=True, exist_ok=True)
+            # Replace the file of an earlier daemon so that only the user can read the new token
+            self._token_path.unlink(missing_ok=True)
+            descriptor = os.open(self._token_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(descriptor, "w", encoding="ascii") as token_file:
+                token_file.write(self.token)
+        except OSError:
+            super().server_close()
+            raise
+
+    def server_close(self):
+        """Stop listening and remove the token file"""
+        super().server_close()
+        self._token_path.unlink(missing_ok=True)
+
+def serve(port=None, jobs=None):
+    """Run the daemon until it is interrupted
+
+    :param port: Port to listen on, defaults to None (DEFAULT_PORT)
+    :type port: int, optional
+    :param jobs: Maximum number of jobs running at the same time, defaults to the number of CPUs
+    :type jobs: int, optional
+    """
+    with DaemonServer(DEFAULT_PORT if port is None else port, jobs) as server:
+        logger.info("Daemon listening on %s:%d", DAEMON_HOST, server.server_address[1])
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logger.info("Daemon stopped")
+
+def job_parameters(args):
+    """Collect the arguments of an action to forward to the daemon
+
+    Paths are made absolute as the daemon runs in another working directory.
+
+    :param args: Parsed command line arguments of a build, decode or verify action
+    :type args: dict
+    :return: Job parameters
+    :rtype: dict
+    """
+    path_arguments, value_arguments = JOB_ARGUMENTS[args.action]
+    params = {name: getattr(args, name) for name in value_arguments}
+    for name in path_arguments:
+        value = getattr(args, name)
+        params[name] = str(Path(value).absolute()) if value else None
+    if args.action == "build" and not params["output"]:
+        # Same default as a local build
+        params["output"] = str(Path(Path(args.input).stem + '.img').absolute())
+    return params
+
+def forward_job(args, port=None):
+    """Run an action in the daemon
+
+    :param args: Parsed command line arguments of a build, decode or verify action
+    :type args: dict
+    :param port: Port of the daemon, defaults to None (DEFAULT_PORT)
+    :type port: int, optional
+    :return: Status code of the job, None if no daemon is running
+    :rtype: int | None
+    """
+    port = DEFAULT_PORT if port is None else port
+    try:
+        token = token_path(port).read_text(encoding="ascii")
+    except FileNotFoundError:
+        return None
+    connection = http.client.HTTPConnection(DAEMON_HOST, port)
+    try:
+        try:
+            connection.request("POST", f"/{args.action}", json.dumps(job_parameters(args)),
+                               {"Content-Type": "application/json", TOKEN_HEADER: token})
+        except ConnectionRefusedError:
+            return None
+        response = connection.getresponse()
+        if response.status != 200:
+            logger.error("Daemon rejected the job: %d %s", response.status, response.reason)
+            return STATUS_FAILURE
+        result = None
+        for line in response:
+            record = json.loads(line)
+            if "stdout" in record:
+                sys.stdout.write(record["stdout"])
+            else:
+                result = record
+    finally:
+        connection.close()
+    if result is None:
+        logger.error("Daemon stopped before the job finished")
+        return STATUS_FAILURE
+    for message in result["info"]:
+        logger.info(message)
+    for error in result["errors"]:
+        logger.error(error)
+    return result["status"]
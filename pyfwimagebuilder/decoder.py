@@ -2,13 +2,12 @@
 Main Decoder Algorithm
 """
 from logging import getLogger
-import toml
 
-from .mcu8builder import Mcu8FirmwareImage, Mcu8ImageBlockBase
-from .pic18builder import FirmwareImagebuilderPic18
-from .pic16builder import FirmwareImagebuilderPic16
-from .avrbuilder import FirmwareImagebuilderAVR, AVR_ARCH_LIST
-from .mcu32builder import Mcu32ImageBlockBase, FirmwareImageBuilderMcu32, Mcu32FirmwareImage, MCU32_ARCH_LIST
+from .profiling import profile_phase
+
+# The architecture modules and toml are imported where they are needed, so that importing
+# the decoder stays cheap for the CLI.
+# pylint: disable=import-outside-toplevel
 
 def image_block_factory(architecture: str, config):
     """Creates a image block class for a specific architecture
@@ -21,6 +20,11 @@ def image_block_factory(architecture: str, config):
     :return: FirmwareImage instance
     :rtype: Instance of a FirmwareImage class
     """
+    from .mcu8builder import Mcu8ImageBlockBase
+    from .pic18builder import FirmwareImagebuilderPic18
+    from .pic16builder import FirmwareImagebuilderPic16
+    from .avrbuilder import FirmwareImagebuilderAVR, AVR_ARCH_LIST
+    from .mcu32builder import Mcu32ImageBlockBase, FirmwareImageBuilderMcu32, MCU32_ARCH_LIST
     version = config['bootloader']['IMAGE_FORMAT_VERSION']
     if architecture == "PIC18":
         builder = FirmwareImagebuilderPic18
@@ -53,6 +57,11 @@ def fwimage_factory(architecture: str, config):
     :return: FirmwareImage instance
     :rtype: Instance of a FirmwareImage class
     """
+    from .mcu8builder import Mcu8FirmwareImage
+    from .pic18builder import FirmwareImagebuilderPic18
+    from .pic16builder import FirmwareImagebuilderPic16
+    from .avrbuilder import FirmwareImagebuilderAVR, AVR_ARCH_LIST
+    from .mcu32builder import FirmwareImageBuilderMcu32, Mcu32FirmwareImage, MCU32_ARCH_LIST
     version = config['bootloader']['IMAGE_FORMAT_VERSION']
     if architecture == "PIC18":
         builder = FirmwareImagebuilderPic18
@@ -74,6 +83,16 @@ def fwimage_factory(architecture: str, config):
             f"{builder.MAX_FORMAT_VERSION}")
     return fwimage
 
+def bytes_per_address(architecture: str):
+    """Number of data bytes per flash address in the image blocks of an architecture
+
+    :param architecture: Architecture type e.g. PIC18, PIC16, AVR, AVR_DA, TINY...
+    :type architecture: string
+    :return: 2 for the word addressed PIC16 flash, 1 for byte addressed flash
+    :rtype: int
+    """
+    return 2 if architecture == "PIC16" else 1
+
 def decode(input_filename, config_filename):
     """Decode and return a firmware image as a string
 
@@ -82,6 +101,7 @@ def decode(input_filename, config_filename):
     :param config_filename: Path to configuration TOML file
     :type config_filename: str
     """
+    import toml
     logger = getLogger(__name__)
 
     # Read in config which was generated when this bootloader was built
@@ -100,3 +120,80 @@ def decode(input_filename, config_filename):
         data = image_file.read()
         fwimage = firmware_image.from_bytes(image_block, data)
     return fwimage
+
+def decode_lazy(input_filename, config_filename, profiler=None):
+    """Open a firmware image for decoding on demand
+
+    Only the block headers are read when the image is opened, the blocks are decoded when they
+    are accessed. Close the image when done, or use it as a context manager.
+
+    :param input_filename: Path to the image file
+    :type input_filename: str
+    :param config_filename: Path to configuration TOML file
+    :type config_filename: str
+    :param profiler: Profiler recording the decoding phases, defaults to None (no profiling)
+    :type profiler: pyfwimagebuilder.profiling.PhaseProfiler, optional
+    :return: Lazily decoded firmware image
+    :rtype: LazyFirmwareImage
+    """
+    import toml
+    logger = getLogger(__name__)
+
+    logger.debug("Loading bootloader config from %s", config_filename)
+    with profile_phase(profiler, "load config"):
+        bootloader_config = toml.load(config_filename)
+    with profile_phase(profiler, "index image"):
+        return decode_lazy_with_config(input_filename, bootloader_config)
+
+def decode_lazy_with_config(input_filename, bootloader_config):
+    """Open a firmware image for decoding on demand for an already loaded configuration
+
+    :param input_filename: Path to the image file
+    :type input_filename: str
+    :param bootloader_config: Bootloader configuration
+    :type bootloader_config: dict
+    :return: Lazily decoded firmware image
+    :rtype: LazyFirmwareImage
+    """
+    from .imagebuilder import LazyFirmwareImage
+    architecture = bootloader_config['bootloader']['ARCH']
+    image_block = image_block_factory(architecture, bootloader_config)
+    return LazyFirmwareImage.open(image_block, input_filename, bytes_per_address(architecture))
+
+def image_to_hexfile(fwimage, bytes_per_address=1, start=0, end=None):
+    """Rebuild the flash contents written by an image
+
+    The contents are collected from the flash write, compressed flash write and pattern fill
+    blocks in one pass over the blocks, in address order.
+
+    :param fwimage: Firmware image
+    :type fwimage: FirmwareImage
+    :param bytes_per_address: Number of data bytes per flash address in the blocks, 2 for the word
+        addressed PIC16 flash, defaults to 1
+    :type bytes_per_address: int, optional
+    :param start: Only collect the blocks that start at this hexfile byte address or later, defaults to 0
+    :type start: int, optional
+    :param end: Only collect the blocks that start before this hexfile byte address, defaults to None (no limit)
+    :type end: int, optional
+    :return: Flash contents with hexfile byte addresses
+    :rtype: HexFile
+    :raises HexFileError: If blocks write overlapping data
+    """
+    from .hexfile import HexFile
+    from .imagebuilder import BlockTable, BlockType
+
+    def in_range(address):
+        return start <= address * bytes_per_address and (end is None or address * bytes_per_address < end)
+
+    blocks = fwimage.blocks
+    if isinstance(blocks, BlockTable):
+        # Sort by the address in the table so only one block at a time is decoded
+        indices = sorted((index for index, block_type in enumerate(blocks.types)
+                          if block_type != BlockType.METADATA.value and in_range(blocks.addresses[index])),
+                         key=blocks.addresses.__getitem__)
+        flash_blocks = (blocks[index] for index in indices)
+    else:
+        flash_blocks = sorted((block for block in blocks if getattr(block, "block_type", None) != BlockType.METADATA
+                               and in_range(block.address)),
+                              key=lambda block: block.address)
+    return HexFile.fromdata((block.address * bytes_per_address, block.data) for block in flash_blocks)
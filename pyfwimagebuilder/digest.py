@@ -0,0 +1,83 @@
+"""
+Integrity digests of firmware images
+
+The digests are updated with each block while the image is serialized, so they are
+available as soon as the image is written, without reading the image file back. The
+SHA-256 and CRC32 of the complete image and the CRC32 of each block can be saved as a
+JSON manifest next to the image:
+
+    {
+      "size": 2108,
+      "sha256": "9f86d0...",
+      "crc32": "1c291ca3",
+      "blocks": [{"offset": 0, "size": 527, "crc32": "0aa7c5e4"}, ...]
+    }
+"""
+import hashlib
+import json
+import zlib
+
+class ImageDigest:
+    """SHA-256 and CRC32 of an image and CRC32 of each of its blocks
+
+    Attributes:
+        size : int
+            Number of image bytes digested
+        crc32 : int
+            CRC32 of the image
+        blocks : list(tuple(int, int, int))
+            Offset, size and CRC32 of each block
+    """
+    def __init__(self):
+        self._sha256 = hashlib.sha256()
+        self.size = 0
+        self.crc32 = 0
+        self.blocks = []
+
+    def add_block(self, buffers):
+        """Add the serialized bytes of the next block of the image
+
+        :param buffers: Bytes-like objects that make up the block, in order
+        :type buffers: Iterable[bytes|memoryview]
+        """
+        offset = self.size
+        block_crc32 = 0
+        for buffer in buffers:
+            self._sha256.update(buffer)
+            self.crc32 = zlib.crc32(buffer, self.crc32)
+            block_crc32 = zlib.crc32(buffer, block_crc32)
+            self.size += len(buffer)
+        self.blocks.append((offset, self.size - offset, block_crc32))
+
+    @property
+    def sha256(self):
+        """SHA-256 of the image
+
+        :return: Hex digest
+        :rtype: str
+        """
+        return self._sha256.hexdigest()
+
+    def to_manifest(self):
+        """Create the manifest of the digests
+
+        :return: Manifest with the image size and digests and the offset, size and CRC32 of each block
+        :rtype: dict
+        """
+        return {
+            "size": self.size,
+            "sha256": self.sha256,
+            "crc32": f"{self.crc32:08x}",
+            "blocks": [{"offset": offset, "size": size, "crc32": f"{crc32:08x}"}
+                       for offset, size, crc32 in self.blocks],
+        }
+
+    def write_manifest(self, manifest_filename):
+        """Write the manifest of the digests to a JSON file
+
+        :param manifest_filename: Manifest file name
+        :type manifest_filename: str
+        """
+        with open(manifest_filename, "w", encoding="utf-8") as manifest_file:
+            json.dump(self.to_manifest(), manifest_file, indent=2)
+            manifest_file.write("\n")
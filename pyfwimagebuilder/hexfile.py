@@ -0,0 +1,311 @@
+"""
+Intel HEX file loading
+
+HexFile parses Intel HEX records directly into one contiguous buffer per segment,
+instead of keeping a dictionary entry per address like intelhex.IntelHex. It provides the
+subset of the IntelHex API used by the image builders: segments() and tobinarray().
+It can also write its contents as Intel HEX records or as a raw binary.
+"""
+import io
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+# Intel HEX record types
+RECORD_DATA = 0x00
+RECORD_END_OF_FILE = 0x01
+RECORD_EXTENDED_SEGMENT_ADDRESS = 0x02
+RECORD_START_SEGMENT_ADDRESS = 0x03
+RECORD_EXTENDED_LINEAR_ADDRESS = 0x04
+RECORD_START_LINEAR_ADDRESS = 0x05
+
+# Record length, address (2 bytes), record type and checksum
+RECORD_OVERHEAD = 5
+
+class HexFileError(Exception):
+    """Intel HEX parsing error"""
+
+class HexFile:
+    """Intel HEX file contents as contiguous segments
+
+    Attributes:
+        padding : int
+            Value used by tobinarray for addresses without data
+    """
+    def __init__(self):
+        self.padding = 0xFF
+        self._segments = {}
+
+    @classmethod
+    def fromfile(cls, filename):
+        """Load an Intel HEX file
+
+        :param filename: Path to the Intel HEX file
+        :type filename: str | pathlib.Path
+        :return: Hex file contents
+        :rtype: HexFile
+        :raises HexFileError: For invalid records, checksum errors and overlapping data
+        """
+        hexfile = cls()
+        with open(filename, "r", encoding="ascii") as file:
+            try:
+                hexfile.loadhex(file)
+            except UnicodeDecodeError as exc:
+                raise HexFileError(f"Invalid characters in '{filename}'") from exc
+        return hexfile
+
+    def loadhex(self, lines):
+        """Load Intel HEX records
+
+        :param lines: Intel HEX records, one per line
+        :type lines: Iterable[str]
+        :raises HexFileError: For invalid records, checksum errors and overlapping data
+        """
+        # Segment start address for each segment and the address following its last byte
+        segments = {}
+        segment_ends = {}
+        offset = 0
+        for line_number, line in enumerate(lines, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            if line[0] != ":":
+                raise HexFileError(f"Line {line_number}: record does not start with ':'")
+            try:
+                record = bytes.fromhex(line[1:])
+            except ValueError as exc:
+                raise HexFileError(f"Line {line_number}: invalid hexadecimal characters") from exc
+            if len(record) < RECORD_OVERHEAD or len(record) != record[0] + RECORD_OVERHEAD:
+                raise HexFileError(f"Line {line_number}: invalid record length")
+            if sum(record) & 0xFF:
+                raise HexFileError(f"Line {line_number}: checksum mismatch")
+
+            record_type = record[3]
+            if record_type == RECORD_DATA:
+                if not record[0]:
+                    # Data records without data are ignored like IntelHex does
+                    continue
+                address = offset + (record[1] << 8 | record[2])
+                if not self._append_data(segments, segment_ends, address, record[4:-1]):
+                    raise HexFileError(f"Line {line_number}: data overlap at address 0x{address:08X}")
+            elif record_type == RECORD_END_OF_FILE:
+                break
+            elif record_type == RECORD_EXTENDED_SEGMENT_ADDRESS:
+                offset = int.from_bytes(record[4:6], "big") << 4
+            elif record_type == RECORD_EXTENDED_LINEAR_ADDRESS:
+                offset = int.from_bytes(record[4:6], "big") << 16
+            elif record_type not in (RECORD_START_SEGMENT_ADDRESS, RECORD_START_LINEAR_ADDRESS):
+                raise HexFileError(f"Line {line_number}: unsupported record type 0x{record_type:02X}")
+
+        self._segments = self._merge_segments(segments)
+
+    @classmethod
+    def fromdata(cls, chunks):
+        """Create hex file contents from chunks of data
+
+        :param chunks: Start address and data of each chunk
+        :type chunks: Iterable[tuple(int, bytes)]
+        :return: Hex file contents
+        :rtype: HexFile
+        :raises HexFileError: If chunks overlap
+        """
+        segments = {}
+        segment_ends = {}
+        for address, data in chunks:
+            if not cls._append_data(segments, segment_ends, address, data):
+                raise HexFileError(f"Data overlap at address 0x{address:08X}")
+        hexfile = cls()
+        hexfile._segments = cls._merge_segments(segments)
+        return hexfile
+
+    @staticmethod
+    def _append_data(segments, segment_ends, address, data):
+        """Append data to the segment that ends at its address, or start a new segment
+
+        :param segments: Segment data by start address
+        :type segments: dict(int, bytearray)
+        :param segment_ends: Segment start address by the address following the segment
+        :type segment_ends: dict(int, int)
+        :param address: Address of the data
+        :type address: int
+        :param data: Data to append
+        :type data: bytes
+        :return: False if a segment already starts at the address
+        :rtype: bool
+        """
+        start = segment_ends.pop(address, None)
+        if start is None:
+            if address in segments:
+                return False
+            start = address
+            segments[start] = bytearray(data)
+        else:
+            segments[start] += data
+        segment_ends[address + len(data)] = start
+        return True
+
+    @staticmethod
+    def _merge_segments(segments):
+        """Merge adjacent segments
+
+        Records that are not in address order can create segments that are adjacent to each other.
+
+        :param segments: Segment data by start address
+        :type segments: dict(int, bytearray)
+        :return: Segment data by start address, with no adjacent segments
+        :rtype: dict(int, bytes)
+        :raises HexFileError: If segments overlap
+        """
+        merged = {}
+        previous_start = None
+        previous_end = None
+        for start in sorted(segments):
+            data = segments[start]
+            if previous_end is not None and start < previous_end:
+                raise HexFileError(f"Data overlap at address 0x{start:08X}")
+            if start == previous_end:
+                merged[previous_start] += data
+            else:
+                merged[start] = data
+                previous_start = start
+            previous_end = start + len(data)
+        return {start: bytes(data) for start, data in merged.items()}
+
+    def segments(self):
+        """Return the address ranges with data
+
+        :return: Segment start and end address tuples, the end address is the first address after the segment
+        :rtype: list(tuple(int, int))
+        """
+        return [(start, start + len(data)) for start, data in self._segments.items()]
+
+    def tobinarray(self, start, end):
+        """Return the data in an address range
+
+        :param start: First address of the range
+        :type start: int
+        :param end: Last address of the range (inclusive)
+        :type end: int
+        :return: Data in the range, addresses without data are filled with the padding value
+        :rtype: bytes
+        """
+        size = end - start + 1
+        segment = self._segments.get(start)
+        if segment is not None and size <= len(segment):
+            # Fast path for complete segments, no copy needed
+            return segment if size == len(segment) else segment[:size]
+
+        data = bytearray([self.padding]) * size
+        for segment_start, segment in self._segments.items():
+            segment_end = segment_start + len(segment)
+            if segment_end <= start or segment_start > end:
+                continue
+            first = max(segment_start, start)
+            last = min(segment_end, end + 1)
+            data[first - start:last - start] = segment[first - segment_start:last - segment_start]
+        return bytes(data)
+
+    def write_hex(self, fileobj, record_length=16):
+        """Write the contents as Intel HEX records
+
+        Each segment is formatted as a whole, with an extended linear address record
+        whenever the data crosses into another 64 KiB region.
+
+        :param fileobj: Text file object
+        :type fileobj: io.TextIOBase
+        :param record_length: Maximum number of data bytes per record, defaults to 16
+        :type record_length: int, optional
+        """
+        upper_address = 0
+        for start, data in self._segments.items():
+            lines = []
+            offset = 0
+            while offset < len(data):
+                address = start + offset
+                if address >> 16 != upper_address:
+                    upper_address = address >> 16
+                    lines.append(_format_record(0, RECORD_EXTENDED_LINEAR_ADDRESS, upper_address.to_bytes(2, "big")))
+                # Records must not cross a 64 KiB boundary
+                length = min(record_length, len(data) - offset, 0x10000 - (address & 0xFFFF))
+                lines.append(_format_record(address & 0xFFFF, RECORD_DATA, data[offset:offset + length]))
+                offset += length
+            fileobj.writelines(lines)
+        fileobj.write(_format_record(0, RECORD_END_OF_FILE, b""))
+
+    def write_bin(self, fileobj, base=None):
+        """Write the contents as a raw binary
+
+        The binary starts at the base address and ends with the last byte of data, gaps between
+        the segments are filled with the padding value.
+
+        :param fileobj: Binary file object
+        :type fileobj: io.BufferedIOBase
+        :param base: Address of the first byte of the binary, defaults to the first address with data
+        :type base: int, optional
+        :raises ValueError: If there is data below the base address
+        """
+        if not self._segments:
+            return
+        first = min(self._segments)
+        last = max(start + len(data) for start, data in self._segments.items()) - 1
+        if base is None:
+            base = first
+        elif base > first:
+            raise ValueError(f"Data at address 0x{first:08X} is below the base address 0x{base:08X}")
+        fileobj.write(self.tobinarray(base, last))
+
+def _format_record(address, record_type, data):
+    """Format an Intel HEX record
+
+    :param address: Lower 16 bits of the record address
+    :type address: int
+    :param record_type: Record type
+    :type record_type: int
+    :param data: Record data
+    :type data: bytes
+    :return: Record line including the line ending
+    :rtype: str
+    """
+    record = bytes((len(data), address >> 8, address & 0xFF, record_type)) + data
+    checksum = -sum(record) & 0xFF
+    return f":{record.hex().upper()}{checksum:02X}\n"
+
+def load_hexfile(filename):
+    """Load an Intel HEX file for image building
+
+    The file is loaded with HexFile. If it can not be parsed, loading is retried with
+    intelhex.IntelHex which reports the problem in more detail or handles the special case.
+
+    :param filename: Path to the Intel HEX file
+    :type filename: str | pathlib.Path
+    :return: Hex file contents
+    :rtype: HexFile | intelhex.IntelHex
+    """
+    try:
+        return HexFile.fromfile(filename)
+    except HexFileError as exc:
+        logger.debug("Falling back to IntelHex for '%s': %s", filename, exc)
+    # IntelHex is slow to import and only needed for this fallback
+    from intelhex import IntelHex # pylint: disable=import-outside-toplevel
+    hexfile = IntelHex()
+    hexfile.fromfile(filename, format='hex')
+    return hexfile
+
+def parse_hexdata(data):
+    """Parse the contents of an Intel HEX file for image building
+
+    Like load_hexfile, for hex file contents that are already read into memory.
+
+    :param data: Contents of the Intel HEX file
+    :type data: bytes
+    :return: Hex file contents
+    :rtype: HexFile | intelhex.IntelHex
+    """
+    hexfile = HexFile()
+    try:
+        hexfile.loadhex(data.decode("ascii").splitlines())
+        return hexfile
+    except (HexFileError, UnicodeDecodeError) as exc:
+        logger.debug("Falling back to IntelHex: %s", exc)
+    from intelhex import IntelHex # pylint: disable=import-outside-toplevel
+    return IntelHex(io.StringIO(data.decode("ascii", errors="replace")))
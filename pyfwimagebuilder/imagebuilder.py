@@ -1,10 +1,16 @@
 """Image builders common functionality"""
 
 from abc import ABC, abstractmethod
+from array import array
+from bisect import bisect_right
+from collections.abc import Sequence
 from enum import Enum
 from logging import getLogger
+import io
+import struct
 import textwrap
 from packaging.version import parse as version_parse
+from .observer import observe
 
 logger = getLogger(__name__)
 
@@ -26,10 +32,78 @@ class BlockType(Enum):
         range is defined in the configuration file from FLASH_START and FLASH_END.
     - 3: EEPROM data operation block, used to transfer bytes that appear in the eeprom data region of the hex file. For the default file format this
         range is defined in the configuration file from EEPROM_START and EEPROM_END. *Not supported yet*
+    - 4: Compressed flash data operation block, same as the flash data operation block but with a run-length compressed
+        payload that expands to the flash data. Used from the format versions that support compression.
+    - 5: Pattern fill block, fills a number of consecutive flash pages with a repeated byte or word pattern. Used from the
+        format versions that support pattern fill.
     """
     UNINITIALIZED = 0
     METADATA = 1
     FLASH_OPERATION = 2
+    COMPRESSED_FLASH_OPERATION = 4
+    PATTERN_FILL = 5
+
+class BlockTable(Sequence):
+    """Compact table of the blocks in an encoded image
+
+    The table keeps the image bytes and parallel arrays with the offset, size, type and
+    flash address of each block. Block objects are only created when the table is indexed,
+    and their payloads are views into the image bytes, so a decoded image takes little
+    more memory than the image itself.
+
+    :param image_block_base: Image block class used to decode the blocks
+    :type image_block_base: ImageBlockBase or child of ImageBlockBase
+    :param data: Image bytes, or a buffer like a memory map that must stay open while the table is used
+    :type data: bytes | mmap.mmap
+    """
+    # Flash blocks store their address right after the common block header
+    ADDRESS_STRUCT = struct.Struct("<I")
+    # Address entry for blocks without an address
+    NO_ADDRESS = -1
+
+    def __init__(self, image_block_base, data):
+        self.image_block_base = image_block_base
+        self.data = data
+        self.offsets = array('Q')
+        self.sizes = array('H')
+        self.types = array('B')
+        self.addresses = array('q')
+
+    def append(self, offset, block_size, block_type):
+        """Add a block to the table
+
+        :param offset: Offset of the block in the image bytes
+        :type offset: int
+        :param block_size: Size of the block
+        :type block_size: int
+        :param block_type: Type of the block
+        :type block_type: BlockType
+        """
+        address = self.NO_ADDRESS
+        if block_type != BlockType.METADATA and \
+                block_size >= ImageBlockBase.BLOCK_HEADER_SIZE + self.ADDRESS_STRUCT.size:
+            address, = self.ADDRESS_STRUCT.unpack_from(self.data, offset + ImageBlockBase.BLOCK_HEADER_SIZE)
+        self.offsets.append(offset)
+        self.sizes.append(block_size)
+        self.types.append(block_type.value)
+        self.addresses.append(address)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        offset = self.offsets[index]
+        if isinstance(self.data, bytes):
+            block_data = memoryview(self.data)[offset:offset + self.sizes[index]]
+        else:
+            # Other buffers, like a memory map, are copied so that no view keeps them from being closed
+            block_data = self.data[offset:offset + self.sizes[index]]
+        try:
+            return self.image_block_base.from_bytes(block_data)
+        except (ValueError, TypeError) as err:
+            raise ImageDecodingError(f"Decoding of block {index} failed. {err}") from err
 
 class FirmwareImage(ABC):
     """Firmware image object
@@ -58,13 +132,22 @@ class FirmwareImage(ABC):
         
         This implementation relies on the fact that any image block class defined will implement it's own __str__ function.
         """
-        txt = ""
+        txt = io.StringIO()
+        self.dump(txt)
+        return txt.getvalue()
+
+    def dump(self, fileobj):
+        """Write the string representation of the image to a text file object
+
+        The text is written block by block, so the dump of a large image is never held in memory.
+
+        :param fileobj: Text file object
+        :type fileobj: io.TextIOBase
+        """
         for i, block in enumerate(self.blocks):
-            txt += f"Block - {i}\n"
-            block_text = textwrap.indent(str(block), '  ')
-            txt += block_text
-            txt += "\n"
-        return txt
+            fileobj.write(f"Block - {i}\n")
+            block.dump(fileobj, '  ')
+            fileobj.write("\n")
 
     def add_block(self, block):
         """Add a block to the image
@@ -72,44 +155,113 @@ class FirmwareImage(ABC):
         :param block: Image block
         :type block: Inherited classes from ImageBlockBase
         """
+        if not isinstance(self.blocks, list):
+            # Decoded images keep their blocks in a read-only table
+            self.blocks = list(self.blocks)
         self.blocks.append(block)
 
-    def to_bytes(self):
+    @staticmethod
+    def write_block(fileobj, block, digest=None):
+        """Write a single block to a file object
+
+        The block header and payload are written as separate buffers so the
+        payload is not copied into an intermediate bytes object.
+
+        :param fileobj: Binary file object
+        :type fileobj: io.BufferedIOBase
+        :param block: Image block
+        :type block: Inherited classes from ImageBlockBase
+        :param digest: Digest to update with the block, defaults to None
+        :type digest: ImageDigest, optional
+        :return: Number of bytes written
+        :rtype: int
+        """
+        buffers = block.to_buffers()
+        fileobj.writelines(buffers)
+        if digest is not None:
+            digest.add_block(buffers)
+        return sum(len(buffer) for buffer in buffers)
+
+    def write(self, fileobj, digest=None):
+        """Write image to a file object
+
+        :param fileobj: Binary file object
+        :type fileobj: io.BufferedIOBase
+        :param digest: Digest to update with each block as it is written, defaults to None
+        :type digest: ImageDigest, optional
+        :return: Number of bytes written
+        :rtype: int
+        """
+        size = 0
+        for block in self.blocks:
+            size += self.write_block(fileobj, block, digest)
+        return size
+
+    def to_bytes(self, digest=None):
         """Create image
 
+        :param digest: Digest to update with each block as it is serialized, defaults to None
+        :type digest: ImageDigest, optional
         :return: Image as bytes like object
         :rtype: bytearray
         """
-        image = bytearray()
+        image = bytearray(sum(block.block_size for block in self.blocks))
+        view = memoryview(image)
+        offset = 0
         for block in self.blocks:
-            image.extend(block.to_bytes())
+            start = offset
+            offset = block.pack_into(image, offset)
+            if digest is not None:
+                digest.add_block((view[start:offset],))
         return image
 
     @classmethod
-    def from_bytes(cls, image_block_base, data):
+    def from_bytes(cls, image_block_base, data, observer=None):
         """Create a firmware image object from a bytes object
 
         :param image_block_base: Firmware image bytes
         :type image_block_base: ImageBlockBase or child of ImageBlockBase
         :param data: Firmware image bytes
         :type data: bytes | bytearray
+        :param observer: Observer to report the decoding metrics to, defaults to None
+        :type observer: PipelineObserver, optional
         :return: Object representing the firmware image
         :rtype: Child class of FirmwareImage
         :raises ImageDecodingError: For image decoding errors.
         """
         fwimage = cls(image_block_base)
-        fwimage.decode(data)
+        fwimage.decode(data, observer)
         return fwimage
 
-    def decode(self, data: bytes | bytearray):
+    def decode(self, data: bytes | bytearray, observer=None):
         """Decode image from bytes object.
 
+        Only the block headers are decoded here. The blocks are kept in a BlockTable that
+        decodes each block when it is accessed.
+
         :param data: Image object
         :type data: bytes | bytearray
+        :param observer: Observer to report the decoding metrics to, defaults to None
+        :type observer: PipelineObserver, optional
         :raises ImageDecodingError: For image decoding errors.
         """
         logger.debug("Attempting to decode firmware image")
         self.blocks = []
+        with observe(observer, "decode") as run:
+            # The table references the image data so it must not change afterwards
+            self.blocks = self._index_blocks(bytes(data), run)
+
+    def _index_blocks(self, data, run=None):
+        """Build the block table of an image from its block headers
+
+        :param data: Image data
+        :type data: bytes | mmap.mmap
+        :param run: Observed run to count the blocks in, defaults to None
+        :type run: ObservedRun, optional
+        :return: Table of the blocks in the image
+        :rtype: BlockTable
+        :raises ImageDecodingError: For image decoding errors.
+        """
         try:
             # Decode only block size and type of the first block
             self.block_size, block_type = self.image_block_base.decode_block_header(data, verify_length=False)
@@ -120,20 +272,146 @@ class FirmwareImage(ABC):
                 logger.error(txt)
                 raise ValueError(txt)
 
-            blocks_count = len(data) // self.block_size
-            logger.debug("Block size %i", self.block_size)
-            logger.debug("Number of blocks in image %i", blocks_count)
-            # Ensure that the image can be divided into a whole number of blocks with a lenght of block_size
-            if len(data) % self.block_size:
-                raise ValueError(f"Data can not be split into an even number of bocks with size of {self.block_size}")
-            for i in range(blocks_count):
-                block_start = 0 + i * self.block_size
-                block_end = block_start + self.block_size
-                logger.debug("Decoding block %i", i)
-                block = self.image_block_base.from_bytes(data[block_start:block_end])
-                self.blocks.append(block)
+            table = BlockTable(self.image_block_base, data)
+            # Blocks can have different sizes so the image is walked block by block
+            offset = 0
+            while offset < len(data):
+                if len(data) - offset < ImageBlockBase.BLOCK_HEADER_SIZE:
+                    raise ValueError(f"Incomplete block header at offset {offset}")
+                block_size, block_type = self.image_block_base.decode_block_header(
+                    data[offset:offset + ImageBlockBase.BLOCK_HEADER_SIZE], verify_length=False)
+                if block_size < ImageBlockBase.BLOCK_HEADER_SIZE or offset + block_size > len(data):
+                    raise ValueError(f"Block {len(table)} at offset {offset} with size {block_size} " +
+                                     "does not fit in the image")
+                table.append(offset, block_size, block_type)
+                offset += block_size
+            logger.debug("Number of blocks in image %i", len(table))
+            if run is not None:
+                run.stats.bytes_in += len(data)
+                run.add_blocks(len(table), offset)
+            # The metadata block is decoded right away to report a corrupt image as early as possible
+            self.image_block_base.from_bytes(data[:table.sizes[0]])
         except (ValueError, TypeError) as err:
             raise ImageDecodingError(f"Image decoding failed. {err}") from err
+        return table
+
+class LazyFirmwareImage(FirmwareImage):
+    """Firmware image decoded on demand from a memory mapped image file
+
+    Opening the image only reads the block headers to index the blocks. Blocks are decoded
+    when they are accessed, by position through the blocks table or by flash address with
+    block_at_address, so inspecting a single page of a large image does not decode the
+    whole image. The image file must stay open while the image is used, either by using
+    the image as a context manager or by calling close when done.
+
+    :param image_block_base_cls: Image block class used to decode the blocks
+    :type image_block_base_cls: ImageBlockBase or child of ImageBlockBase
+    :param bytes_per_address: Number of data bytes per flash address in the blocks, 2 for the word
+        addressed PIC16 flash, defaults to 1
+    :type bytes_per_address: int, optional
+    """
+    def __init__(self, image_block_base_cls, bytes_per_address=1):
+        super().__init__(image_block_base_cls)
+        self.bytes_per_address = bytes_per_address
+        self._mmap = None
+        self._sorted_addresses = None
+        self._sorted_indices = None
+
+    @classmethod
+    def open(cls, image_block_base, filename, bytes_per_address=1):
+        """Open and index an image file
+
+        :param image_block_base: Image block class used to decode the blocks
+        :type image_block_base: ImageBlockBase or child of ImageBlockBase
+        :param filename: Image file name
+        :type filename: str | pathlib.Path
+        :param bytes_per_address: Number of data bytes per flash address in the blocks, defaults to 1
+        :type bytes_per_address: int, optional
+        :return: Lazily decoded image
+        :rtype: LazyFirmwareImage
+        :raises ImageDecodingError: For image decoding errors.
+        """
+        import mmap # pylint: disable=import-outside-toplevel
+        fwimage = cls(image_block_base, bytes_per_address)
+        with open(filename, "rb") as image_file:
+            try:
+                # The map stays valid after the file is closed
+                data = mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError as err:
+                # Empty files can not be mapped
+                raise ImageDecodingError(f"Image decoding failed. {err}") from err
+        fwimage._mmap = data
+        try:
+            fwimage.blocks = fwimage._index_blocks(data)
+        except ImageDecodingError:
+            fwimage.close()
+            raise
+        return fwimage
+
+    def close(self):
+        """Close the memory map of the image file
+
+        Blocks that were already decoded stay valid, the image itself can not be used anymore.
+        """
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def metadata(self):
+        """Metadata block of the image
+
+        :return: First block of the image
+        :rtype: MetaDataBlock
+        """
+        return self.blocks[0]
+
+    def _build_address_index(self):
+        """Sort the blocks with a flash address by their address"""
+        addresses = self.blocks.addresses
+        indices = sorted((index for index, address in enumerate(addresses) if address != BlockTable.NO_ADDRESS),
+                         key=addresses.__getitem__)
+        self._sorted_indices = array('Q', indices)
+        self._sorted_addresses = array('q', (addresses[index] for index in indices))
+
+    def block_index_at_address(self, address):
+        """Find the block that writes a flash address
+
+        :param address: Flash address as stored in the image blocks
+        :type address: int
+        :return: Index of the block that contains the address or None if no block contains it
+        :rtype: int | None
+        """
+        if self._sorted_addresses is None:
+            self._build_address_index()
+        position = bisect_right(self._sorted_addresses, address) - 1
+        if position < 0:
+            return None
+        index = self._sorted_indices[position]
+        block = self.blocks[index]
+        if address >= block.address + block.data_length // self.bytes_per_address:
+            return None
+        return index
+
+    def block_at_address(self, address):
+        """Decode the block that writes a flash address
+
+        :param address: Flash address as stored in the image blocks
+        :type address: int
+        :return: Block that contains the address or None if no block contains it
+        :rtype: Inherited classes from ImageBlockBase | None
+        """
+        index = self.block_index_at_address(address)
+        if index is None:
+            return None
+        return self.blocks[index]
 
 class ImageBlockBase(ABC):
     """
@@ -144,9 +422,13 @@ class ImageBlockBase(ABC):
     that defines the type of data held in the block using one of the BlockType values.
     
     """
+    # Blocks are created in large numbers, so they do not have a __dict__
+    __slots__ = ()
     BLOCK_TYPE_LENGTH = 1
     BLOCK_SIZE_LENGTH = 2
     BLOCK_HEADER_SIZE = BLOCK_SIZE_LENGTH + BLOCK_TYPE_LENGTH
+    # Number of bytes per row of a hexdump
+    HEXDUMP_ROW_LENGTH = 16
     
     @staticmethod
     def decode_block_header(data, verify_length=True):
@@ -214,6 +496,80 @@ class ImageBlockBase(ABC):
         :rtype: bytes
         """
         
+    def dump(self, fileobj, indent=""):
+        """
+        Write the string representation of the block to a text file object.
+
+        :param fileobj: Text file object
+        :type fileobj: io.TextIOBase
+        :param indent: Prefix for each non-empty line, defaults to no indentation
+        :type indent: str, optional
+        """
+        fileobj.write(textwrap.indent(str(self), indent))
+
+    @classmethod
+    def _dump_data(cls, fileobj, address, data, indent=""):
+        """
+        Write a hexdump of data with 16 bytes per row to a text file object.
+
+        The whole data is formatted with one bytes.hex call and split into rows, instead of
+        formatting each byte on its own.
+
+        :param fileobj: Text file object
+        :type fileobj: io.TextIOBase
+        :param address: Address of the first byte
+        :type address: int
+        :param data: Data to dump
+        :type data: bytes|memoryview
+        :param indent: Prefix for each line, defaults to no indentation
+        :type indent: str, optional
+        """
+        fileobj.write(f"{indent}Address   00 01 02 03 04 05 06 07 08 09 0A 0B 0C 0D 0E 0F\n")
+        hex_txt = bytes(data).hex(" ").upper()
+        full_rows = len(data) // cls.HEXDUMP_ROW_LENGTH
+        # Each byte takes two digits and a separator
+        row_txt_length = cls.HEXDUMP_ROW_LENGTH * 3
+        rows = [f"{indent}{address + i * cls.HEXDUMP_ROW_LENGTH:08X}  "
+                f"{hex_txt[i * row_txt_length:(i + 1) * row_txt_length - 1]}\n"
+                for i in range(full_rows)]
+        if len(data) % cls.HEXDUMP_ROW_LENGTH:
+            # The row with the remaining bytes has always been indented by one more space
+            rows.append(f"{indent}{address + full_rows * cls.HEXDUMP_ROW_LENGTH:08X}   "
+                        f"{hex_txt[full_rows * row_txt_length:]}\n")
+        fileobj.writelines(rows)
+
+    def pack_into(self, buffer, offset):
+        """
+        Write the block into a buffer.
+
+        Blocks with a fixed header layout can override this to pack the header
+        directly into the buffer instead of creating an intermediate bytes object.
+
+        :param buffer: Writable buffer with room for the block at offset
+        :type buffer: bytearray
+        :param offset: Offset of the block in the buffer
+        :type offset: int
+        :return: Offset of the first byte after the block
+        :rtype: int
+        """
+        data = self.to_bytes()
+        end = offset + len(data)
+        buffer[offset:end] = data
+        return end
+
+    def to_buffers(self):
+        """
+        Convert the block to a sequence of bytes-like objects.
+
+        The concatenation of the buffers is the block's byte representation. Blocks
+        carrying a payload can override this to return the header and the payload
+        separately, avoiding a copy of the payload.
+
+        :return: Block buffers
+        :rtype: tuple(bytes|memoryview)
+        """
+        return (self.to_bytes(),)
+
     @abstractmethod
     def __str__(self):
         """
@@ -256,6 +612,16 @@ class FirmwareImageBuilder(ABC):
     """
     MAX_FORMAT_VERSION = "0.0.0"
     MIN_FORMAT_VERSION = "0.0.0"
+    # First format version with compressed flash write blocks, None if not supported
+    COMPRESSED_FORMAT_VERSION = None
+    # First format version with pattern fill blocks, None if not supported
+    PATTERN_FILL_FORMAT_VERSION = None
+    # First format version that marks delta images in the metadata, None if not supported
+    DELTA_FORMAT_VERSION = None
+    # Pattern lengths that pages are checked for, shortest first
+    FILL_PATTERN_LENGTHS = (1, 2, 4)
+    # Maximum number of pages in one pattern fill block
+    MAX_FILL_PAGE_COUNT = 0xFFFF
     UNDEFINED_SEQUENCE = 0xFF
     UNDEFINED_SEQUENCE_BYTE_LENGTH = 1
 
@@ -263,6 +629,22 @@ class FirmwareImageBuilder(ABC):
         self.config = config
         self.write_block_size = self.config['bootloader']['WRITE_BLOCK_SIZE']
         self.firmware_image = firmware_image_cls
+        # Empty block patterns by size, shared by all empty blocks of that size
+        self._empty_blocks = {}
+        self.compress_blocks = self._supports_format_feature(self.COMPRESSED_FORMAT_VERSION)
+        self.pattern_fill_blocks = self._supports_format_feature(self.PATTERN_FILL_FORMAT_VERSION)
+
+    def _supports_format_feature(self, feature_version):
+        """Check if the configured image format version has a feature
+
+        :param feature_version: First format version with the feature, None if the builder does not support it
+        :type feature_version: str | None
+        :return: True if the configured format version is the same or newer than the feature version
+        :rtype: bool
+        """
+        if feature_version is None:
+            return False
+        return version_parse(self.config['bootloader']['IMAGE_FORMAT_VERSION']) >= version_parse(feature_version)
 
     @abstractmethod
     def include_segment(self, start_address, end_address):
@@ -309,10 +691,79 @@ class FirmwareImageBuilder(ABC):
         """
         Return platform-specific empty byte pattern block with given size in bytes.
 
+        The patterns are cached, the same immutable bytes object is returned for
+        every request of a given size.
+
         param: size: size of the block in bytes.
         type: size: int
         """
-        return size * self.UNDEFINED_SEQUENCE.to_bytes(self.UNDEFINED_SEQUENCE_BYTE_LENGTH, 'little')
+        block = self._empty_blocks.get(size)
+        if block is None:
+            block = (size // self.UNDEFINED_SEQUENCE_BYTE_LENGTH) * \
+                self.UNDEFINED_SEQUENCE.to_bytes(self.UNDEFINED_SEQUENCE_BYTE_LENGTH, 'little')
+            self._empty_blocks[size] = block
+        return block
+
+    def empty_pages(self, segment_data):
+        """
+        Find the empty write blocks of a segment.
+
+        The segment is searched for the empty block pattern and only matches that are
+        aligned to a write block are reported, so each segment is scanned in bulk
+        instead of comparing every block on its own.
+
+        :param segment_data: Segment data, starting at a write block boundary
+        :type segment_data: bytes
+        :return: Indices of the write blocks in the segment that are empty
+        :rtype: list(int)
+        """
+        page_size = self.write_block_size
+        full_pages_length = len(segment_data) - len(segment_data) % page_size
+        indices = []
+        if full_pages_length:
+            fill = self.empty_block(page_size)
+            position = segment_data.find(fill, 0, full_pages_length)
+            while position != -1:
+                misalignment = position % page_size
+                if misalignment:
+                    # Continue at the next write block boundary
+                    position += page_size - misalignment
+                else:
+                    indices.append(position // page_size)
+                    position += page_size
+                position = segment_data.find(fill, position, full_pages_length)
+        if full_pages_length != len(segment_data):
+            # Last block of the segment is not a complete write block
+            tail = segment_data[full_pages_length:]
+            if tail == self.empty_block(len(tail)):
+                indices.append(full_pages_length // page_size)
+        return indices
+
+    def _flash_block_address(self, address):
+        """Convert a hexfile byte address to the address stored in flash write blocks
+
+        This function can be overridden by the inheriting class for architectures that do not use
+        byte addresses in the image. Only integer arithmetic is used, so the conversion also
+        works element-wise on NumPy integer arrays.
+
+        :param address: Hexfile byte address
+        :type address: int
+        :return: Flash write block address
+        :rtype: int
+        """
+        return address
+
+    def _hex_address(self, block_address):
+        """Convert an address stored in flash write blocks to a hexfile byte address
+
+        This is the inverse of _flash_block_address and must be overridden together with it.
+
+        :param block_address: Flash write block address
+        :type block_address: int
+        :return: Hexfile byte address
+        :rtype: int
+        """
+        return block_address
 
     @abstractmethod
     def _generate_metadata_block(self):
@@ -333,32 +784,102 @@ class FirmwareImageBuilder(ABC):
         param: address Start address of the data block
         type: address int
         param: data block data that must be placed inside the flash block format
-        type: data bytearray | bytes
+        type: data bytes | memoryview
+        The empty status of the returned block is set by the caller.
         :return: FlashWriteBlock is the default class defined but could be any child of the ImageBlockBase class.
         :rtype: Child of the ImageBlockBase
         """
 
-    def build(self, hexfile, include_empty_blocks=False):
-        """Build firmware image
+    def _generate_pattern_fill_block(self, address, page_count, pattern):
+        """Stub function that defines the pattern fill block format.
+
+        *This function must be overridden by implementations that support pattern fill blocks*
+
+        :param address: Start address of the first page
+        :type address: int
+        :param page_count: Number of consecutive pages to fill
+        :type page_count: int
+        :param pattern: Pattern repeated over the pages
+        :type pattern: bytes
+        :return: Pattern fill block
+        :rtype: Child of the ImageBlockBase
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support pattern fill blocks")
+
+    def fill_pattern(self, data):
+        """Find the pattern that a page is a repetition of
+
+        :param data: Page data
+        :type data: bytes | memoryview
+        :return: Shortest repeated pattern of FILL_PATTERN_LENGTHS bytes, None if data is not a repeated pattern
+        :rtype: bytes | None
+        """
+        for length in self.FILL_PATTERN_LENGTHS:
+            if len(data) <= length or len(data) % length:
+                continue
+            # Cheap check of the ends before comparing the complete page with itself shifted by one pattern
+            if data[:length] == data[-length:] and bytes(data[length:]) == bytes(data[:-length]):
+                return bytes(data[:length])
+        return None
+
+    def iter_blocks(self, hexfile, include_empty_blocks=False, reusable_blocks=None, stats=None):
+        """Generate the blocks of a firmware image one by one
+
+        The blocks are generated in image order, starting with the metadata block.
 
-        :param builder: Firmware image builder
-        :type builder: Implementation of FirmwareImageBuilder
         :param hexfile: Source hexfile
         :type hexfile: IntelHex
         :param include_empty_blocks: Include empty memory blocks in image, defaults to False
         :type include_empty_blocks: bool, optional
-        :return: Firmware image
-        :rtype: FirmwareImage
+        :param reusable_blocks: Previously built flash write blocks by block address. A block is
+            reused instead of generated when its data is unchanged, defaults to None
+        :type reusable_blocks: dict(int, ImageBlockBase), optional
+        :param stats: Counters to add the skipped segments, skipped empty blocks and hex file bytes to,
+            defaults to None
+        :type stats: PipelineStats, optional
+        :return: Iterator of image blocks
+        :rtype: Iterator[ImageBlockBase]
         """
-        # Generate a new firmware image based on what has been defined by the inheriting class
-        image = self.firmware_image()
         # Generate the first block and add it if the block exists
         metadata_block = self._generate_metadata_block()
         # If None then skip the block write because the inheriting class does not use it
-        if metadata_block != None:
-            image.add_block(metadata_block)
+        if metadata_block is not None:
+            yield metadata_block
+
+        for segment_start, segment_data in self._iter_segments(hexfile, stats):
+            yield from self._iter_segment_flash_blocks(segment_start, segment_data, include_empty_blocks,
+                                                       reusable_blocks, stats)
+
+    def _observed_blocks(self, hexfile, include_empty_blocks, reusable_blocks, run):
+        """Generate the blocks of a firmware image, counting them in an observed run
+
+        :param hexfile: Source hexfile
+        :type hexfile: IntelHex
+        :param include_empty_blocks: Include empty memory blocks in image
+        :type include_empty_blocks: bool
+        :param reusable_blocks: Previously built flash write blocks by block address
+        :type reusable_blocks: dict(int, ImageBlockBase) | None
+        :param run: Observed run to count the blocks in, None to not count them
+        :type run: ObservedRun | None
+        :return: Iterator of image blocks
+        :rtype: Iterator[ImageBlockBase]
+        """
+        if run is None:
+            return self.iter_blocks(hexfile, include_empty_blocks, reusable_blocks)
+        return run.observe_blocks(self.iter_blocks(hexfile, include_empty_blocks, reusable_blocks, run.stats))
+
+    def _iter_segments(self, hexfile, stats=None):
+        """Extract the segments of a hexfile that belong in the image
 
-        # Parse the hexfile
+        Segments outside the memory regions of the builder are skipped with a warning.
+
+        :param hexfile: Source hexfile
+        :type hexfile: IntelHex
+        :param stats: Counters to add the skipped segments and hex file bytes to, defaults to None
+        :type stats: PipelineStats, optional
+        :return: Iterator of segment start address and segment data tuples
+        :rtype: Iterator[tuple(int, bytes)]
+        """
         segments = hexfile.segments()
         for segment in segments:
             segment_start, segment_stop = segment
@@ -369,31 +890,326 @@ class FirmwareImageBuilder(ABC):
                 txt = f"Skipping segment from 0x{segment_start:08X} to 0x{segment_stop:08X} "+\
                     "that is outside defined segments for this architecture"
                 logger.warning(txt)
+                if stats is not None:
+                    stats.segments_skipped += 1
                 continue
 
-            # Extract data for this segment
             segment_data = bytes(hexfile.tobinarray(start=segment_start, end=segment_stop-1))
             logger.debug("Adding segment of length: %d", len(segment_data))
+            if stats is not None:
+                stats.bytes_in += len(segment_data)
+            yield segment_start, segment_data
 
-            address = segment_start
-            # Loop through the segment creating blocks
-            while segment_data:
-                # Set the block address
-                logger.debug("Address: 0x%X", address)
-                if len(segment_data) >= self.write_block_size:
-                    block_data = segment_data[:self.write_block_size]
-                    segment_data = segment_data[self.write_block_size:]
-                else:
-                    block_data = segment_data
-                    segment_data = []
-                block = self._generate_flash_write_block(address, block_data)
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def _iter_segment_flash_blocks(self, segment_start, segment_data, include_empty_blocks, reusable_blocks=None,
+                                   stats=None):
+        """Generate the flash write blocks of a segment
 
-                # Add block to image, adjust remaining data and counters
-                if include_empty_blocks or not block.empty:
-                    image.add_block(block)
-                else:
-                    logger.debug("Skipping empty block at address 0x%08x", address)
+        :param segment_start: Address of the first byte in the segment
+        :type segment_start: int
+        :param segment_data: Segment data
+        :type segment_data: bytes
+        :param include_empty_blocks: Include empty memory blocks
+        :type include_empty_blocks: bool
+        :param reusable_blocks: Previously built flash write blocks by block address, defaults to None
+        :type reusable_blocks: dict(int, ImageBlockBase), optional
+        :param stats: Counters to add the skipped empty blocks to, defaults to None
+        :type stats: PipelineStats, optional
+        :return: Iterator of flash write blocks
+        :rtype: Iterator[ImageBlockBase]
+        """
+        empty_pages = set(self.empty_pages(segment_data))
+        logger.debug("Segment at 0x%08X has %d empty write blocks", segment_start, len(empty_pages))
+        if stats is not None and not include_empty_blocks:
+            # All empty pages are skipped so they are counted up front instead of in the block loop
+            stats.empty_blocks_skipped += len(empty_pages)
+        # Run of consecutive pages with the same fill pattern
+        run_address = run_pattern = None
+        run_count = 0
+
+        # The blocks hold views into the segment data so the segment is only copied once
+        blocks = self._iter_segment_blocks(segment_start, memoryview(segment_data))
+        for index, (address, block_data) in enumerate(blocks):
+            empty = index in empty_pages
+            if empty:
+                if not include_empty_blocks:
+                    continue
+                # All empty blocks share the same immutable payload
+                block_data = self.empty_block(len(block_data))
+            if self.pattern_fill_blocks:
+                pattern = self.fill_pattern(block_data) if len(block_data) == self.write_block_size else None
+                if run_count and (pattern != run_pattern or run_count == self.MAX_FILL_PAGE_COUNT or
+                                  address != run_address + run_count * self.write_block_size):
+                    yield self._generate_pattern_fill_block(run_address, run_count, run_pattern)
+                    run_count = 0
+                if pattern is not None:
+                    if not run_count:
+                        run_address, run_pattern = address, pattern
+                    run_count += 1
+                    continue
+            if reusable_blocks:
+                previous = reusable_blocks.get(self._flash_block_address(address))
+                if previous is not None and previous.data == block_data:
+                    yield previous
+                    continue
+            block = self._generate_flash_write_block(address, block_data)
+            block.empty = empty
+            yield block
+        if run_count:
+            yield self._generate_pattern_fill_block(run_address, run_count, run_pattern)
+
+    def build(self, hexfile, include_empty_blocks=False, observer=None):
+        """Build firmware image
 
-                logger.debug("Data remaining: %d", len(segment_data))
-                address += len(block_data)
+        :param hexfile: Source hexfile
+        :type hexfile: IntelHex
+        :param include_empty_blocks: Include empty memory blocks in image, defaults to False
+        :type include_empty_blocks: bool, optional
+        :param observer: Observer to report the build metrics and progress to, defaults to None
+        :type observer: PipelineObserver, optional
+        :return: Firmware image
+        :rtype: FirmwareImage
+        """
+        # Generate a new firmware image based on what has been defined by the inheriting class
+        image = self.firmware_image()
+        with observe(observer, "build") as run:
+            for block in self._observed_blocks(hexfile, include_empty_blocks, None, run):
+                image.add_block(block)
         return image
+
+    def build_incremental(self, hexfile, previous_image, include_empty_blocks=False, observer=None):
+        """Build firmware image reusing the unchanged blocks of a previously built image
+
+        Flash write blocks of the previous image are reused when a page holds the same data at
+        the same address, only changed pages are generated. The result is identical to a full
+        build. If the previous image was built with a different configuration all blocks are
+        generated again.
+
+        :param hexfile: Source hexfile
+        :type hexfile: IntelHex
+        :param previous_image: Previously built image, e.g. decoded with FirmwareImage.from_bytes
+        :type previous_image: FirmwareImage
+        :param include_empty_blocks: Include empty memory blocks in image, defaults to False
+        :type include_empty_blocks: bool, optional
+        :param observer: Observer to report the build metrics and progress to, defaults to None
+        :type observer: PipelineObserver, optional
+        :return: Firmware image
+        :rtype: FirmwareImage
+        """
+        reusable_blocks = self._previous_flash_blocks(previous_image)
+        if reusable_blocks is None:
+            logger.info("Previous image does not match the configuration, rebuilding all blocks")
+            reusable_blocks = {}
+        image = self.firmware_image()
+        with observe(observer, "build") as run:
+            for block in self._observed_blocks(hexfile, include_empty_blocks, reusable_blocks, run):
+                image.add_block(block)
+        return image
+
+    def build_delta(self, hexfile, baseline_image, include_empty_blocks=False, observer=None):
+        """Build a firmware image with only the pages that differ from a baseline image
+
+        The delta image holds the metadata block and the flash write blocks whose address is not
+        in the baseline image or whose data differs from the baseline block at that address.
+        Pages of the baseline image that the hexfile no longer writes are erased by the delta image,
+        so the baseline image followed by the delta image leaves the same flash contents as the full
+        image. The metadata block marks the image as a delta image, so the bootloader does not erase
+        the pages that the image leaves out.
+
+        :param hexfile: Source hexfile
+        :type hexfile: IntelHex
+        :param baseline_image: Image already programmed on the device, e.g. decoded with FirmwareImage.from_bytes
+        :type baseline_image: FirmwareImage
+        :param include_empty_blocks: Include empty memory blocks in image, defaults to False
+        :type include_empty_blocks: bool, optional
+        :param observer: Observer to report the build metrics and progress to, only the blocks in the
+            delta image are counted as emitted, defaults to None
+        :type observer: PipelineObserver, optional
+        :return: Firmware image
+        :rtype: FirmwareImage
+        :raises ValueError: If the image format version has no delta images or the baseline image was built
+            with a different configuration
+        """
+        if not self._supports_format_feature(self.DELTA_FORMAT_VERSION):
+            raise ValueError("Delta images are not supported by image format version "
+                             f"{self.config['bootloader']['IMAGE_FORMAT_VERSION']}")
+        baseline_blocks = self._previous_flash_blocks(baseline_image)
+        if baseline_blocks is None:
+            raise ValueError("Baseline image metadata does not match the configuration")
+        image = self.firmware_image()
+        skipped_blocks = 0
+        skipped_size = 0
+        # Pages written by the new build, including the unchanged pages that are left out
+        pages = set()
+        with observe(observer, "build") as run:
+            stats = run.stats if run is not None else None
+            for block in self.iter_blocks(hexfile, include_empty_blocks=include_empty_blocks,
+                                          reusable_blocks=baseline_blocks, stats=stats):
+                if getattr(block, "block_type", None) == BlockType.METADATA:
+                    block.flags |= block.FLAG_DELTA
+                else:
+                    pages.update(self._block_pages(block))
+                    # Blocks that are reused from the baseline are unchanged, pattern fill blocks are
+                    # generated again and are unchanged if they encode the same pages
+                    previous = baseline_blocks.get(block.address)
+                    if previous is block or (previous is not None and previous.to_bytes() == block.to_bytes()):
+                        skipped_blocks += 1
+                        skipped_size += block.block_size
+                        continue
+                image.add_block(block)
+                if run is not None:
+                    run.add_blocks(1, block.block_size)
+            baseline_pages = set()
+            for block in baseline_blocks.values():
+                baseline_pages.update(self._block_pages(block))
+            removed_pages = sorted(baseline_pages - pages)
+            for block in self._erase_blocks(removed_pages):
+                image.add_block(block)
+                if run is not None:
+                    run.add_blocks(1, block.block_size)
+        logger.info("Delta image leaves out %d unchanged blocks, saving %d bytes of transfer",
+                    skipped_blocks, skipped_size)
+        if removed_pages:
+            logger.info("Delta image erases %d pages that are not in the hexfile", len(removed_pages))
+        return image
+
+    def _block_pages(self, block):
+        """Find the flash pages that a flash write or pattern fill block writes to
+
+        :param block: Flash write or pattern fill block
+        :type block: ImageBlockBase
+        :return: Flash write block addresses of the pages
+        :rtype: range
+        """
+        page_step = self._flash_block_address(self.write_block_size)
+        end = block.address + self._flash_block_address(block.data_length)
+        return range(block.address - block.address % page_step, end, page_step)
+
+    def _erase_blocks(self, page_addresses):
+        """Generate the blocks that restore the erased state of flash pages
+
+        :param page_addresses: Sorted flash write block addresses of the pages
+        :type page_addresses: list(int)
+        :return: Iterator of flash write blocks, or pattern fill blocks if the image format has them
+        :rtype: Iterator[ImageBlockBase]
+        """
+        empty_page = self.empty_block(self.write_block_size)
+        if not self.pattern_fill_blocks:
+            for address in page_addresses:
+                block = self._generate_flash_write_block(self._hex_address(address), empty_page)
+                block.empty = True
+                yield block
+            return
+        pattern = self.fill_pattern(empty_page)
+        page_step = self._flash_block_address(self.write_block_size)
+        run_address = None
+        run_count = 0
+        for address in page_addresses:
+            if run_count and (run_count == self.MAX_FILL_PAGE_COUNT or
+                              address != run_address + run_count * page_step):
+                yield self._generate_pattern_fill_block(self._hex_address(run_address), run_count, pattern)
+                run_count = 0
+            if not run_count:
+                run_address = address
+            run_count += 1
+        if run_count:
+            yield self._generate_pattern_fill_block(self._hex_address(run_address), run_count, pattern)
+
+    def _previous_flash_blocks(self, previous_image):
+        """Collect the flash write blocks of a previously built image by address
+
+        :param previous_image: Previously built image
+        :type previous_image: FirmwareImage
+        :return: Flash write blocks by block address, None if the previous image has a different metadata block
+        :rtype: dict(int, ImageBlockBase) | None
+        """
+        previous_blocks = previous_image.blocks
+        metadata_block = self._generate_metadata_block()
+        if metadata_block is not None:
+            # The metadata holds the format version, device and keys, all flash write blocks depend on them
+            if not previous_blocks or previous_blocks[0].to_bytes() != metadata_block.to_bytes():
+                return None
+            previous_blocks = previous_blocks[1:]
+        return {block.address: block for block in previous_blocks}
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def build_to_stream(self, hexfile, fileobj, include_empty_blocks=False, engine="python", digest=None,
+                        observer=None):
+        """Build firmware image and write it directly to a file object
+
+        Each block is serialized and written as soon as it is generated so the
+        complete image is never held in memory.
+
+        :param hexfile: Source hexfile
+        :type hexfile: IntelHex
+        :param fileobj: Binary file object to write the image to
+        :type fileobj: io.BufferedIOBase
+        :param include_empty_blocks: Include empty memory blocks in image, defaults to False
+        :type include_empty_blocks: bool, optional
+        :param engine: Build engine, "python" or "numpy". The NumPy engine processes complete
+            segments at once and falls back to the python engine if NumPy is not installed.
+            Defaults to "python".
+        :type engine: str, optional
+        :param digest: Digest to update with each block as it is written, defaults to None
+        :type digest: ImageDigest, optional
+        :param observer: Observer to report the build metrics and progress to, defaults to None
+        :type observer: PipelineObserver, optional
+        :return: Number of bytes written
+        :rtype: int
+        """
+        with observe(observer, "build") as run:
+            return self._build_to_stream(hexfile, fileobj, include_empty_blocks, engine, digest, run)
+
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def _build_to_stream(self, hexfile, fileobj, include_empty_blocks, engine, digest, run):
+        """Build firmware image and write it directly to a file object
+
+        :param hexfile: Source hexfile
+        :type hexfile: IntelHex
+        :param fileobj: Binary file object to write the image to
+        :type fileobj: io.BufferedIOBase
+        :param include_empty_blocks: Include empty memory blocks in image
+        :type include_empty_blocks: bool
+        :param engine: Build engine, "python" or "numpy"
+        :type engine: str
+        :param digest: Digest to update with each block as it is written
+        :type digest: ImageDigest | None
+        :param run: Observed run to count the blocks in, None to not count them
+        :type run: ObservedRun | None
+        :return: Number of bytes written
+        :rtype: int
+        """
+        if engine == "numpy":
+            # pylint: disable-next=import-outside-toplevel
+            from . import numpyengine
+            if self.compress_blocks or self.pattern_fill_blocks:
+                # Compressed and pattern fill blocks have a different size for each page
+                logger.debug("The NumPy engine only supports plain flash write blocks, using the python build engine")
+            elif numpyengine.is_available():
+                return numpyengine.build_to_stream(self, hexfile, fileobj, include_empty_blocks=include_empty_blocks,
+                                                   digest=digest, run=run)
+            else:
+                logger.warning("NumPy is not installed, falling back to the python build engine")
+        elif engine != "python":
+            raise ValueError(f"Unknown build engine '{engine}'")
+
+        size = 0
+        for block in self._observed_blocks(hexfile, include_empty_blocks, None, run):
+            size += FirmwareImage.write_block(fileobj, block, digest)
+        return size
+
+    def _iter_segment_blocks(self, segment_start, segment_data):
+        """Split a segment into write blocks
+
+        The last block of the segment is shorter than the write block size if the
+        segment length is not a multiple of it.
+
+        :param segment_start: Address of the first byte in the segment
+        :type segment_start: int
+        :param segment_data: Segment data
+        :type segment_data: memoryview
+        :return: Iterator of block address and block data tuples, the block data are views into segment_data
+        :rtype: Iterator[tuple(int, memoryview)]
+        """
+        for offset in range(0, len(segment_data), self.write_block_size):
+            yield segment_start + offset, segment_data[offset:offset + self.write_block_size]
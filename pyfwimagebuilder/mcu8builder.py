@@ -1,9 +1,13 @@
 """
 Common Firmware Builder functions for MCU8 builders.
 """
+import io
+import struct
+import textwrap
 from logging import getLogger
 from packaging.version import Version
 from .imagebuilder import FirmwareImageBuilder, BlockType, ImageBlockBase, FirmwareImage
+from .compression import compress, decompress
 
 logger = getLogger(__name__)
 
@@ -11,6 +15,7 @@ class Mcu8ImageBlockBase(ImageBlockBase):
     """
     Base class for firmware image blocks.
     """
+    __slots__ = ()
     @classmethod
     def from_bytes(cls, data: bytes|bytearray):
         """
@@ -19,7 +24,7 @@ class Mcu8ImageBlockBase(ImageBlockBase):
         :param data: The byte data to decode.
         :type data: bytes|bytearray
         :return: An instance of the appropriate image block subclass.
-        :rtype: MetaDataBlock | FlashWriteBlock
+        :rtype: MetaDataBlock | FlashWriteBlock | CompressedFlashWriteBlock | PatternFillBlock
         """
         _, block_type = cls.decode_block_header(data)
         block = None
@@ -27,6 +32,10 @@ class Mcu8ImageBlockBase(ImageBlockBase):
             block = MetaDataBlock.from_bytes(data)
         elif block_type == BlockType.FLASH_OPERATION:
             block = FlashWriteBlock.from_bytes(data)
+        elif block_type == BlockType.COMPRESSED_FLASH_OPERATION:
+            block = CompressedFlashWriteBlock.from_bytes(data)
+        elif block_type == BlockType.PATTERN_FILL:
+            block = PatternFillBlock.from_bytes(data)
 
         return block
 
@@ -47,10 +56,15 @@ class FlashWriteBlock(Mcu8ImageBlockBase):
     :type page_read_key: int
     :param data: The data to be written to flash. Must be padded to
     flash block write size.
-    :type data: bytes
+    :type data: bytes|memoryview
     """
     KEY_LENGTH = 2
+    __slots__ = ('block_size', 'address', 'page_erase_key', 'page_write_key', 'byte_write_key', 'page_read_key',
+                 'data', '_empty')
+    BLOCK_TYPE = BlockType.FLASH_OPERATION
     ADDRESS_LENGTH = 4
+    # Block size, block type, address and the four keys
+    HEADER_STRUCT = struct.Struct("<HBIHHHH")
     # pylint: disable=too-many-arguments,too-many-positional-arguments
     def __init__(self, address, page_erase_key,
                  page_write_key, byte_write_key, page_read_key, data):
@@ -64,6 +78,15 @@ class FlashWriteBlock(Mcu8ImageBlockBase):
         self.data = data
         self._empty = False
 
+    @property
+    def data_length(self):
+        """Number of flash bytes written by the block
+
+        :return: Length of the data
+        :rtype: int
+        """
+        return len(self.data)
+
     def __str__(self):
         """
         Return a string representation of the flash write block.
@@ -71,12 +94,23 @@ class FlashWriteBlock(Mcu8ImageBlockBase):
         :return: A string representation of the flash write block.
         :rtype: str
         """
+        txt = io.StringIO()
+        self.dump(txt)
+        return txt.getvalue()
+
+    def _header_str(self):
+        """
+        Return a string representation of the flash write block fields.
+
+        :return: A string representation of the block fields.
+        :rtype: str
+        """
         block_length_bit_length = self.BLOCK_SIZE_LENGTH * 8
         address_length_bit_length = self.ADDRESS_LENGTH * 8
         key_bit_length = self.KEY_LENGTH * 8
-        txt = f"""\
+        return f"""\
 Block size: {self._pad_to_hex(self.block_size, block_length_bit_length)} ({self.block_size})
-Block type: {BlockType.FLASH_OPERATION.name} (0x{BlockType.FLASH_OPERATION.value:X})
+Block type: {self.BLOCK_TYPE.name} (0x{self.BLOCK_TYPE.value:X})
 Page erase key: {self._pad_to_hex(self.page_erase_key, key_bit_length)}
 Page write key: {self._pad_to_hex(self.page_write_key, key_bit_length)}
 Byte write key: {self._pad_to_hex(self.byte_write_key, key_bit_length)}
@@ -84,27 +118,18 @@ Page read key: {self._pad_to_hex(self.page_read_key, key_bit_length)}
 Start address: {self._pad_to_hex(self.address, address_length_bit_length)}
 Data bytes: 0x{len(self.data):X} ({len(self.data)})
 """
-        data_txt = "Address   00 01 02 03 04 05 06 07 08 09 0A 0B 0C 0D 0E 0F\n"
-        full_blocks = len(self.data) // 16
-
-        for i in range(full_blocks):
-            address = self.address + i * 16
-            data_txt += f"{address:08X} "
-            tmp = self.data[16*i:16*(i+1)]
-            for byte in tmp:
-                data_txt += f" {byte:02X}"
-            data_txt += "\n"
-
-        # Handle remaining bytes
-        remaining_bytes = len(self.data) % 16
-        if remaining_bytes > 0:
-            address = self.address + full_blocks * 16
-            data_txt += f"{address:08X}  "
-            tmp = self.data[full_blocks * 16:]
-            for byte in tmp:
-                data_txt += f" {byte:02X}"
-            data_txt += "\n"
-        return txt + data_txt
+
+    def dump(self, fileobj, indent=""):
+        """
+        Write the string representation of the flash write block to a text file object.
+
+        :param fileobj: Text file object
+        :type fileobj: io.TextIOBase
+        :param indent: Prefix for each line, defaults to no indentation
+        :type indent: str, optional
+        """
+        fileobj.write(textwrap.indent(self._header_str(), indent))
+        self._dump_data(fileobj, self.address, self.data, indent)
 
     @classmethod
     def from_bytes(cls, data: bytes|bytearray):
@@ -118,20 +143,27 @@ Data bytes: 0x{len(self.data):X} ({len(self.data)})
         :raises ValueError: If the block type is not FLASH_OPERATION.
         """
         _, block_type = cls.decode_block_header(data)
-        if block_type != BlockType.FLASH_OPERATION:
-            raise ValueError(f"Expected {BlockType.FLASH_OPERATION.name} (0x{BlockType.FLASH_OPERATION.value:02X}) "+ \
+        if block_type != cls.BLOCK_TYPE:
+            raise ValueError(f"Expected {cls.BLOCK_TYPE.name} (0x{cls.BLOCK_TYPE.value:02X}) "+ \
                             f"block type but got 0x{block_type.value:02X}")
-        data = data[3:]
-        address = int.from_bytes(data[:cls.ADDRESS_LENGTH], byteorder="little")
-        page_erase_key = int.from_bytes(data[4:6], byteorder="little")
-        page_write_key = int.from_bytes(data[6:8], byteorder="little")
-        byte_write_key = int.from_bytes(data[8:10], byteorder="little")
-        page_read_key = int.from_bytes(data[10:12], byteorder="little")
-        flash_data = data[12:]
+        _, _, address, page_erase_key, page_write_key, byte_write_key, page_read_key = \
+            cls.HEADER_STRUCT.unpack_from(data)
+        flash_data = data[cls.HEADER_STRUCT.size:]
         flash_block = cls(address, page_erase_key, page_write_key,
                           byte_write_key, page_read_key, flash_data)
         return flash_block
 
+    def _header_to_bytes(self):
+        """
+        Convert the flash write operation block header to bytes.
+
+        :return: The byte representation of the block header.
+        :rtype: bytes
+        """
+        return self.HEADER_STRUCT.pack(self.block_size, self.BLOCK_TYPE.value, self.address,
+                                       self.page_erase_key, self.page_write_key,
+                                       self.byte_write_key, self.page_read_key)
+
     def to_bytes(self):
         """
         Convert the flash write operation block to bytes.
@@ -139,15 +171,266 @@ Data bytes: 0x{len(self.data):X} ({len(self.data)})
         :return: The byte representation of the flash write block.
         :rtype: bytes
         """
-        block = self.block_size.to_bytes(self.BLOCK_SIZE_LENGTH, byteorder="little") + \
-            bytes([BlockType.FLASH_OPERATION.value]) + \
-            self.address.to_bytes(self.ADDRESS_LENGTH, byteorder="little") + \
-            self.page_erase_key.to_bytes(self.KEY_LENGTH, byteorder="little") + \
-            self.page_write_key.to_bytes(self.KEY_LENGTH, byteorder="little") + \
-            self.byte_write_key.to_bytes(self.KEY_LENGTH, byteorder="little") + \
-            self.page_read_key.to_bytes(self.KEY_LENGTH, byteorder="little") + \
-            self.data
-        return block
+        return self._header_to_bytes() + self.data
+
+    def to_buffers(self):
+        """
+        Convert the flash write operation block to a header and a payload buffer.
+
+        :return: Block header and block data
+        :rtype: tuple(bytes, bytes|memoryview)
+        """
+        return self._header_to_bytes(), self.data
+
+    def pack_into(self, buffer, offset):
+        """
+        Write the flash write operation block into a buffer.
+
+        :param buffer: Writable buffer with room for the block at offset
+        :type buffer: bytearray
+        :param offset: Offset of the block in the buffer
+        :type offset: int
+        :return: Offset of the first byte after the block
+        :rtype: int
+        """
+        self.HEADER_STRUCT.pack_into(buffer, offset, self.block_size, self.BLOCK_TYPE.value,
+                                     self.address, self.page_erase_key, self.page_write_key,
+                                     self.byte_write_key, self.page_read_key)
+        data_offset = offset + self.HEADER_STRUCT.size
+        end = data_offset + len(self.data)
+        buffer[data_offset:end] = self.data
+        return end
+
+class CompressedFlashWriteBlock(FlashWriteBlock):
+    """
+    Class representing a flash write operation block with a compressed payload.
+
+    The block header has the same fields as the flash write block followed by the length
+    of the expanded data. The data attribute holds the expanded data.
+
+    :param address: The start address for the flash write operation.
+    :type address: int
+    :param page_erase_key: The key for page erase operations.
+    :type page_erase_key: int
+    :param page_write_key: The key for page write operations.
+    :type page_write_key: int
+    :param byte_write_key: The key for byte write operations.
+    :type byte_write_key: int
+    :param page_read_key: The key for page read operations.
+    :type page_read_key: int
+    :param data: The data to be written to flash.
+    :type data: bytes|memoryview
+    :param compressed_data: The compressed data, compressed from data if not given.
+    :type compressed_data: bytes, optional
+    """
+    __slots__ = ('compressed_data',)
+    BLOCK_TYPE = BlockType.COMPRESSED_FLASH_OPERATION
+    DATA_LENGTH_LENGTH = 2
+    # Block size, block type, address, the four keys and the expanded data length
+    HEADER_STRUCT = struct.Struct("<HBIHHHHH")
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def __init__(self, address, page_erase_key,
+                 page_write_key, byte_write_key, page_read_key, data, compressed_data=None):
+        super().__init__(address, page_erase_key, page_write_key, byte_write_key, page_read_key, data)
+        if compressed_data is None:
+            compressed_data = compress(data)
+        self.compressed_data = compressed_data
+        self.block_size = self.HEADER_STRUCT.size + len(compressed_data)
+
+    def _header_str(self):
+        """
+        Return a string representation of the compressed flash write block fields.
+
+        :return: A string representation of the block fields.
+        :rtype: str
+        """
+        # The compressed size follows the expanded data size
+        return super()._header_str() + \
+            f"Compressed bytes: 0x{len(self.compressed_data):X} ({len(self.compressed_data)})\n"
+
+    @classmethod
+    def from_bytes(cls, data: bytes|bytearray):
+        """
+        Create a compressed flash write block from the given byte data.
+
+        :param data: The byte data to decode.
+        :type data: bytes|bytearray
+        :return: An instance of CompressedFlashWriteBlock.
+        :rtype: CompressedFlashWriteBlock
+        :raises ValueError: If the block type is not COMPRESSED_FLASH_OPERATION or the payload is corrupt.
+        """
+        _, block_type = cls.decode_block_header(data)
+        if block_type != cls.BLOCK_TYPE:
+            raise ValueError(f"Expected {cls.BLOCK_TYPE.name} (0x{cls.BLOCK_TYPE.value:02X}) "+ \
+                            f"block type but got 0x{block_type.value:02X}")
+        _, _, address, page_erase_key, page_write_key, byte_write_key, page_read_key, data_length = \
+            cls.HEADER_STRUCT.unpack_from(data)
+        compressed_data = bytes(data[cls.HEADER_STRUCT.size:])
+        return cls(address, page_erase_key, page_write_key, byte_write_key, page_read_key,
+                   decompress(compressed_data, data_length), compressed_data)
+
+    def _header_to_bytes(self):
+        """
+        Convert the compressed flash write operation block header to bytes.
+
+        :return: The byte representation of the block header.
+        :rtype: bytes
+        """
+        return self.HEADER_STRUCT.pack(self.block_size, self.BLOCK_TYPE.value, self.address,
+                                       self.page_erase_key, self.page_write_key,
+                                       self.byte_write_key, self.page_read_key, len(self.data))
+
+    def to_bytes(self):
+        """
+        Convert the compressed flash write operation block to bytes.
+
+        :return: The byte representation of the compressed flash write block.
+        :rtype: bytes
+        """
+        return self._header_to_bytes() + self.compressed_data
+
+    def to_buffers(self):
+        """
+        Convert the compressed flash write operation block to a header and a payload buffer.
+
+        :return: Block header and compressed data
+        :rtype: tuple(bytes, bytes)
+        """
+        return self._header_to_bytes(), self.compressed_data
+
+    def pack_into(self, buffer, offset):
+        """
+        Write the compressed flash write operation block into a buffer.
+
+        :param buffer: Writable buffer with room for the block at offset
+        :type buffer: bytearray
+        :param offset: Offset of the block in the buffer
+        :type offset: int
+        :return: Offset of the first byte after the block
+        :rtype: int
+        """
+        end = offset + self.block_size
+        buffer[offset:end] = self.to_bytes()
+        return end
+
+# pylint: disable=too-many-instance-attributes
+class PatternFillBlock(Mcu8ImageBlockBase):
+    """
+    Class representing a block that fills consecutive flash pages with a repeated pattern.
+
+    :param address: The start address of the first page.
+    :type address: int
+    :param page_erase_key: The key for page erase operations.
+    :type page_erase_key: int
+    :param page_write_key: The key for page write operations.
+    :type page_write_key: int
+    :param byte_write_key: The key for byte write operations.
+    :type byte_write_key: int
+    :param page_read_key: The key for page read operations.
+    :type page_read_key: int
+    :param page_length: The length of each page in bytes.
+    :type page_length: int
+    :param page_count: The number of pages to fill.
+    :type page_count: int
+    :param pattern: The byte or word pattern repeated over the pages.
+    :type pattern: bytes
+    """
+    __slots__ = ('block_size', 'address', 'page_erase_key', 'page_write_key', 'byte_write_key', 'page_read_key',
+                 'page_length', 'page_count', 'pattern', '_empty')
+    BLOCK_TYPE = BlockType.PATTERN_FILL
+    KEY_LENGTH = 2
+    ADDRESS_LENGTH = 4
+    # Block size, block type, address, the four keys, page length and page count
+    HEADER_STRUCT = struct.Struct("<HBIHHHHHH")
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def __init__(self, address, page_erase_key, page_write_key, byte_write_key, page_read_key,
+                 page_length, page_count, pattern):
+        self.block_size = self.HEADER_STRUCT.size + len(pattern)
+        self.address = address
+        self.page_erase_key = page_erase_key
+        self.page_write_key = page_write_key
+        self.byte_write_key = byte_write_key
+        self.page_read_key = page_read_key
+        self.page_length = page_length
+        self.page_count = page_count
+        self.pattern = pattern
+        self._empty = False
+
+    @property
+    def data_length(self):
+        """Number of flash bytes written by the block, without expanding the pattern
+
+        :return: Length of all pages
+        :rtype: int
+        """
+        return self.page_length * self.page_count
+
+    @property
+    def data(self):
+        """Expanded data of all pages
+
+        :return: The pattern repeated over all pages
+        :rtype: bytes
+        """
+        return self.pattern * (self.page_length * self.page_count // len(self.pattern))
+
+    def __str__(self):
+        """
+        Return a string representation of the pattern fill block.
+
+        :return: A string representation of the pattern fill block.
+        :rtype: str
+        """
+        block_length_bit_length = self.BLOCK_SIZE_LENGTH * 8
+        address_length_bit_length = self.ADDRESS_LENGTH * 8
+        key_bit_length = self.KEY_LENGTH * 8
+        return f"""\
+Block size: {self._pad_to_hex(self.block_size, block_length_bit_length)} ({self.block_size})
+Block type: {self.BLOCK_TYPE.name} (0x{self.BLOCK_TYPE.value:X})
+Page erase key: {self._pad_to_hex(self.page_erase_key, key_bit_length)}
+Page write key: {self._pad_to_hex(self.page_write_key, key_bit_length)}
+Byte write key: {self._pad_to_hex(self.byte_write_key, key_bit_length)}
+Page read key: {self._pad_to_hex(self.page_read_key, key_bit_length)}
+Start address: {self._pad_to_hex(self.address, address_length_bit_length)}
+Page length: 0x{self.page_length:X} ({self.page_length})
+Page count: {self.page_count}
+Pattern: {self.pattern.hex(' ').upper()}
+"""
+
+    @classmethod
+    def from_bytes(cls, data: bytes|bytearray):
+        """
+        Create a pattern fill block from the given byte data.
+
+        :param data: The byte data to decode.
+        :type data: bytes|bytearray
+        :return: An instance of PatternFillBlock.
+        :rtype: PatternFillBlock
+        :raises ValueError: If the block type is not PATTERN_FILL or the pattern does not fit the pages.
+        """
+        _, block_type = cls.decode_block_header(data)
+        if block_type != cls.BLOCK_TYPE:
+            raise ValueError(f"Expected {cls.BLOCK_TYPE.name} (0x{cls.BLOCK_TYPE.value:02X}) "+ \
+                            f"block type but got 0x{block_type.value:02X}")
+        _, _, address, page_erase_key, page_write_key, byte_write_key, page_read_key, page_length, page_count = \
+            cls.HEADER_STRUCT.unpack_from(data)
+        pattern = bytes(data[cls.HEADER_STRUCT.size:])
+        if not pattern or page_length % len(pattern):
+            raise ValueError(f"Pattern length {len(pattern)} does not fit page length {page_length}")
+        return cls(address, page_erase_key, page_write_key, byte_write_key, page_read_key,
+                   page_length, page_count, pattern)
+
+    def to_bytes(self):
+        """
+        Convert the pattern fill block to bytes.
+
+        :return: The byte representation of the pattern fill block.
+        :rtype: bytes
+        """
+        return self.HEADER_STRUCT.pack(self.block_size, self.BLOCK_TYPE.value, self.address,
+                                       self.page_erase_key, self.page_write_key,
+                                       self.byte_write_key, self.page_read_key,
+                                       self.page_length, self.page_count) + self.pattern
 
 # pylint: disable=too-many-instance-attributes
 class MetaDataBlock(Mcu8ImageBlockBase):
@@ -173,12 +456,21 @@ class MetaDataBlock(Mcu8ImageBlockBase):
     :param page_read_key: The key for page read operations.
     :type page_read_key: int
     """
+    __slots__ = ('block_type', 'block_size', 'version', 'device_id', 'write_block_size', 'address', 'page_erase_key',
+                 'page_write_key', 'byte_write_key', 'page_read_key', 'flags', 'padding')
     METADATA_LENGTH = 21
     KEY_LENGTH = 2
     ADDRESS_LENGTH = 4
     FLASH_WRITE_LENGTH = 2
     DEVICE_ID_LENGTH = 4
     FLASH_WRITE_HEADER_LENGTH = 15
+    # Block size, block type, version (micro, minor, major), device ID, write block size,
+    # address and the four keys
+    METADATA_STRUCT = struct.Struct("<HBBBBIHIHHHH")
+    # First format version with a flags byte after the metadata fields
+    FLAGS_FORMAT_VERSION = Version("0.6.0")
+    # Flag for images that only hold the pages that differ from the image on the device
+    FLAG_DELTA = 0x01
     # pylint: disable=too-many-arguments, too-many-positional-arguments
     def __init__(self, version: Version, device_id, write_block_size, address,
                  page_erase_key, page_write_key, byte_write_key, page_read_key):
@@ -192,6 +484,7 @@ class MetaDataBlock(Mcu8ImageBlockBase):
         self.page_write_key = page_write_key
         self.byte_write_key = byte_write_key
         self.page_read_key = page_read_key
+        self.flags = 0
         self.padding = None
 
     @classmethod
@@ -210,22 +503,20 @@ class MetaDataBlock(Mcu8ImageBlockBase):
             raise ValueError(f"Block size ({block_size})does not match actual block length ({len(data)})")
         if block_type != BlockType.METADATA:
             raise ValueError("Block type is not a metadata block")
-        data = data[3:]
-        if len(data) < cls.METADATA_LENGTH:
+        if len(data) < cls.METADATA_STRUCT.size:
             raise ValueError("Not enough data to decode metadata. " +
-                             f"Need {cls.METADATA_LENGTH} bytes but got {len(data)}")
-        version = Version(f"{data[0]}.{data[1]}.{data[2]}")
-        device_id = int.from_bytes(data[3:7], "little")
-        write_block_size = int.from_bytes(data[7:9], "little")
-        address = int.from_bytes(data[9:13], "little")
-        page_erase_key = int.from_bytes(data[13:15], "little")
-        page_write_key = int.from_bytes(data[15:17], "little")
-        byte_write_key = int.from_bytes(data[17:19], "little")
-        page_read_key = int.from_bytes(data[19:21], "little")
-        padding = data[21:]
+                             f"Need {cls.METADATA_LENGTH} bytes but got {len(data) - cls.BLOCK_HEADER_SIZE}")
+        (_, _, version_0, version_1, version_2, device_id, write_block_size, address,
+         page_erase_key, page_write_key, byte_write_key, page_read_key) = cls.METADATA_STRUCT.unpack_from(data)
+        version = Version(f"{version_0}.{version_1}.{version_2}")
 
         meta_block = cls(version, device_id, write_block_size, address,
                    page_erase_key, page_write_key, byte_write_key, page_read_key)
+        padding = data[cls.METADATA_STRUCT.size:]
+        if version >= cls.FLAGS_FORMAT_VERSION and padding:
+            # The flags are stored in the first padding byte
+            meta_block.flags = padding[0]
+            padding = padding[1:]
         meta_block.padding = padding
         return meta_block
 
@@ -236,20 +527,40 @@ class MetaDataBlock(Mcu8ImageBlockBase):
         :return: The byte representation of the metadata block.
         :rtype: bytes
         """
+        block = bytearray(self.block_size)
+        self.pack_into(block, 0)
+        return bytes(block)
 
-        padding = self.block_size - self.BLOCK_HEADER_SIZE - self.METADATA_LENGTH
-        block = self.block_size.to_bytes(self.BLOCK_SIZE_LENGTH, byteorder="little") + \
-            bytes([BlockType.METADATA.value]) + \
-            bytes([self.version.micro, self.version.minor, self.version.major]) + \
-            self.device_id.to_bytes(self.DEVICE_ID_LENGTH, byteorder="little") + \
-            self.write_block_size.to_bytes(self.FLASH_WRITE_LENGTH, byteorder="little") + \
-            self.address.to_bytes(self.ADDRESS_LENGTH, "little") + \
-            self.page_erase_key.to_bytes(self.KEY_LENGTH, "little") + \
-            self.page_write_key.to_bytes(self.KEY_LENGTH, "little") + \
-            self.byte_write_key.to_bytes(self.KEY_LENGTH, "little") + \
-            self.page_read_key.to_bytes(self.KEY_LENGTH, "little") + \
-            bytes(padding)
-        return block
+    def pack_into(self, buffer, offset):
+        """
+        Write the metadata block into a buffer.
+
+        Only the flags are written, the buffer must already contain zeros in the rest of the padding.
+
+        :param buffer: Writable buffer with room for the block at offset
+        :type buffer: bytearray
+        :param offset: Offset of the block in the buffer
+        :type offset: int
+        :return: Offset of the first byte after the block
+        :rtype: int
+        """
+        self.METADATA_STRUCT.pack_into(buffer, offset, self.block_size, BlockType.METADATA.value,
+                                       self.version.micro, self.version.minor, self.version.major,
+                                       self.device_id, self.write_block_size, self.address,
+                                       self.page_erase_key, self.page_write_key,
+                                       self.byte_write_key, self.page_read_key)
+        if self.flags:
+            buffer[offset + self.METADATA_STRUCT.size] = self.flags
+        return offset + self.block_size
+
+    @property
+    def delta(self):
+        """Delta image status
+
+        :return: True if the image only holds the pages that differ from the image on the device
+        :rtype: bool
+        """
+        return bool(self.flags & self.FLAG_DELTA)
 
     def __str__(self):
         """
@@ -274,6 +585,8 @@ Page erase key: {self._pad_to_hex(self.page_erase_key, key_bit_length)}
 Page write key: {self._pad_to_hex(self.page_write_key, key_bit_length)}
 Byte write key: {self._pad_to_hex(self.byte_write_key, key_bit_length)}
 Page read key: {self._pad_to_hex(self.page_read_key, key_bit_length)}"""
+        if self.version >= self.FLAGS_FORMAT_VERSION:
+            txt += f"\nFlags: 0x{self.flags:02X}" + (" (delta image)" if self.delta else "")
         pad_txt = ""
         if self.padding is not None and self._verify_padding(self.padding):
             pad_txt = f"\nBlock padded with {len(self.padding)} zeros"
@@ -288,8 +601,11 @@ class FirmwareImageBuilderMcu8 (FirmwareImageBuilder):
     """
     UNDEFINED_SEQUENCE = 0xFF
     UNDEFINED_SEQUENCE_BYTE_LENGTH = 1
-    MAX_FORMAT_VERSION = "0.3.0"
+    MAX_FORMAT_VERSION = "0.6.0"
     MIN_FORMAT_VERSION = "0.3.0"
+    COMPRESSED_FORMAT_VERSION = "0.4.0"
+    PATTERN_FILL_FORMAT_VERSION = "0.5.0"
+    DELTA_FORMAT_VERSION = "0.6.0"
 
     def include_segment(self, start_address, end_address):
         """
@@ -311,19 +627,26 @@ class FirmwareImageBuilderMcu8 (FirmwareImageBuilder):
             return True
         return False
 
+    def _flash_keys(self):
+        return (self.config["bootloader"]["PAGE_ERASE_KEY"],
+                self.config["bootloader"]["PAGE_WRITE_KEY"],
+                self.config["bootloader"]["BYTE_WRITE_KEY"],
+                self.config["bootloader"]["PAGE_READ_KEY"])
+
     def _generate_flash_write_block(self, address, data):
-        block = FlashWriteBlock(address,
-                      self.config["bootloader"]["PAGE_ERASE_KEY"],
-                      self.config["bootloader"]["PAGE_WRITE_KEY"],
-                      self.config["bootloader"]["BYTE_WRITE_KEY"],
-                      self.config["bootloader"]["PAGE_READ_KEY"],
-                      data)
-        if data == self.empty_block(len(data)):
-            block.empty = True
-        else:
-            block.empty = False
+        keys = self._flash_keys()
+        block = FlashWriteBlock(self._flash_block_address(address), *keys, data)
+        if self.compress_blocks:
+            compressed_block = CompressedFlashWriteBlock(self._flash_block_address(address), *keys, data)
+            # Fall back to the plain block when compression does not make the block smaller
+            if compressed_block.block_size < block.block_size:
+                block = compressed_block
         return block
 
+    def _generate_pattern_fill_block(self, address, page_count, pattern):
+        return PatternFillBlock(self._flash_block_address(address), *self._flash_keys(),
+                                self.write_block_size, page_count, pattern)
+
     def _generate_metadata_block(self):
         version = Version(self.config["bootloader"]["IMAGE_FORMAT_VERSION"])
         return MetaDataBlock(version,
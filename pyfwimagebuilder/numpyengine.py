@@ -0,0 +1,145 @@
+"""
+NumPy based build engine
+
+Builds the flash write blocks of complete segments at once instead of one block at a time.
+Each segment is loaded into a NumPy array and reshaped into one row per write block, empty
+rows are found with a single reduction and the block records (header and payload) for all
+remaining rows are assembled in a structured array that is written to the output in one go.
+
+The output is identical to FirmwareImageBuilder.build_to_stream. NumPy is an optional
+dependency, use is_available() to check whether this engine can be used.
+"""
+from logging import getLogger
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = getLogger(__name__)
+
+# Offset and length of the address field in flash write block headers, it follows
+# directly after the common block size and block type fields
+ADDRESS_OFFSET = 3
+ADDRESS_LENGTH = 4
+
+def is_available():
+    """Check if NumPy is installed
+
+    :return: True if the NumPy engine can be used
+    :rtype: bool
+    """
+    return np is not None
+
+def _record_dtype(header_length, payload_length):
+    """Create the structured data type of a flash write block record
+
+    :param header_length: Flash write block header length in bytes
+    :type header_length: int
+    :param payload_length: Flash write block payload length in bytes
+    :type payload_length: int
+    :return: Packed structured data type with header fields and payload
+    :rtype: numpy.dtype
+    """
+    fields = [('prefix', np.uint8, (ADDRESS_OFFSET,)),
+              ('address', '<u4')]
+    keys_length = header_length - ADDRESS_OFFSET - ADDRESS_LENGTH
+    if keys_length:
+        fields.append(('keys', np.uint8, (keys_length,)))
+    fields.append(('payload', np.uint8, (payload_length,)))
+    return np.dtype(fields)
+
+def build_segment(builder, segment_start, segment_data, include_empty_blocks=False):
+    """Build the flash write block records of all complete write blocks in a segment
+
+    :param builder: Image builder
+    :type builder: FirmwareImageBuilder
+    :param segment_start: Address of the first byte in the segment
+    :type segment_start: int
+    :param segment_data: Segment data
+    :type segment_data: bytes
+    :param include_empty_blocks: Include empty memory blocks, defaults to False
+    :type include_empty_blocks: bool, optional
+    :return: Serialized blocks as a structured array
+    :rtype: numpy.ndarray
+    """
+    page_size = builder.write_block_size
+    page_count = len(segment_data) // page_size
+    pages = np.frombuffer(segment_data, dtype=np.uint8, count=page_count * page_size).reshape(page_count, page_size)
+
+    fill = np.frombuffer(builder.empty_block(page_size), dtype=np.uint8)
+    if include_empty_blocks:
+        rows = np.arange(page_count)
+    else:
+        empty = (pages == fill).all(axis=1)
+        rows = np.flatnonzero(~empty)
+
+    # All complete write blocks of a builder share the same header apart from the address
+    template = builder._generate_flash_write_block(0, builder.empty_block(page_size)) # pylint: disable=protected-access
+    header = np.frombuffer(template.to_buffers()[0], dtype=np.uint8)
+
+    records = np.empty(len(rows), dtype=_record_dtype(len(header), page_size))
+    records['prefix'] = header[:ADDRESS_OFFSET]
+    addresses = segment_start + rows.astype(np.uint64) * page_size
+    # pylint: disable-next=protected-access
+    records['address'] = builder._flash_block_address(addresses)
+    if 'keys' in records.dtype.names:
+        records['keys'] = header[ADDRESS_OFFSET + ADDRESS_LENGTH:]
+    records['payload'] = pages[rows]
+    return records
+
+# pylint: disable-next=too-many-arguments,too-many-positional-arguments
+def build_to_stream(builder, hexfile, fileobj, include_empty_blocks=False, digest=None, run=None):
+    """Build firmware image and write it to a file object using NumPy
+
+    :param builder: Image builder
+    :type builder: FirmwareImageBuilder
+    :param hexfile: Source hexfile
+    :type hexfile: IntelHex
+    :param fileobj: Binary file object to write the image to
+    :type fileobj: io.BufferedIOBase
+    :param include_empty_blocks: Include empty memory blocks in image, defaults to False
+    :type include_empty_blocks: bool, optional
+    :param digest: Digest to update with each block as it is written, defaults to None
+    :type digest: ImageDigest, optional
+    :param run: Observed run to count the blocks in, progress is reported once per segment, defaults to None
+    :type run: ObservedRun, optional
+    :return: Number of bytes written
+    :rtype: int
+    """
+    # pylint: disable=protected-access
+    size = 0
+    metadata_block = builder._generate_metadata_block()
+    if metadata_block is not None:
+        size += builder.firmware_image.write_block(fileobj, metadata_block, digest)
+        if run is not None:
+            run.add_blocks(1, metadata_block.block_size)
+
+    stats = run.stats if run is not None else None
+    page_size = builder.write_block_size
+    for segment_start, segment_data in builder._iter_segments(hexfile, stats):
+        full_pages_length = len(segment_data) - len(segment_data) % page_size
+        if full_pages_length:
+            records = build_segment(builder, segment_start, segment_data, include_empty_blocks)
+            logger.debug("Writing %d blocks for segment at 0x%08X", len(records), segment_start)
+            data = memoryview(records.view(np.uint8))
+            fileobj.write(data)
+            if digest is not None:
+                record_size = records.itemsize
+                for offset in range(0, records.nbytes, record_size):
+                    digest.add_block((data[offset:offset + record_size],))
+            size += records.nbytes
+            if run is not None:
+                if not include_empty_blocks:
+                    stats.empty_blocks_skipped += full_pages_length // page_size - len(records)
+                run.add_blocks(len(records), records.nbytes)
+        if full_pages_length != len(segment_data):
+            # The last block of the segment is shorter than a write block, use the common code for it
+            tail = segment_data[full_pages_length:]
+            blocks = builder._iter_segment_flash_blocks(segment_start + full_pages_length, tail, include_empty_blocks,
+                                                        stats=stats)
+            if run is not None:
+                blocks = run.observe_blocks(blocks)
+            for block in blocks:
+                size += builder.firmware_image.write_block(fileobj, block, digest)
+    return size
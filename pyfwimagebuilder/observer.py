@@ -0,0 +1,170 @@
+"""
+Metrics and progress reporting for the build and decode pipelines
+
+An application that embeds the builder passes a PipelineObserver to FirmwareImageBuilder.build
+or FirmwareImage.decode and receives the counters of the run:
+
+    class ProgressObserver(PipelineObserver):
+        def progress(self, stats):
+            print(f"{stats.blocks} blocks, {stats.bytes_out} bytes")
+
+    image = builder.build(hexfile, observer=ProgressObserver())
+
+Progress is reported in batches of at least progress_interval blocks, not for every block.
+Nothing is counted when no observer is given.
+"""
+import time
+from contextlib import contextmanager
+
+# Minimum number of blocks between progress events
+PROGRESS_INTERVAL = 256
+
+class PipelineStats:
+    """Counters of a build or decode run
+
+    Attributes:
+        blocks : int
+            Number of blocks emitted by a build or found by a decode
+        empty_blocks_skipped : int
+            Number of empty write blocks left out of the image
+        segments_skipped : int
+            Number of hex file segments outside the memory regions of the builder
+        bytes_in : int
+            Number of hex file data bytes built or image bytes decoded
+        bytes_out : int
+            Number of image bytes in the emitted or decoded blocks
+        phase_seconds : dict(str, float)
+            Wall time of each finished phase in seconds
+    """
+    def __init__(self):
+        self.blocks = 0
+        self.empty_blocks_skipped = 0
+        self.segments_skipped = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.phase_seconds = {}
+
+    def to_dict(self):
+        """Create a dictionary of the counters
+
+        :return: Counters by name
+        :rtype: dict
+        """
+        return {
+            "blocks": self.blocks,
+            "empty_blocks_skipped": self.empty_blocks_skipped,
+            "segments_skipped": self.segments_skipped,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "phase_seconds": dict(self.phase_seconds),
+        }
+
+class PipelineObserver:
+    """Receiver of the metrics and progress events of build and decode runs
+
+    All events do nothing by default, override the ones that are needed. The stats passed to
+    the events belong to the run and are updated after the event returns, copy them with
+    PipelineStats.to_dict to keep them.
+
+    Attributes:
+        progress_interval : int
+            Minimum number of blocks between progress events
+    """
+    progress_interval = PROGRESS_INTERVAL
+
+    def progress(self, stats):
+        """Called each time at least progress_interval more blocks have been emitted or decoded
+
+        :param stats: Counters of the run so far
+        :type stats: PipelineStats
+        """
+
+    def phase_finished(self, name, seconds, stats):
+        """Called when a phase of the run is finished
+
+        :param name: Phase name, "build" or "decode"
+        :type name: str
+        :param seconds: Wall time of the phase in seconds
+        :type seconds: float
+        :param stats: Counters of the run so far
+        :type stats: PipelineStats
+        """
+
+    def finished(self, stats):
+        """Called when the run is complete
+
+        :param stats: Final counters of the run
+        :type stats: PipelineStats
+        """
+
+class ObservedRun:
+    """Counts the blocks of one run and reports them to an observer
+
+    :param observer: Observer to report to
+    :type observer: PipelineObserver
+    """
+    def __init__(self, observer):
+        self.observer = observer
+        self.stats = PipelineStats()
+        self._next_progress = observer.progress_interval
+
+    def add_blocks(self, count, size):
+        """Count emitted or decoded blocks, reporting progress when a batch is complete
+
+        :param count: Number of blocks
+        :type count: int
+        :param size: Total size of the blocks in bytes
+        :type size: int
+        """
+        stats = self.stats
+        stats.blocks += count
+        stats.bytes_out += size
+        if stats.blocks >= self._next_progress:
+            self.observer.progress(stats)
+            self._next_progress = stats.blocks + self.observer.progress_interval
+
+    def observe_blocks(self, blocks):
+        """Count blocks as they are generated
+
+        :param blocks: Image blocks
+        :type blocks: Iterator[ImageBlockBase]
+        :return: The same blocks
+        :rtype: Iterator[ImageBlockBase]
+        """
+        for block in blocks:
+            self.add_blocks(1, block.block_size)
+            yield block
+
+    @contextmanager
+    def phase(self, name):
+        """Time a phase of the run
+
+        :param name: Phase name
+        :type name: str
+        """
+        start = time.perf_counter()
+        yield
+        seconds = time.perf_counter() - start
+        self.stats.phase_seconds[name] = self.stats.phase_seconds.get(name, 0.0) + seconds
+        self.observer.phase_finished(name, seconds, self.stats)
+
+@contextmanager
+def observe(observer, phase):
+    """Report a run consisting of a single phase to an observer
+
+    The observer gets the progress of the run, the phase time and the final counters.
+
+    :param observer: Observer to report to, None to not observe the run
+    :type observer: PipelineObserver | None
+    :param phase: Phase name
+    :type phase: str
+    :return: Context manager giving the ObservedRun to count blocks with, None when not observing
+    :rtype: contextlib.AbstractContextManager
+    """
+    if observer is None:
+        yield None
+        return
+    run = ObservedRun(observer)
+    with run.phase(phase):
+        yield run
+    observer.finished(run.stats)
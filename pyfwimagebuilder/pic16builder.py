@@ -2,7 +2,7 @@
 Firmware Builder functions for PIC16
 """
 from packaging.version import Version
-from .mcu8builder import FirmwareImageBuilderMcu8, FlashWriteBlock, MetaDataBlock
+from .mcu8builder import FirmwareImageBuilderMcu8, MetaDataBlock
 
 class FirmwareImagebuilderPic16 (FirmwareImageBuilderMcu8):
     """
@@ -29,7 +29,7 @@ class FirmwareImagebuilderPic16 (FirmwareImageBuilderMcu8):
         if size != self.write_block_size:
             raise ValueError(f"PIC16 devices can only write complete flash pages, requested a write size of {size} " +
                                 f"but page size was specified as {self.write_block_size}")
-        return int(size/2) * self.UNDEFINED_SEQUENCE.to_bytes(self.UNDEFINED_SEQUENCE_BYTE_LENGTH, 'little')
+        return super().empty_block(size)
 
     def include_segment(self, start_address, end_address):
         """
@@ -55,19 +55,29 @@ class FirmwareImagebuilderPic16 (FirmwareImageBuilderMcu8):
             return True
         return False
 
-    def _generate_flash_write_block(self, address, data):
-        pic16_address = int(address / 2)
-        block = FlashWriteBlock(pic16_address,
-                      self.config["bootloader"]["PAGE_ERASE_KEY"],
-                      self.config["bootloader"]["PAGE_WRITE_KEY"],
-                      self.config["bootloader"]["BYTE_WRITE_KEY"],
-                      self.config["bootloader"]["PAGE_READ_KEY"],
-                      data)
-        if data == self.empty_block(len(data)):
-            block.empty = True
-        else:
-            block.empty = False
-        return block
+    def _flash_block_address(self, address):
+        """
+        Override:
+        PIC16 flash write blocks use word addresses.
+
+        :param address: Hexfile byte address
+        :type address: int
+        :return: Flash write block word address
+        :rtype: int
+        """
+        return address // 2
+
+    def _hex_address(self, block_address):
+        """
+        Override:
+        PIC16 flash write blocks use word addresses.
+
+        :param block_address: Flash write block word address
+        :type block_address: int
+        :return: Hexfile byte address
+        :rtype: int
+        """
+        return block_address * 2
 
     def _generate_metadata_block(self):
         version = Version(self.config["bootloader"]["IMAGE_FORMAT_VERSION"])
@@ -0,0 +1,121 @@
+"""
+Per-phase profiling of CLI actions
+
+A PhaseProfiler records the wall time and the peak Python memory use of each phase of an
+action, like loading the hex file, building the image and writing the dump. The code
+being profiled marks its phases with profile_phase, which does nothing when no profiler
+is given, so profiling costs nothing when it is off.
+
+Memory is measured with tracemalloc, which slows down the profiled code. The wall times
+are therefore most useful to compare phases with each other. Optionally the whole action
+runs under cProfile and the statistics are saved as a .pstats file.
+"""
+import time
+from contextlib import contextmanager, nullcontext
+
+def profile_phase(profiler, name):
+    """Mark a phase for a profiler
+
+    :param profiler: Profiler to record the phase with, None to not profile
+    :type profiler: PhaseProfiler | None
+    :param name: Phase name
+    :type name: str
+    :return: Context manager covering the phase
+    :rtype: contextlib.AbstractContextManager
+    """
+    if profiler is None:
+        return nullcontext()
+    return profiler.phase(name)
+
+class PhaseProfiler:
+    """Wall time and peak memory of the phases of an action
+
+    Attributes:
+        phases : list(tuple(str, float, int))
+            Name, wall time in seconds and peak traced memory in bytes of each phase, in the order
+            the phases ended
+
+    :param use_cprofile: Also run the profiled code under cProfile, defaults to False
+    :type use_cprofile: bool, optional
+    """
+    def __init__(self, use_cprofile=False):
+        self.phases = []
+        self._cprofile = None
+        if use_cprofile:
+            import cProfile # pylint: disable=import-outside-toplevel
+            self._cprofile = cProfile.Profile()
+
+    def start(self):
+        """Start tracing memory allocations and the cProfile profiler"""
+        import tracemalloc # pylint: disable=import-outside-toplevel
+        tracemalloc.start()
+        if self._cprofile is not None:
+            self._cprofile.enable()
+
+    def stop(self):
+        """Stop tracing memory allocations and the cProfile profiler"""
+        import tracemalloc # pylint: disable=import-outside-toplevel
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        tracemalloc.stop()
+
+    @contextmanager
+    def phase(self, name):
+        """Record a phase
+
+        :param name: Phase name
+        :type name: str
+        """
+        import tracemalloc # pylint: disable=import-outside-toplevel
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            self.phases.append((name, elapsed, peak))
+
+    def summary(self):
+        """Create a summary table of the phases
+
+        :return: Table with one row per phase and the total time
+        :rtype: str
+        """
+        width = max([len(name) for name, _, _ in self.phases] + [len("Total")])
+        lines = [f"{'Phase':<{width}} {'Time (s)':>10} {'Peak memory (KiB)':>18}"]
+        for name, elapsed, peak in self.phases:
+            lines.append(f"{name:<{width}} {elapsed:>10.4f} {peak / 1024:>18.1f}")
+        lines.append(f"{'Total':<{width}} {sum(elapsed for _, elapsed, _ in self.phases):>10.4f}")
+        return "\n".join(lines)
+
+    def to_dict(self):
+        """Create a timing report of the phases
+
+        :return: Report with the name, wall time and peak memory of each phase
+        :rtype: dict
+        """
+        return {
+            "phases": [{"name": name, "seconds": elapsed, "peak_memory": peak} for name, elapsed, peak in self.phases],
+            "total_seconds": sum(elapsed for _, elapsed, _ in self.phases),
+        }
+
+    def save(self, filename):
+        """Save the profile
+
+        A filename ending with .json gets the timing report, any other filename the cProfile
+        statistics in pstats format.
+
+        :param filename: Output file name
+        :type filename: str
+        :raises ValueError: If cProfile statistics are requested but cProfile was not used
+        """
+        if str(filename).endswith(".json"):
+            import json # pylint: disable=import-outside-toplevel
+            with open(filename, "w", encoding="utf-8") as report_file:
+                json.dump(self.to_dict(), report_file, indent=2)
+        elif self._cprofile is not None:
+            self._cprofile.dump_stats(filename)
+        else:
+            raise ValueError("cProfile statistics are only available when the profiler uses cProfile")
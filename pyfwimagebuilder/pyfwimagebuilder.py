@@ -5,16 +5,12 @@ import sys
 import logging
 import argparse
 import os
+import json
 import textwrap
 from pathlib import Path
 
 from logging import getLogger
-from logging.config import dictConfig
-from appdirs import user_log_dir
-import yaml
-from yaml.scanner import ScannerError
 
-from . import pyfwimagebuilder_main
 from .status_codes import STATUS_SUCCESS
 
 try:
@@ -25,11 +21,86 @@ except ImportError:
     COMMIT_ID = "N/A"
     BUILD_DATE = "N/A"
 
+class LoggingConfigError(Exception):
+    """Logging config file parsing error"""
+
+# Parsed logging configuration cached in the user cache directory, valid as long as the YAML file is unchanged
+LOGGING_CONFIG_CACHE = "logging_config.json"
+
+def _read_logging_config(path):
+    """
+    Read a logging config YAML file with the file handlers redirected to the user log directory
+
+    Parsing the YAML file is a large part of the start-up time of the CLI, so the result is cached
+    as JSON and reused while the YAML file keeps the same path, modification time and size.
+
+    :param path: Path to the logging config YAML file
+    :type path: str
+    :return: Logging configuration dictionary and the log directory if any file handlers are configured
+    :rtype: tuple(dict, str|None)
+    :raises LoggingConfigError: If the YAML file can not be parsed
+    :raises KeyError: If the config has no handlers
+    """
+    # pylint: disable=import-outside-toplevel
+    from appdirs import user_cache_dir, user_log_dir
+    # File logging goes to user log directory under Microchip/modulename
+    logdir = user_log_dir(__name__, "Microchip")
+    stat = os.stat(path)
+    cache_key = [os.path.abspath(path), stat.st_mtime_ns, stat.st_size, logdir]
+    cache_dir = user_cache_dir(__name__, "Microchip")
+    cache_path = os.path.join(cache_dir, LOGGING_CONFIG_CACHE)
+    try:
+        with open(cache_path, 'r', encoding="utf-8") as file:
+            cached = json.load(file)
+        if cached['key'] == cache_key:
+            return cached['config'], cached['logdir']
+    except (OSError, ValueError, KeyError, TypeError):
+        # Missing or invalid cache, parse the YAML file instead
+        pass
+
+    import yaml
+    from yaml.scanner import ScannerError
+    with open(path, 'r', encoding="utf-8") as file:
+        try:
+            # Load logging configfile from yaml
+            configfile = yaml.safe_load(file)
+        except ScannerError as exc:
+            raise LoggingConfigError(f"Error parsing logging config file '{path}'") from exc
+    # Look through all handlers, and prepend log directory to redirect all file loggers
+    num_file_handlers = 0
+    for handler in configfile['handlers'].keys():
+        # A filename key
+        if 'filename' in configfile['handlers'][handler].keys():
+            configfile['handlers'][handler]['filename'] = os.path.join(
+                logdir, configfile['handlers'][handler]['filename'])
+            num_file_handlers += 1
+    if num_file_handlers == 0:
+        logdir = None
+
+    import tempfile
+    try:
+        Path(cache_dir).mkdir(exist_ok=True, parents=True)
+        # Write to a temporary file first so concurrent runs never read a partial cache file
+        handle, temp_name = tempfile.mkstemp(dir=cache_dir, prefix=f".{LOGGING_CONFIG_CACHE}.")
+        try:
+            with os.fdopen(handle, 'w', encoding="utf-8") as file:
+                json.dump({'key': cache_key, 'config': configfile, 'logdir': logdir}, file)
+            os.replace(temp_name, cache_path)
+        except BaseException:
+            os.unlink(temp_name)
+            raise
+    except (OSError, TypeError, ValueError):
+        # Caching is an optimization only, e.g. the cache directory may be read-only
+        pass
+    return configfile, logdir
+
 def setup_logging(user_requested_level=logging.WARNING, default_path='logging.yaml',
                   env_key='MICROCHIP_PYTHONTOOLS_CONFIG'):
     """
     Setup logging configuration for pyfwimagebuilder CLI
     """
+    # pylint: disable=import-outside-toplevel
+    from logging.config import dictConfig
     # Logging config YAML file can be specified via environment variable
     value = os.getenv(env_key, None)
     if value:
@@ -40,38 +111,26 @@ def setup_logging(user_requested_level=logging.WARNING, default_path='logging.ya
     # Load the YAML if possible
     if os.path.exists(path):
         try:
-            with open(path, 'r', encoding="utf-8") as file:
-                # Load logging configfile from yaml
-                configfile = yaml.safe_load(file)
-                # File logging goes to user log directory under Microchip/modulename
-                logdir = user_log_dir(__name__, "Microchip")
-                # Look through all handlers, and prepend log directory to redirect all file loggers
-                num_file_handlers = 0
-                for handler in configfile['handlers'].keys():
-                    # A filename key
-                    if 'filename' in configfile['handlers'][handler].keys():
-                        configfile['handlers'][handler]['filename'] = os.path.join(
-                            logdir, configfile['handlers'][handler]['filename'])
-                        num_file_handlers += 1
-                # If file logging is enabled, it needs a folder
-                if num_file_handlers > 0:
-                    # Create it if it does not exist
-                    Path(logdir).mkdir(exist_ok=True, parents=True)
-                # Console logging takes granularity argument from CLI user
-                configfile['handlers']['console']['level'] = user_requested_level
-                # Root logger must be the most verbose of the ALL YAML configurations and the CLI user argument
-                most_verbose_logging = min(user_requested_level, getattr(logging, configfile['root']['level']))
-                for handler in configfile['handlers'].keys():
-                    # A filename key
-                    if 'filename' in configfile['handlers'][handler].keys():
-                        level = getattr(logging, configfile['handlers'][handler]['level'])
-                        most_verbose_logging = min(most_verbose_logging, level)
-                configfile['root']['level'] = most_verbose_logging
+            configfile, logdir = _read_logging_config(path)
+            # If file logging is enabled, it needs a folder
+            if logdir is not None and not os.path.isdir(logdir):
+                # Create it if it does not exist
+                Path(logdir).mkdir(exist_ok=True, parents=True)
+            # Console logging takes granularity argument from CLI user
+            configfile['handlers']['console']['level'] = user_requested_level
+            # Root logger must be the most verbose of the ALL YAML configurations and the CLI user argument
+            most_verbose_logging = min(user_requested_level, getattr(logging, configfile['root']['level']))
+            for handler in configfile['handlers'].keys():
+                # A filename key
+                if 'filename' in configfile['handlers'][handler].keys():
+                    level = getattr(logging, configfile['handlers'][handler]['level'])
+                    most_verbose_logging = min(most_verbose_logging, level)
+            configfile['root']['level'] = most_verbose_logging
             dictConfig(configfile)
             return
-        except ScannerError:
+        except LoggingConfigError as exc:
             # Error while parsing YAML
-            print(f"Error parsing logging config file '{path}'")
+            print(exc)
         except KeyError as keyerror:
             # Error looking for custom fields in YAML
             print(f"Key {keyerror} not found in logging config file")
@@ -101,6 +160,26 @@ def main():
     common_argument_parser.add_argument("-R", "--release-info", action="store_true",
                         help="Print pyfwimagebuilder release details and exit")
 
+    # Profiling switches shared by the build and decode actions
+    profile_argument_parser = argparse.ArgumentParser(add_help=False)
+    profile_argument_parser.add_argument(
+        "--profile", action="store_true",
+        help="Print the wall time and peak memory of each phase of the action to stderr")
+    profile_argument_parser.add_argument(
+        "--profile-output", metavar="profile.pstats|profile.json",
+        help=textwrap.dedent('''\
+        Also save the profile, implies --profile. A .json file gets the timing report,
+        any other file the cProfile statistics of the action in pstats format'''))
+
+    # Daemon client switches shared by the build, decode and verify actions
+    daemon_argument_parser = argparse.ArgumentParser(add_help=False)
+    daemon_argument_parser.add_argument(
+        "--daemon", action="store_true",
+        help="Run the action in a running pyfwimagebuilder serve daemon, or locally if none is running")
+    daemon_argument_parser.add_argument(
+        "--port", type=int,
+        help="Port of the daemon, defaults to 47810")
+
     # Parse out what is seen this far for later use
     common_args, _ = common_argument_parser.parse_known_args()
 
@@ -117,11 +196,20 @@ def main():
     available actions:
         - build: builds an image
         - decode: decodes an image
+        - verify: verifies an image against its hex file and configuration
+        - batch: builds all images listed in a manifest file
+        - serve: runs a daemon that runs build, decode and verify actions started with --daemon
             '''),
         epilog=textwrap.dedent('''usage examples:
 
         - pyfwimagebuilder build -i app.hex -c bootconf.toml -o app.image
         - pyfwimagebuilder decode -i app.image -c bootconf.toml -o app.txt
+        - pyfwimagebuilder decode -i app.image -c bootconf.toml --format jsonl --hash sha256
+        - pyfwimagebuilder build -i app.hex -c bootconf.toml -o app.image --profile-output build.pstats
+        - pyfwimagebuilder verify -i app.image -x app.hex -c bootconf.toml
+        - pyfwimagebuilder batch -m manifest.toml -j 8
+        - pyfwimagebuilder serve
+        - pyfwimagebuilder build -i app.hex -c bootconf.toml -o app.image --daemon
     '''))
 
     subparsers = parser.add_subparsers(
@@ -136,7 +224,7 @@ def main():
         name='build',
         formatter_class=argparse.RawTextHelpFormatter,
         help='Build firmware image',
-        parents=[common_argument_parser])
+        parents=[common_argument_parser, profile_argument_parser, daemon_argument_parser])
 
     # Image-building switches
     build_parser.add_argument(
@@ -160,11 +248,33 @@ def main():
         "-D", "--dump", metavar="dump.txt",
         help="Dump additional human readable output to file")
 
+    build_parser.add_argument(
+        "--manifest", metavar="manifest.json",
+        help="Write a JSON manifest with the SHA-256 and CRC32 of the image and the CRC32 of each block")
+
+    build_parser.add_argument(
+        "--engine", default="python", choices=["python", "numpy"],
+        help="Build engine to use. The numpy engine is faster for large images and requires NumPy.\n"
+             "It can not be combined with --dump, --previous or --baseline")
+
+    build_parser.add_argument(
+        "--cache-dir", metavar="DIR",
+        help="Reuse previously built images stored in this build cache directory")
+
+    previous_group = build_parser.add_mutually_exclusive_group()
+    previous_group.add_argument(
+        "--previous", metavar="previous.img",
+        help="Previously built image to reuse unchanged blocks from")
+
+    previous_group.add_argument(
+        "--baseline", metavar="baseline.img",
+        help="Image already on the device. Only blocks that differ from it are written to the output image")
+
     decode_parser = subparsers.add_parser(
         name='decode',
         formatter_class=argparse.RawTextHelpFormatter,
         help='Decode firmware image',
-        parents=[common_argument_parser])
+        parents=[common_argument_parser, profile_argument_parser, daemon_argument_parser])
 
     decode_parser.add_argument(
         "-i", "--input", required=True, metavar="application.img",
@@ -178,6 +288,102 @@ def main():
         "-c", "--config", required=True, metavar="config.toml",
         help="Bootloader configuration file to use")
 
+    decode_parser.add_argument(
+        "--format", default="text", choices=["text", "jsonl", "csv"],
+        help=textwrap.dedent('''\
+        Output format, defaults to text. jsonl and csv write one record per block
+        with the index, type, size, address, keys and payload length of the block'''))
+
+    decode_parser.add_argument(
+        "--hash", choices=["md5", "sha1", "sha256"],
+        help="Add a hash of the flash data of each block to the jsonl and csv records")
+
+    decode_parser.add_argument(
+        "--to-hex", metavar="application.hex",
+        help="Write the flash contents of the image to an Intel HEX file")
+
+    decode_parser.add_argument(
+        "--to-bin", metavar="application.bin",
+        help="Write the flash contents of the image to a raw binary file")
+
+    decode_parser.add_argument(
+        "--base", type=lambda value: int(value, 0), metavar="ADDR",
+        help=textwrap.dedent('''\
+        Hexfile address of the first byte of the --to-bin output,
+        defaults to the first address written by the image'''))
+
+    verify_parser = subparsers.add_parser(
+        name='verify',
+        formatter_class=argparse.RawTextHelpFormatter,
+        help='Verify firmware image against its hex file and configuration',
+        parents=[common_argument_parser, daemon_argument_parser])
+
+    verify_parser.add_argument(
+        "-i", "--input", required=True, metavar="application.img",
+        help="Image file to verify")
+
+    verify_parser.add_argument(
+        "-x", "--hex", required=True, metavar="application.hex",
+        help="Application file the image was built from, in Intel-hex format")
+
+    verify_parser.add_argument(
+        "-c", "--config", required=True, metavar="config.toml",
+        help="Bootloader configuration file the image was built with")
+
+    verify_parser.add_argument(
+        "-j", "--jobs", type=int, metavar="N",
+        help="Number of parallel processes for comparing hex files with at least 64 MiB of data.\n"
+             "Smaller hex files, like those of device flash, are always compared in this process.\n"
+             "Defaults to comparing in this process")
+
+    batch_parser = subparsers.add_parser(
+        name='batch',
+        formatter_class=argparse.RawTextHelpFormatter,
+        help='Build all images listed in a manifest file',
+        parents=[common_argument_parser])
+
+    batch_parser.add_argument(
+        "-m", "--manifest", required=True, metavar="manifest.toml",
+        help=textwrap.dedent('''\
+        Manifest file listing the images to build, one [[image]] table per image:
+            [[image]]
+            input = "app.hex"
+            config = "config.toml"
+            output = "app.img"
+        Relative paths are relative to the manifest file'''))
+
+    batch_parser.add_argument(
+        "-j", "--jobs", type=int, metavar="N",
+        help="Number of parallel build processes, defaults to the number of CPUs")
+
+    batch_parser.add_argument(
+        "-e", "--include-empty-blocks",
+        action = "store_true",
+        help="Include empty blocks in image files. WARNING: may cause large files")
+
+    batch_parser.add_argument(
+        "--engine", default="python", choices=["python", "numpy"],
+        help="Build engine to use. The numpy engine is faster for large images and requires NumPy.\n"
+             "Images with a dump in the manifest must be built with the python engine")
+
+    batch_parser.add_argument(
+        "--cache-dir", metavar="DIR",
+        help="Reuse previously built images stored in this build cache directory")
+
+    serve_parser = subparsers.add_parser(
+        name='serve',
+        formatter_class=argparse.RawTextHelpFormatter,
+        help='Run a daemon for build, decode and verify actions started with --daemon',
+        parents=[common_argument_parser])
+
+    serve_parser.add_argument(
+        "--port", type=int,
+        help="Port to listen on at localhost, defaults to 47810")
+
+    serve_parser.add_argument(
+        "-j", "--jobs", type=int, metavar="N",
+        help="Maximum number of jobs running at the same time, defaults to the number of CPUs")
+
     # Handle action-less switches
     if common_args.version or common_args.release_info:
         print(f"pyfwimagebuilder version {VERSION}")
@@ -194,6 +400,9 @@ def main():
     args = parser.parse_args()
 
     try:
+        # The builder and decoder are only imported when an action needs them
+        # pylint: disable-next=import-outside-toplevel
+        from . import pyfwimagebuilder_main
         # Call the command handler with args
         return pyfwimagebuilder_main.pyfwimagebuilder(args)
     except Exception as exc: # pylint: disable=broad-exception-caught
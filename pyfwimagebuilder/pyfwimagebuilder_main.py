@@ -2,18 +2,24 @@
 Python firmware image builder main
 """
 
+import sys
 from pathlib import Path
 from logging import getLogger
-from .builder import build
-from .status_codes import STATUS_SUCCESS
-from .decoder import decode
+from .status_codes import STATUS_SUCCESS, STATUS_FAILURE
 
-def run_build(args):
+# The builder, decoder and batch modules are imported by the actions that use them to keep
+# the start-up time low.
+# pylint: disable=import-outside-toplevel
+
+def run_build(args, profiler=None):
     """Build an image
 
     :param args: Parsed command line arguments
     :type args: dict
+    :param profiler: Profiler recording the build phases, defaults to None (no profiling)
+    :type profiler: pyfwimagebuilder.profiling.PhaseProfiler, optional
     """
+    from .builder import build
     logger = getLogger(__name__)
     if args.output:
         imagefilename = args.output
@@ -25,30 +31,128 @@ def run_build(args):
     logger.debug("Output img file: '%s'", imagefilename)
     if args.dump:
         logger.debug("Hex dump file: '%s'", args.dump)
-    build(args.input, args.config, imagefilename, args.dump, args.include_empty_blocks)
+    if args.manifest:
+        logger.debug("Manifest file: '%s'", args.manifest)
+    build(args.input, args.config, imagefilename, args.dump, args.include_empty_blocks, args.engine, args.cache_dir,
+          args.previous, args.baseline, args.manifest, profiler)
 
     logger.info("Image building complete")
 
-def run_decode(args):
+def run_decode(args, profiler=None):
     """Decode a firmware image
 
     :param args: Parsed command line arguments
     :type args: dict
+    :param profiler: Profiler recording the decoding phases, defaults to None (no profiling)
+    :type profiler: pyfwimagebuilder.profiling.PhaseProfiler, optional
     :raises: ImageDecodingError For decoding errors
     :raises: FileNotFoundError When image file cannot be found
     """
+    from .decoder import decode_lazy
     logger = getLogger(__name__)
     logger.debug("Input image file: '%s'", args.input)
     logger.debug("Configuration image file: '%s'", args.config)
     
-    fwimage = decode(args.input, args.config)
+    # The blocks are decoded one at a time while the output is written
+    with decode_lazy(args.input, args.config, profiler) as fwimage:
+        write_decoded(fwimage, args, sys.stdout, profiler)
 
-    if args.output:
-        logger.debug("Decoded image file: '%s'", args.output)
-        with open(args.output, "w", encoding="utf-8") as outfile:
-            outfile.write(str(fwimage))
-    else:
-        print(fwimage)
+def write_decoded(fwimage, args, stdout, profiler=None):
+    """Write the outputs of the decode action for an opened image
+
+    :param fwimage: Image to decode
+    :type fwimage: LazyFirmwareImage
+    :param args: Parsed command line arguments of the decode action
+    :type args: dict
+    :param stdout: Text stream for the decoded image when no output file is given
+    :type stdout: io.TextIOBase
+    :param profiler: Profiler recording the decoding phases, defaults to None (no profiling)
+    :type profiler: pyfwimagebuilder.profiling.PhaseProfiler, optional
+    """
+    from .decoder import image_to_hexfile
+    from .profiling import profile_phase
+    logger = getLogger(__name__)
+    if args.to_hex or args.to_bin:
+        with profile_phase(profiler, "rebuild flash"):
+            flash = image_to_hexfile(fwimage, fwimage.bytes_per_address)
+        if args.to_hex:
+            with profile_phase(profiler, "write hex"), open(args.to_hex, "w", encoding="ascii") as hexfile:
+                flash.write_hex(hexfile)
+            logger.info("Flash contents written to '%s'", args.to_hex)
+        if args.to_bin:
+            with profile_phase(profiler, "write bin"), open(args.to_bin, "wb") as binfile:
+                flash.write_bin(binfile, args.base)
+            logger.info("Flash contents written to '%s'", args.to_bin)
+        if not args.output:
+            # The flash contents replace the decoded text unless an output file is given
+            return
+    # The blocks are decoded while they are written so this phase includes the decoding
+    with profile_phase(profiler, "decode and write"):
+        if args.format != "text":
+            from .records import write_records
+            if args.output:
+                logger.debug("Decoded image records file: '%s'", args.output)
+                with open(args.output, "w", encoding="utf-8", newline="") as outfile:
+                    write_records(fwimage, outfile, args.format, args.hash)
+            else:
+                write_records(fwimage, stdout, args.format, args.hash)
+        elif args.output:
+            logger.debug("Decoded image file: '%s'", args.output)
+            with open(args.output, "w", encoding="utf-8") as outfile:
+                fwimage.dump(outfile)
+        else:
+            fwimage.dump(stdout)
+            # Same output as printing the image
+            stdout.write("\n")
+
+def run_verify(args):
+    """Verify a firmware image against its hex file and configuration
+
+    :param args: Parsed command line arguments
+    :type args: dict
+    :return: Status code, STATUS_FAILURE if the image does not match
+    :rtype: int
+    """
+    from .verifier import verify
+    logger = getLogger(__name__)
+    logger.debug("Image file: '%s'", args.input)
+    logger.debug("Hex file: '%s'", args.hex)
+    logger.debug("Configuration file: '%s'", args.config)
+    result = verify(args.input, args.hex, args.config, args.jobs)
+    for error in result.errors:
+        logger.error(error)
+    if not result.ok:
+        logger.error("Image '%s' does not match '%s'", args.input, args.hex)
+        return STATUS_FAILURE
+    logger.info("Image '%s' matches '%s', %d pages verified", args.input, args.hex, result.pages_checked)
+    return STATUS_SUCCESS
+
+def run_batch(args):
+    """Build all images listed in a manifest
+
+    :param args: Parsed command line arguments
+    :type args: dict
+    :return: Status code, STATUS_FAILURE if any image failed to build
+    :rtype: int
+    """
+    from .batch import load_manifest, run_batch as build_batch
+    logger = getLogger(__name__)
+    logger.debug("Manifest file: '%s'", args.manifest)
+    items = load_manifest(args.manifest)
+    results = build_batch(items, args.jobs, args.include_empty_blocks, args.engine, args.cache_dir)
+
+    failures = 0
+    for result in results:
+        if result.ok:
+            logger.info("Built '%s' in %.3f s", result.item.output_filename, result.elapsed)
+        else:
+            failures += 1
+            logger.error("Failed to build '%s' from '%s': %s", result.item.output_filename,
+                         result.item.input_filename, result.error)
+    logger.info("Batch complete: %d of %d images built", len(results) - failures, len(results))
+    if failures:
+        return STATUS_FAILURE
+    return STATUS_SUCCESS
 
 def pyfwimagebuilder(args):
     """
@@ -57,9 +161,41 @@ def pyfwimagebuilder(args):
     logger = getLogger(__name__)
     logger.info("pyfwimagebuilder - Python firmware image builder for Microchip MDFU bootloaders")
     status = STATUS_SUCCESS
-    if args.action == "build":
-        run_build(args)
-    elif args.action == "decode":
-        run_decode(args)
+    # Profiles are of the local process so profiled actions always run locally
+    if args.action in ("build", "decode", "verify") and args.daemon and \
+            not (getattr(args, "profile", False) or getattr(args, "profile_output", None)):
+        from .daemon import forward_job
+        status = forward_job(args, args.port)
+        if status is not None:
+            return status
+        logger.info("No pyfwimagebuilder daemon is running, running %s locally", args.action)
+        status = STATUS_SUCCESS
+    if args.action in ("build", "decode"):
+        profiler = None
+        if args.profile or args.profile_output:
+            from .profiling import PhaseProfiler
+            use_cprofile = bool(args.profile_output) and not args.profile_output.endswith(".json")
+            profiler = PhaseProfiler(use_cprofile)
+            profiler.start()
+        try:
+            if args.action == "build":
+                run_build(args, profiler)
+            else:
+                run_decode(args, profiler)
+        finally:
+            if profiler:
+                profiler.stop()
+                # stderr keeps the profile apart from decoded output written to stdout
+                print(profiler.summary(), file=sys.stderr)
+                if args.profile_output:
+                    profiler.save(args.profile_output)
+                    logger.info("Profile written to '%s'", args.profile_output)
+    elif args.action == "verify":
+        status = run_verify(args)
+    elif args.action == "batch":
+        status = run_batch(args)
+    elif args.action == "serve":
+        from .daemon import serve
+        serve(args.port, args.jobs)
 
     return status
@@ -0,0 +1,129 @@
+"""
+Machine readable records of the blocks in a firmware image
+
+Each block of an image is described by one flat record, written either as JSON Lines
+(one JSON object per line) or as CSV with a header row. The records are written one
+block at a time, so tools can process a large image while it is being decoded and the
+memory use does not grow with the image size.
+
+Record fields:
+
+- index: Position of the block in the image
+- type: Block type name, e.g. FLASH_OPERATION
+- size: Block size in bytes
+- address: Start address of the block, the flash start address for the metadata block
+- page_erase_key, page_write_key, byte_write_key, page_read_key: Flash operation keys,
+  empty for formats without keys
+- payload_length: Number of flash data bytes written by the block, empty for the metadata block
+- payload_hash: Hex digest of the flash data, only when a hash algorithm is requested
+"""
+import csv
+import hashlib
+import json
+
+RECORD_FIELDS = ("index", "type", "size", "address", "page_erase_key", "page_write_key", "byte_write_key",
+                 "page_read_key", "payload_length", "payload_hash")
+RECORD_FORMATS = ("jsonl", "csv")
+HASH_ALGORITHMS = ("md5", "sha1", "sha256")
+
+KEY_FIELDS = ("page_erase_key", "page_write_key", "byte_write_key", "page_read_key")
+
+def block_record(index, block, hash_algorithm=None):
+    """Create the record of an image block
+
+    Compressed and pattern fill blocks are described by the flash data they expand to, so
+    the payload length and hash do not depend on how the data is encoded in the image.
+
+    :param index: Position of the block in the image
+    :type index: int
+    :param block: Image block
+    :type block: Inherited classes from ImageBlockBase
+    :param hash_algorithm: hashlib algorithm for the payload hash, defaults to None (no hash)
+    :type hash_algorithm: str, optional
+    :return: Block record with the RECORD_FIELDS keys
+    :rtype: dict
+    """
+    block_type = getattr(block, "block_type", None) or block.BLOCK_TYPE
+    record = {
+        "index": index,
+        "type": block_type.name,
+        "size": block.block_size,
+        "address": block.address,
+    }
+    for field in KEY_FIELDS:
+        record[field] = getattr(block, field, None)
+    # Pattern fill blocks expand to up to 0xFFFF pages so the data is only built for the hash
+    payload_length = getattr(block, "data_length", None)
+    payload = None
+    if payload_length is None or hash_algorithm:
+        payload = getattr(block, "data", None)
+        if payload is not None and payload_length is None:
+            payload_length = len(payload)
+    record["payload_length"] = payload_length
+    record["payload_hash"] = None
+    if hash_algorithm and payload is not None:
+        record["payload_hash"] = hashlib.new(hash_algorithm, payload).hexdigest()
+    return record
+
+def iter_records(fwimage, hash_algorithm=None):
+    """Iterate over the records of the blocks in an image
+
+    :param fwimage: Firmware image
+    :type fwimage: FirmwareImage
+    :param hash_algorithm: hashlib algorithm for the payload hash, defaults to None (no hash)
+    :type hash_algorithm: str, optional
+    :return: Block records in image order
+    :rtype: iterator(dict)
+    """
+    for index, block in enumerate(fwimage.blocks):
+        yield block_record(index, block, hash_algorithm)
+
+def write_jsonl(fwimage, fileobj, hash_algorithm=None):
+    """Write the block records of an image as JSON Lines
+
+    :param fwimage: Firmware image
+    :type fwimage: FirmwareImage
+    :param fileobj: Text file object
+    :type fileobj: io.TextIOBase
+    :param hash_algorithm: hashlib algorithm for the payload hash, defaults to None (no hash)
+    :type hash_algorithm: str, optional
+    """
+    for record in iter_records(fwimage, hash_algorithm):
+        fileobj.write(json.dumps(record) + "\n")
+
+def write_csv(fwimage, fileobj, hash_algorithm=None):
+    """Write the block records of an image as CSV with a header row
+
+    Fields without a value are left empty.
+
+    :param fwimage: Firmware image
+    :type fwimage: FirmwareImage
+    :param fileobj: Text file object, opened with newline=""
+    :type fileobj: io.TextIOBase
+    :param hash_algorithm: hashlib algorithm for the payload hash, defaults to None (no hash)
+    :type hash_algorithm: str, optional
+    """
+    writer = csv.DictWriter(fileobj, fieldnames=RECORD_FIELDS, lineterminator="\n")
+    writer.writeheader()
+    for record in iter_records(fwimage, hash_algorithm):
+        writer.writerow(record)
+
+def write_records(fwimage, fileobj, record_format, hash_algorithm=None):
+    """Write the block records of an image in one of the RECORD_FORMATS
+
+    :param fwimage: Firmware image
+    :type fwimage: FirmwareImage
+    :param fileobj: Text file object
+    :type fileobj: io.TextIOBase
+    :param record_format: Output format, "jsonl" or "csv"
+    :type record_format: str
+    :param hash_algorithm: hashlib algorithm for the payload hash, defaults to None (no hash)
+    :type hash_algorithm: str, optional
+    :raises ValueError: For an unknown record format
+    """
+    if record_format == "jsonl":
+        write_jsonl(fwimage, fileobj, hash_algorithm)
+    elif record_format == "csv":
+        write_csv(fwimage, fileobj, hash_algorithm)
+    else:
+        raise ValueError(f"Unknown record format '{record_format}', use one of {', '.join(RECORD_FORMATS)}")
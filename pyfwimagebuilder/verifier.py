@@ -0,0 +1,299 @@
+"""
+Verification of firmware images against their source
+
+An image is verified by checking that its metadata block matches the bootloader
+configuration and that it writes exactly the data of the hex file: every page of the
+hex file inside the flash range of the configuration that is not empty must be written
+with the same data, and the image must not write data that is not in the hex file.
+
+The pages are split into the same write blocks as when the image is built, so
+verification does not depend on the image using plain, compressed or pattern fill
+blocks. The pages are compared in the calling process. Very large hex files can be
+split into address ranges that are compared in worker processes, each worker loads the
+image and the hex file itself so only the file names and the address ranges are sent
+to the workers.
+"""
+from bisect import bisect_right
+from logging import getLogger
+
+from .builder import builder_factory, load_config, load_image
+from .decoder import bytes_per_address, image_to_hexfile
+from .imagebuilder import BlockTable
+from .hexfile import HexFileError, load_hexfile
+
+logger = getLogger(__name__)
+
+# Number of mismatching pages listed in the result
+MAX_REPORTED_MISMATCHES = 10
+# Minimum number of hex file data bytes for comparing in worker processes. Every worker parses the hex
+# file again, which takes about three times as long as verifying the same data in the calling process,
+# so only hex files far larger than the flash of current devices are split over workers.
+PARALLEL_MIN_BYTES = 64 * 1024 * 1024
+# Number of address ranges per worker process, so workers that finish early take over more ranges
+RANGES_PER_JOB = 4
+
+class VerificationResult:
+    """Result of verifying an image
+
+    :param pages_checked: Number of hex file pages compared with the image
+    :type pages_checked: int
+    :param errors: Description of each problem found, at most MAX_REPORTED_MISMATCHES page mismatches
+        are listed
+    :type errors: list(str)
+    """
+    def __init__(self, pages_checked, errors):
+        self.pages_checked = pages_checked
+        self.errors = errors
+
+    @property
+    def ok(self):
+        """Verification status
+
+        :return: True if the image matches the hex file and the configuration
+        :rtype: bool
+        """
+        return not self.errors
+
+def _compare_pages(pages):
+    """Compare the expected and the written data of pages
+
+    :param pages: Address, expected data and data written by the image of each page. The written
+        data is None if the image does not write the complete page.
+    :type pages: list(tuple(int, bytes, bytes|None))
+    :return: Address and description of each mismatching page
+    :rtype: list(tuple(int, str))
+    """
+    mismatches = []
+    for address, expected, actual in pages:
+        if actual is None:
+            mismatches.append((address, f"Page at 0x{address:08X} is not written by the image"))
+        elif actual != expected:
+            offset = next(index for index, (byte, expected_byte) in enumerate(zip(actual, expected))
+                          if byte != expected_byte)
+            mismatches.append((address, f"Data at 0x{address + offset:08X} is 0x{actual[offset]:02X} in the image "
+                                        f"but 0x{expected[offset]:02X} in the hex file"))
+    return mismatches
+
+def _compare_metadata(image_metadata, expected_metadata):
+    """Compare the metadata block of an image with the block built from the configuration
+
+    :return: Error description or None if the blocks match
+    :rtype: str | None
+    """
+    if image_metadata.to_bytes() == expected_metadata.to_bytes():
+        return None
+    for line, expected_line in zip(str(image_metadata).splitlines(), str(expected_metadata).splitlines()):
+        if line != expected_line:
+            return f"Metadata block does not match the configuration: '{line}' but expected '{expected_line}'"
+    return "Metadata block does not match the configuration"
+
+class _RangeVerifier:
+    """Compares the hex file pages in an address range with the data written by an image
+
+    :param image: Decoded image
+    :type image: FirmwareImage
+    :param hexfile: Hexfile the image was built from
+    :type hexfile: HexFile | intelhex.IntelHex
+    :param bootloader_config: Bootloader configuration
+    :type bootloader_config: dict
+    """
+    def __init__(self, image, hexfile, bootloader_config):
+        architecture = bootloader_config['bootloader']['ARCH']
+        # The builder defines how the hex file is split into pages
+        self.builder = builder_factory(architecture, bootloader_config)
+        self.bytes_per_address = bytes_per_address(architecture)
+        self.image = image
+        self.hexfile = hexfile
+        self._segments = None
+
+    def segments(self):
+        """Get the segments of the hex file that belong in the image
+
+        :return: Segment start address and segment data tuples
+        :rtype: list(tuple(int, bytes))
+        """
+        if self._segments is None:
+            # pylint: disable-next=protected-access
+            self._segments = list(self.builder._iter_segments(self.hexfile))
+        return self._segments
+
+    def _iter_pages(self, written, start, end):
+        """Pair the hex file pages that start in an address range with the data written by the image
+
+        :param written: Flash contents written by the image blocks that start in the range
+        :type written: HexFile
+        :param start: First hexfile byte address of the range
+        :type start: int
+        :param end: End of the range, None for no limit
+        :type end: int | None
+        :return: Address, expected data and written data or None of each page that must be compared
+        :rtype: Iterator[tuple(int, bytes, bytes|None)]
+        """
+        # pylint: disable=protected-access
+        written_segments = written.segments()
+        written_starts = [segment_start for segment_start, _ in written_segments]
+        written_data = [written.tobinarray(segment_start, segment_end - 1)
+                        for segment_start, segment_end in written_segments]
+        page_size = self.builder.write_block_size
+        for segment_start, segment_data in self.segments():
+            # Only the pages that start in the range
+            first = max(0, -(-(start - segment_start) // page_size)) * page_size
+            last = len(segment_data) if end is None else \
+                min(len(segment_data), max(0, -(-(end - segment_start) // page_size)) * page_size)
+            if first >= last:
+                continue
+            range_data = segment_data[first:last]
+            empty_pages = set(self.builder.empty_pages(range_data))
+            for index, (address, page) in enumerate(self.builder._iter_segment_blocks(segment_start + first,
+                                                                                      range_data)):
+                position = bisect_right(written_starts, address) - 1
+                actual = None
+                if position >= 0 and address + len(page) <= written_segments[position][1]:
+                    offset = address - written_starts[position]
+                    actual = written_data[position][offset:offset + len(page)]
+                # Empty pages only need to match if the image writes them
+                if index not in empty_pages or actual is not None:
+                    yield address, page, actual
+
+    def verify(self, start=0, end=None):
+        """Verify an address range
+
+        :param start: First hexfile byte address of the range, defaults to 0
+        :type start: int, optional
+        :param end: End of the range, defaults to None (no limit)
+        :type end: int, optional
+        :return: Number of pages checked, address and description of each mismatching page and other errors
+        :rtype: tuple(int, list(tuple(int, str)), list(str))
+        """
+        try:
+            written = image_to_hexfile(self.image, self.bytes_per_address, start, end)
+        except HexFileError as exc:
+            return 0, [], [f"Image blocks overlap: {exc}"]
+        hex_segments = [(segment_start, segment_start + len(segment_data))
+                        for segment_start, segment_data in self.segments()]
+        errors = []
+        for segment_start, segment_end in written.segments():
+            if not any(hex_start <= segment_start and segment_end <= hex_end for hex_start, hex_end in hex_segments):
+                errors.append(f"Image writes 0x{segment_start:08X} - 0x{segment_end - 1:08X} "
+                              "which is not all in the hex file")
+        pages = list(self._iter_pages(written, start, end))
+        return len(pages), _compare_pages(pages), errors
+
+# Verifier of a worker process, set up by _init_worker
+_worker_verifier = None
+
+def _init_worker(image_filename, hex_filename, bootloader_config):
+    """Load the image and the hex file in a worker process
+
+    :param image_filename: Image file name
+    :type image_filename: str
+    :param hex_filename: Path to the hexfile the image was built from
+    :type hex_filename: str
+    :param bootloader_config: Bootloader configuration
+    :type bootloader_config: dict
+    """
+    global _worker_verifier # pylint: disable=global-statement
+    _worker_verifier = _RangeVerifier(load_image(image_filename, bootloader_config), load_hexfile(hex_filename),
+                                      bootloader_config)
+
+def _verify_worker_range(address_range):
+    """Verify an address range in a worker process
+
+    :param address_range: First hexfile byte address and end of the range, None for no limit
+    :type address_range: tuple(int, int|None)
+    :return: See _RangeVerifier.verify
+    :rtype: tuple(int, list(tuple(int, str)), list(str))
+    """
+    return _worker_verifier.verify(*address_range)
+
+def _address_ranges(image, bytes_per_block_address, count):
+    """Split the flash written by an image into address ranges with about the same number of blocks
+
+    :param image: Decoded image
+    :type image: FirmwareImage
+    :param bytes_per_block_address: Number of data bytes per flash address in the blocks
+    :type bytes_per_block_address: int
+    :param count: Number of ranges
+    :type count: int
+    :return: First hexfile byte address and end of each range, together covering all addresses
+    :rtype: list(tuple(int, int|None))
+    """
+    addresses = sorted(address * bytes_per_block_address for address in image.blocks.addresses
+                       if address != BlockTable.NO_ADDRESS)
+    boundaries = sorted({addresses[len(addresses) * index // count] for index in range(1, count)} - {0})
+    return list(zip([0] + boundaries, boundaries + [None]))
+
+def verify(image_filename, hex_filename, config_filename, jobs=None):
+    """Verify a firmware image against its hex file and bootloader configuration
+
+    :param image_filename: Image file name
+    :type image_filename: str
+    :param hex_filename: Path to the hexfile the image was built from
+    :type hex_filename: str
+    :param config_filename: Path to configuration TOML file
+    :type config_filename: str
+    :param jobs: Number of worker processes for hex files with at least PARALLEL_MIN_BYTES of data,
+        defaults to None (compare in the calling process)
+    :type jobs: int, optional
+    :return: Verification result
+    :rtype: VerificationResult
+    :raises ImageDecodingError: For image decoding errors.
+    """
+    bootloader_config = load_config(config_filename)
+    return verify_with_config(image_filename, load_hexfile(hex_filename), bootloader_config, jobs, hex_filename)
+
+# pylint: disable-next=too-many-arguments,too-many-positional-arguments
+def verify_with_config(image_filename, hexfile, bootloader_config, jobs=None, hex_filename=None):
+    """Verify a firmware image against a loaded hex file and bootloader configuration
+
+    :param image_filename: Image file name
+    :type image_filename: str
+    :param hexfile: Hexfile the image was built from
+    :type hexfile: HexFile | intelhex.IntelHex
+    :param bootloader_config: Bootloader configuration
+    :type bootloader_config: dict
+    :param jobs: Number of worker processes for hex files with at least PARALLEL_MIN_BYTES of data,
+        defaults to None (compare in the calling process)
+    :type jobs: int, optional
+    :param hex_filename: Path to the hexfile for the worker processes to load, defaults to None (compare
+        in the calling process)
+    :type hex_filename: str, optional
+    :return: Verification result
+    :rtype: VerificationResult
+    :raises ImageDecodingError: For image decoding errors.
+    """
+    image = load_image(image_filename, bootloader_config)
+    verifier = _RangeVerifier(image, hexfile, bootloader_config)
+    errors = []
+
+    # pylint: disable-next=protected-access
+    expected_metadata = verifier.builder._generate_metadata_block()
+    if expected_metadata is not None:
+        error = _compare_metadata(image.blocks[0], expected_metadata)
+        if error:
+            errors.append(error)
+
+    hex_size = sum(segment_end - segment_start for segment_start, segment_end in hexfile.segments())
+    parallel = jobs is not None and jobs > 1
+    if parallel and not (hex_filename and hex_size >= PARALLEL_MIN_BYTES):
+        # Starting the workers takes longer than comparing device sized hex files in this process
+        logger.info("Ignoring %d jobs, worker processes are only used for hex files with at least %d MiB of data",
+                    jobs, PARALLEL_MIN_BYTES // (1024 * 1024))
+        parallel = False
+    if parallel:
+        from concurrent.futures import ProcessPoolExecutor # pylint: disable=import-outside-toplevel
+        address_ranges = _address_ranges(image, verifier.bytes_per_address, jobs * RANGES_PER_JOB)
+        logger.debug("Comparing %d address ranges in %d processes", len(address_ranges), jobs)
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                                 initargs=(str(image_filename), str(hex_filename), bootloader_config)) as executor:
+            results = list(executor.map(_verify_worker_range, address_ranges))
+    else:
+        results = [verifier.verify()]
+
+    pages_checked = sum(result[0] for result in results)
+    mismatches = [mismatch for result in results for mismatch in result[1]]
+    errors.extend(error for result in results for error in result[2])
+    errors.extend(message for _, message in mismatches[:MAX_REPORTED_MISMATCHES])
+    if len(mismatches) > MAX_REPORTED_MISMATCHES:
+        errors.append(f"... and {len(mismatches) - MAX_REPORTED_MISMATCHES} more mismatching pages")
+    return VerificationResult(pages_checked, errors)
@@ -0,0 +1,76 @@
+"""
+Tests related to the asyncapi module
+"""
+import asyncio
+import unittest
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from pyfwimagebuilder.asyncapi import build_async, decode_async
+from pyfwimagebuilder.decoder import decode
+
+DATA_FOLDER = Path(__file__).parent.absolute() / 'data'
+
+APPFILE = DATA_FOLDER / 'MCU8' / 'applications' / 'PIC16F18875_App_checksum.hex'
+CONFIGFILE = DATA_FOLDER / 'MCU8' / 'v0.3.0' / 'configs' / 'bootloader_config_pic16.toml'
+REFERENCEFILE = DATA_FOLDER / 'MCU8' / 'v0.3.0' / 'PIC16F18875_App_checksum_v0_3_0.image'
+
+class TestAsyncApi(unittest.TestCase):
+    """Test the asyncio build and decode coroutines
+    """
+    def test_build_and_decode(self):
+        """Test concurrent builds and decodes in the default executor
+        """
+        async def run(outputfile):
+            return await asyncio.gather(build_async(APPFILE, CONFIGFILE, outputfile),
+                                        build_async(APPFILE, CONFIGFILE),
+                                        decode_async(REFERENCEFILE, CONFIGFILE))
+
+        reference = REFERENCEFILE.read_bytes()
+        with tempfile.TemporaryDirectory() as tempdir:
+            outputfile = Path(tempdir) / 'app.img'
+            written, returned, image = asyncio.run(run(outputfile))
+            self.assertEqual(outputfile.read_bytes(), reference)
+        self.assertEqual(written, reference)
+        self.assertEqual(returned, reference)
+        self.assertEqual(str(image), str(decode(REFERENCEFILE, CONFIGFILE)))
+
+    def test_process_executor(self):
+        """Test building and decoding in worker processes
+        """
+        async def run(executor):
+            data = await build_async(APPFILE, CONFIGFILE, executor=executor)
+            image = await decode_async(REFERENCEFILE, CONFIGFILE, executor=executor)
+            return data, image
+
+        with ProcessPoolExecutor(1) as executor:
+            data, image = asyncio.run(run(executor))
+        self.assertEqual(data, REFERENCEFILE.read_bytes())
+        self.assertEqual(bytes(image.to_bytes()), data)
+
+    def test_build_stages(self):
+        """Test that hex file parsing and image building are separate executor calls
+        """
+        class RecordingExecutor(ThreadPoolExecutor):
+            """Executor that records the names of the functions it runs"""
+            def __init__(self):
+                super().__init__(1)
+                self.calls = []
+
+            def submit(self, fn, /, *args, **kwargs):
+                self.calls.append(fn.__name__)
+                return super().submit(fn, *args, **kwargs)
+
+        with RecordingExecutor() as executor:
+            data = asyncio.run(build_async(APPFILE, CONFIGFILE, executor=executor))
+        self.assertEqual(data, REFERENCEFILE.read_bytes())
+        self.assertEqual(executor.calls, ['parse_hexdata', '_build_image'])
+
+    def test_timeout(self):
+        """Test that a build that times out does not write the image
+        """
+        with tempfile.TemporaryDirectory() as tempdir:
+            outputfile = Path(tempdir) / 'app.img'
+            with self.assertRaises(asyncio.TimeoutError):
+                asyncio.run(build_async(APPFILE, CONFIGFILE, outputfile, timeout=0))
+            self.assertFalse(outputfile.exists())
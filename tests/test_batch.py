@@ -0,0 +1,57 @@
+"""
+Tests related to batch building
+"""
+import unittest
+import tempfile
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from mock import patch
+from pyfwimagebuilder.batch import BatchItem, run_batch
+
+DATA_FOLDER = Path(__file__).parent.absolute() / 'data' / 'MCU8'
+
+APPFILE = DATA_FOLDER / 'applications' / 'AVR128DA48_App_checksum.hex'
+CONFIGFILE = DATA_FOLDER / 'v0.3.0' / 'configs' / 'bootloader_config_avr.toml'
+REFERENCEFILE = DATA_FOLDER / 'v0.3.0' / 'AVR128DA48_App_checksum_v0_3_0.image'
+
+class BrokenPoolExecutor:
+    """Executor that runs the first job and fails the others as if its pool broke"""
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers
+        self.submitted = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def submit(self, function, *args):
+        """Run the first job in this process and fail the following ones"""
+        future = Future()
+        if self.submitted:
+            future.set_exception(BrokenProcessPool("A child process terminated abruptly"))
+        else:
+            future.set_result(function(*args))
+        self.submitted += 1
+        return future
+
+class TestBatch(unittest.TestCase):
+    """Test building batches of images
+    """
+    def test_broken_pool(self):
+        """Test that a broken worker pool fails the affected images without aborting the batch
+        """
+        with tempfile.TemporaryDirectory() as tempdir:
+            items = [BatchItem(str(APPFILE), str(CONFIGFILE), str(Path(tempdir) / f'image{index}.img'))
+                     for index in range(3)]
+            with patch('concurrent.futures.ProcessPoolExecutor', BrokenPoolExecutor):
+                results = run_batch(items, jobs=2)
+            self.assertEqual(Path(items[0].output_filename).read_bytes(), REFERENCEFILE.read_bytes())
+
+        self.assertEqual([result.item for result in results], items)
+        self.assertTrue(results[0].ok)
+        for result in results[1:]:
+            self.assertFalse(result.ok)
+            self.assertEqual(result.error, "BrokenProcessPool: A child process terminated abruptly")
@@ -0,0 +1,57 @@
+"""
+Tests related to the build cache
+"""
+import os
+import unittest
+import tempfile
+from pathlib import Path
+from mock import patch
+from pyfwimagebuilder.builder import build
+from pyfwimagebuilder.cache import BuildCache
+
+DATA_FOLDER = Path(__file__).parent.absolute() / 'data' / 'MCU8'
+
+APPFILE = DATA_FOLDER / 'applications' / 'AVR128DA48_App_checksum.hex'
+CONFIGFILE = DATA_FOLDER / 'v0.3.0' / 'configs' / 'bootloader_config_avr.toml'
+REFERENCEFILE = DATA_FOLDER / 'v0.3.0' / 'AVR128DA48_App_checksum_v0_3_0.image'
+
+class TestBuildCache(unittest.TestCase):
+    """Test the content addressed build cache
+    """
+    def test_cache_hit(self):
+        """Test that a cached image is returned without building it again
+        """
+        with tempfile.TemporaryDirectory() as tempdir:
+            cache_dir = Path(tempdir) / 'cache'
+            first = Path(tempdir) / 'first.img'
+            second = Path(tempdir) / 'second.img'
+            build(APPFILE, CONFIGFILE, first, cache_dir=cache_dir)
+            with patch('pyfwimagebuilder.builder.load_hexfile') as mock_load:
+                build(APPFILE, CONFIGFILE, second, cache_dir=cache_dir)
+                mock_load.assert_not_called()
+            self.assertEqual(second.read_bytes(), REFERENCEFILE.read_bytes())
+
+            # A dump was not cached so requesting one is a cache miss
+            dump = Path(tempdir) / 'second.txt'
+            build(APPFILE, CONFIGFILE, second, hexdump_filename=dump, cache_dir=cache_dir)
+            self.assertTrue(dump.exists())
+
+            # Different settings must not use the cached image
+            build(APPFILE, CONFIGFILE, second, include_empty_blocks=True, cache_dir=cache_dir)
+            self.assertNotEqual(second.read_bytes(), REFERENCEFILE.read_bytes())
+
+    def test_eviction(self):
+        """Test that the least recently used entries are evicted
+        """
+        with tempfile.TemporaryDirectory() as tempdir:
+            cache_dir = Path(tempdir) / 'cache'
+            cache = BuildCache(cache_dir, max_size=250)
+            source = Path(tempdir) / 'source.bin'
+            source.write_bytes(bytes(100))
+            for index, key in enumerate(['a', 'b', 'c']):
+                cache.store(key, {'img': source})
+                # Make sure the entries get different modification times
+                os.utime(cache_dir / f'{key}.img', (index, index))
+            cache.evict()
+            cache_files = sorted(path.name for path in cache_dir.iterdir())
+            self.assertEqual(cache_files, ['b.img', 'c.img'])
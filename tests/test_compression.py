@@ -0,0 +1,43 @@
+"""
+Tests related to the compression module
+"""
+import unittest
+import pytest
+from pyfwimagebuilder.compression import compress, decompress
+
+class TestCompression(unittest.TestCase):
+    """Test the run-length compression of flash pages
+    """
+    def test_roundtrip(self):
+        """Test that compressed data expands to the original data
+        """
+        samples = [
+            b"",
+            b"\x00",
+            b"\xFF" * 129,
+            b"\xFF" * 256 + bytes(range(200)) + b"\x3F\xFF" * 64,
+            b"\x01\x01\x02\x02\x02\x03" * 50,
+            bytes(range(256)) * 2,
+        ]
+        for data in samples:
+            with self.subTest(length=len(data)):
+                self.assertEqual(decompress(compress(data), len(data)), data)
+
+    def test_compression_ratio(self):
+        """Test that runs are compressed and that literal data has a small overhead
+        """
+        self.assertEqual(compress(b"\xFF" * 128), b"\x81\xFF")
+        self.assertEqual(len(compress(b"\xFF" * 512)), 8)
+        self.assertEqual(len(compress(bytes(range(256)))), 258)
+
+    def test_corrupt_data(self):
+        """Test detection of corrupt compressed data
+        """
+        with pytest.raises(ValueError):
+            decompress(b"\x80", 0)
+        with pytest.raises(ValueError):
+            decompress(b"\x05\x01\x02", 6)
+        with pytest.raises(ValueError):
+            decompress(b"\x81", 128)
+        with pytest.raises(ValueError):
+            decompress(b"\x81\xFF", 64)
@@ -0,0 +1,141 @@
+"""
+Tests related to the daemon module
+"""
+import io
+import sys
+import json
+import socket
+import http.client
+import unittest
+import tempfile
+import threading
+from pathlib import Path
+from mock import patch
+from pyfwimagebuilder.builder import load_config
+from pyfwimagebuilder.daemon import DaemonServer, token_path
+from pyfwimagebuilder.pyfwimagebuilder import main
+
+DATA_FOLDER = Path(__file__).parent.absolute() / 'data' / 'MCU8'
+
+APPFILE = DATA_FOLDER / 'applications' / 'AVR128DA48_App_checksum.hex'
+CONFIGFILE = DATA_FOLDER / 'v0.3.0' / 'configs' / 'bootloader_config_avr.toml'
+REFERENCEFILE = DATA_FOLDER / 'v0.3.0' / 'AVR128DA48_App_checksum_v0_3_0.image'
+DECODEDFILE = DATA_FOLDER / 'v0.3.0' / 'decoded' / 'AVR128DA48_App_checksum_v0_3_0.image.txt'
+
+class TestDaemon(unittest.TestCase):
+    """Test running actions in the daemon
+    """
+    def setUp(self):
+        # Keep the token files of the test daemons out of the home directory
+        token_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(token_directory.cleanup)
+        token_directory_patch = patch('pyfwimagebuilder.daemon.TOKEN_DIRECTORY', Path(token_directory.name))
+        token_directory_patch.start()
+        self.addCleanup(token_directory_patch.stop)
+
+    def _start_daemon(self):
+        """Start a daemon on a free port
+
+        :return: Port of the daemon
+        :rtype: int
+        """
+        server = DaemonServer(0, jobs=2)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(thread.join)
+        self.addCleanup(server.shutdown)
+        return server.server_address[1]
+
+    def test_daemon_actions(self):
+        """Test building, decoding and verifying in the daemon with a warm configuration
+        """
+        port = str(self._start_daemon())
+        with tempfile.TemporaryDirectory() as tempdir:
+            with patch('pyfwimagebuilder.daemon.load_config', wraps=load_config) as mock_load_config:
+                for name in ('first', 'second'):
+                    imagefile = Path(tempdir) / f'{name}.img'
+                    testargs = ["pyfwimagebuilder", "build", "-i", str(APPFILE), "-c", str(CONFIGFILE),
+                                "-o", str(imagefile), "--daemon", "--port", port]
+                    with patch.object(sys, 'argv', testargs):
+                        self.assertEqual(main(), 0)
+                    self.assertEqual(imagefile.read_bytes(), REFERENCEFILE.read_bytes())
+                # The configuration is loaded once and reused by the second build
+                self.assertEqual(mock_load_config.call_count, 1)
+
+            # The decoded image is printed by the client like by a local decode. The daemon sends
+            # it in many small records while decoding.
+            outputs = []
+            for daemon_args in ([], ["--daemon", "--port", port]):
+                testargs = ["pyfwimagebuilder", "decode", "-i", str(imagefile), "-c", str(CONFIGFILE),
+                            "-v", "warning"] + daemon_args
+                with patch.object(sys, 'argv', testargs), patch('sys.stdout', new_callable=io.StringIO) as stdout, \
+                        patch('pyfwimagebuilder.daemon._StdoutRecords.BUFFER_SIZE', 100):
+                    self.assertEqual(main(), 0)
+                outputs.append(stdout.getvalue())
+            self.assertEqual(outputs[1], outputs[0])
+            self.assertTrue(outputs[1].startswith(DECODEDFILE.read_text()))
+
+            testargs = ["pyfwimagebuilder", "verify", "-i", str(imagefile), "-x", str(APPFILE), "-c", str(CONFIGFILE),
+                        "-j", "1", "--daemon", "--port", port]
+            with patch.object(sys, 'argv', testargs):
+                self.assertEqual(main(), 0)
+
+            # Errors in the daemon are reported by the client
+            testargs = ["pyfwimagebuilder", "build", "-i", str(Path(tempdir) / 'missing.hex'), "-c", str(CONFIGFILE),
+                        "--daemon", "--port", port]
+            with patch.object(sys, 'argv', testargs):
+                self.assertEqual(main(), 1)
+
+    def test_rejected_requests(self):
+        """Test that jobs without the token, with another content type or for another host are rejected
+        """
+        port = self._start_daemon()
+        token = token_path(port).read_text(encoding="ascii")
+        if sys.platform != "win32":
+            self.assertEqual(token_path(port).stat().st_mode & 0o777, 0o600)
+        with tempfile.TemporaryDirectory() as tempdir:
+            imagefile = Path(tempdir) / 'app.img'
+            body = json.dumps({"input": str(APPFILE), "config": str(CONFIGFILE), "output": str(imagefile),
+                               "dump": None, "manifest": None, "cache_dir": None, "previous": None,
+                               "baseline": None, "include_empty_blocks": False, "engine": "python"})
+            headers = {"Content-Type": "application/json", "X-Daemon-Token": token}
+            requests = [
+                ({"Content-Type": "application/json"}, 403),
+                ({"Content-Type": "application/json", "X-Daemon-Token": "0" * len(token)}, 403),
+                ({"Content-Type": "text/plain", "X-Daemon-Token": token}, 415),
+                (dict(headers, Host=f"localhost.example:{port}"), 403),
+                (headers, 200),
+            ]
+            for request_headers, status in requests:
+                connection = http.client.HTTPConnection('127.0.0.1', port)
+                try:
+                    connection.request("POST", "/build", body, request_headers)
+                    response = connection.getresponse()
+                    response.read()
+                finally:
+                    connection.close()
+                self.assertEqual(response.status, status)
+                # Only the accepted job writes the image
+                self.assertEqual(imagefile.exists(), status == 200)
+        # The token file is removed with the daemon
+        server = DaemonServer(0)
+        path = token_path(server.server_address[1])
+        self.assertTrue(path.exists())
+        server.server_close()
+        self.assertFalse(path.exists())
+
+    def test_no_daemon(self):
+        """Test that actions run locally when no daemon is running
+        """
+        # Find a port that nothing listens on
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = str(sock.getsockname()[1])
+        with tempfile.TemporaryDirectory() as tempdir:
+            imagefile = Path(tempdir) / 'app.img'
+            testargs = ["pyfwimagebuilder", "build", "-i", str(APPFILE), "-c", str(CONFIGFILE),
+                        "-o", str(imagefile), "--daemon", "--port", port]
+            with patch.object(sys, 'argv', testargs):
+                self.assertEqual(main(), 0)
+            self.assertEqual(imagefile.read_bytes(), REFERENCEFILE.read_bytes())
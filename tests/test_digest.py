@@ -0,0 +1,56 @@
+"""
+Tests related to the digest module
+"""
+import io
+import json
+import hashlib
+import unittest
+import tempfile
+import zlib
+from pathlib import Path
+from pyfwimagebuilder.builder import build
+from pyfwimagebuilder.digest import ImageDigest
+from pyfwimagebuilder.mcu8builder import Mcu8FirmwareImage, Mcu8ImageBlockBase
+
+DATA_FOLDER = Path(__file__).parent.absolute() / 'data' / 'MCU8'
+
+APPFILE = DATA_FOLDER / 'applications' / 'AVR128DA48_App_checksum.hex'
+CONFIGFILE = DATA_FOLDER / 'v0.3.0' / 'configs' / 'bootloader_config_avr.toml'
+REFERENCEFILE = DATA_FOLDER / 'v0.3.0' / 'AVR128DA48_App_checksum_v0_3_0.image'
+
+class TestImageDigest(unittest.TestCase):
+    """Test the digests computed while images are serialized
+    """
+    def test_serialize(self):
+        """Test that writing and packing an image give the same digests as hashing the image bytes
+        """
+        data = REFERENCEFILE.read_bytes()
+        image = Mcu8FirmwareImage.from_bytes(Mcu8ImageBlockBase, data)
+        packed_digest = ImageDigest()
+        image.to_bytes(packed_digest)
+        written_digest = ImageDigest()
+        image.write(io.BytesIO(), written_digest)
+        for digest in (packed_digest, written_digest):
+            self.assertEqual(digest.sha256, hashlib.sha256(data).hexdigest())
+            self.assertEqual(digest.crc32, zlib.crc32(data))
+            self.assertEqual(digest.size, len(data))
+            self.assertEqual(digest.blocks, [(offset, 527, zlib.crc32(data[offset:offset + 527]))
+                                             for offset in range(0, len(data), 527)])
+
+    def test_build_manifest(self):
+        """Test the manifest written by a build, also when the image comes from the build cache
+        """
+        data = REFERENCEFILE.read_bytes()
+        with tempfile.TemporaryDirectory() as tempdir:
+            cache_dir = Path(tempdir) / 'cache'
+            for name in ('first', 'second'):
+                manifest = Path(tempdir) / f'{name}.json'
+                build(APPFILE, CONFIGFILE, Path(tempdir) / f'{name}.img', cache_dir=cache_dir,
+                      manifest_filename=manifest)
+                with manifest.open('r', encoding='utf-8') as manifest_file:
+                    content = json.load(manifest_file)
+                self.assertEqual(content['size'], len(data))
+                self.assertEqual(content['sha256'], hashlib.sha256(data).hexdigest())
+                self.assertEqual(content['crc32'], f"{zlib.crc32(data):08x}")
+                self.assertEqual(content['blocks'][1], {'offset': 527, 'size': 527,
+                                                        'crc32': f"{zlib.crc32(data[527:1054]):08x}"})
@@ -0,0 +1,117 @@
+"""
+Tests related to the hexfile module
+"""
+import unittest
+import io
+from pathlib import Path
+import pytest
+import intelhex
+from pyfwimagebuilder.hexfile import HexFile, HexFileError, load_hexfile
+
+DATA_FOLDER = Path(__file__).parent.absolute() / 'data'
+
+def _record(address, record_type, data):
+    """Create an Intel HEX record with a valid checksum"""
+    record = bytes([len(data), address >> 8, address & 0xFF, record_type]) + bytes(data)
+    checksum = (-sum(record)) & 0xFF
+    return ":" + (record + bytes([checksum])).hex().upper()
+
+class TestHexFile(unittest.TestCase):
+    """Test Intel HEX loading
+    """
+    def test_same_as_intelhex(self):
+        """Test that segments and data are the same as loaded by IntelHex
+        """
+        for hexfilename in sorted(DATA_FOLDER.glob('*/applications/*.hex')):
+            with self.subTest(hexfile=hexfilename.name):
+                reference = intelhex.IntelHex()
+                reference.fromfile(hexfilename, format='hex')
+                hexfile = HexFile.fromfile(hexfilename)
+                self.assertEqual(hexfile.segments(), reference.segments())
+                for start, stop in reference.segments():
+                    self.assertEqual(hexfile.tobinarray(start=start, end=stop - 1),
+                                     bytes(reference.tobinarray(start=start, end=stop - 1)))
+                # Range crossing the end of the first segment
+                start, stop = reference.segments()[0][1] - 8, reference.segments()[0][1] + 8
+                self.assertEqual(hexfile.tobinarray(start=start, end=stop - 1),
+                                 bytes(reference.tobinarray(start=start, end=stop - 1)))
+
+    def test_extended_addresses(self):
+        """Test extended segment and linear address records and merging of unordered records
+        """
+        hexfile = HexFile()
+        hexfile.loadhex([
+            _record(0, 0x02, [0x10, 0x00]),
+            _record(0x0004, 0x00, [4, 5, 6, 7]),
+            _record(0x0000, 0x00, [0, 1, 2, 3]),
+            _record(0, 0x04, [0x00, 0x01]),
+            _record(0xFFFE, 0x00, [8, 9, 10, 11]),
+            _record(0, 0x01, []),
+            _record(0x0000, 0x00, [0xEE]),
+        ])
+        self.assertEqual(hexfile.segments(), [(0x10000, 0x10008), (0x1FFFE, 0x20002)])
+        self.assertEqual(hexfile.tobinarray(start=0x10000, end=0x10007), bytes(range(8)))
+        self.assertEqual(hexfile.tobinarray(start=0x1FFFE, end=0x20001), bytes([8, 9, 10, 11]))
+
+    def test_empty_data_records(self):
+        """Test that data records without data do not create segments
+        """
+        lines = [
+            _record(0x0010, 0x00, []),
+            _record(0x0010, 0x00, [1, 2, 3, 4]),
+            _record(0x0100, 0x00, []),
+        ]
+        hexfile = HexFile()
+        hexfile.loadhex(lines)
+        reference = intelhex.IntelHex(io.StringIO("\n".join(lines + [_record(0, 0x01, [])]) + "\n"))
+        self.assertEqual(hexfile.segments(), [(0x10, 0x14)])
+        self.assertEqual(hexfile.segments(), reference.segments())
+
+    def test_invalid_records(self):
+        """Test detection of checksum errors, invalid records and overlapping data
+        """
+        valid = _record(0x0000, 0x00, [1, 2, 3, 4])
+        with pytest.raises(HexFileError):
+            HexFile().loadhex([valid[:-2] + "00"])
+        with pytest.raises(HexFileError):
+            HexFile().loadhex([valid[1:]])
+        with pytest.raises(HexFileError):
+            HexFile().loadhex([valid[:-4] + valid[-2:]])
+        with pytest.raises(HexFileError):
+            HexFile().loadhex([valid, _record(0x0002, 0x00, [1])])
+
+    def test_load_hexfile_fallback(self):
+        """Test that IntelHex is used when the hex file can not be parsed
+        """
+        hexfilename = DATA_FOLDER / 'MCU8' / 'applications' / 'AVR128DA48_App_checksum.hex'
+        self.assertIsInstance(load_hexfile(hexfilename), HexFile)
+        with self.assertRaises(intelhex.IntelHexError):
+            load_hexfile(DATA_FOLDER / 'MCU8' / 'v0.3.0' / 'configs' / 'bootloader_config_avr.toml')
+
+    def test_write(self):
+        """Test writing Intel HEX records and raw binaries
+        """
+        hexfile = HexFile.fromdata([(0x1FFF8, bytes(range(20))), (0x20020, b"\x01\x02"), (0x1FFF0, bytes(8))])
+        self.assertEqual(hexfile.segments(), [(0x1FFF0, 0x2000C), (0x20020, 0x20022)])
+        with pytest.raises(HexFileError):
+            HexFile.fromdata([(0x100, b"\x00\x00"), (0x100, b"\x00")])
+
+        output = io.StringIO()
+        hexfile.write_hex(output)
+        lines = output.getvalue().splitlines()
+        # Records are split at the 64 KiB boundary
+        self.assertEqual(lines[:3], [_record(0, 0x04, [0x00, 0x01]),
+                                     _record(0xFFF0, 0x00, bytes(8) + bytes(range(8))),
+                                     _record(0, 0x04, [0x00, 0x02])])
+        self.assertEqual(lines[-1], ":00000001FF")
+        reference = intelhex.IntelHex()
+        reference.loadhex(io.StringIO(output.getvalue()))
+        self.assertEqual(reference.segments(), hexfile.segments())
+        self.assertEqual(bytes(reference.tobinarray(start=0x1FFF0, end=0x20021)),
+                         hexfile.tobinarray(start=0x1FFF0, end=0x20021))
+
+        output = io.BytesIO()
+        hexfile.write_bin(output, base=0x1FFE0)
+        self.assertEqual(output.getvalue(), b"\xFF" * 16 + hexfile.tobinarray(start=0x1FFF0, end=0x20021))
+        with pytest.raises(ValueError):
+            hexfile.write_bin(io.BytesIO(), base=0x20000)
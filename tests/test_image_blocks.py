@@ -2,9 +2,13 @@
 Unit tests for image block encoding/decoding.
 """
 import unittest
+import io
+import hashlib
 from pathlib import Path
 import pytest
-from pyfwimagebuilder.mcu8builder import MetaDataBlock, FlashWriteBlock, BlockType
+from mock import patch, PropertyMock
+from pyfwimagebuilder.mcu8builder import MetaDataBlock, FlashWriteBlock, PatternFillBlock, BlockType
+from pyfwimagebuilder.records import block_record
 
 DATA_FOLDER = Path(__file__).parent.absolute() / 'data' / 'MCU8'
 
@@ -57,3 +61,31 @@ class TestImageBlocks(unittest.TestCase):
         tmp[2] = BlockType.METADATA.value # Set metadata block type instead of flash write block type
         with pytest.raises(ValueError):
             FlashWriteBlock.from_bytes(tmp)
+
+    def test_flashwrite_block_dump(self):
+        """Test the hexdump of a flash write block
+        """
+        flashblock = FlashWriteBlock(0x1000, 1, 2, 3, 4, bytes(range(20)))
+        dump = io.StringIO()
+        flashblock.dump(dump, '  ')
+        lines = dump.getvalue().splitlines()
+        self.assertEqual(lines[-3], "  Address   00 01 02 03 04 05 06 07 08 09 0A 0B 0C 0D 0E 0F")
+        self.assertEqual(lines[-2], "  00001000  00 01 02 03 04 05 06 07 08 09 0A 0B 0C 0D 0E 0F")
+        # The row with the remaining bytes is indented by one more space
+        self.assertEqual(lines[-1], "  00001010   10 11 12 13")
+        self.assertEqual(str(flashblock), "".join(line[2:] + "\n" for line in lines))
+
+    def test_pattern_fill_block_record(self):
+        """Test that the record of a pattern fill block only expands the pattern for the payload hash
+        """
+        block = PatternFillBlock(0x1000, 1, 2, 3, 4, 512, 0xFFFF, b'\xff\xff')
+        with patch.object(PatternFillBlock, 'data', new_callable=PropertyMock) as data:
+            record = block_record(1, block)
+        data.assert_not_called()
+        self.assertEqual(record['payload_length'], 512 * 0xFFFF)
+        self.assertIsNone(record['payload_hash'])
+
+        block = PatternFillBlock(0x1000, 1, 2, 3, 4, 16, 2, b'\x12\x34')
+        record = block_record(1, block, 'sha256')
+        self.assertEqual(record['payload_length'], 32)
+        self.assertEqual(record['payload_hash'], hashlib.sha256(b'\x12\x34' * 16).hexdigest())
@@ -1,9 +1,12 @@
 import unittest
 import toml
 import os
-from pyfwimagebuilder.mcu32builder import FirmwareImageBuilderMcu32, Mcu32FirmwareImage
+from intelhex import IntelHex
+from pyfwimagebuilder.mcu32builder import FirmwareImageBuilderMcu32, Mcu32FirmwareImage, Mcu32ImageBlockBase, \
+    PatternFillBlock
 
 pic32cm_v3_test_config = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data','MCU32','v1.0.0', 'configs', 'bootloader_config_pic32cm.toml')
+pic32cm_test_app = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'MCU32', 'applications', 'PIC32_TestApp.X.production.hex')
 
 class TestMcu32Builder_default(unittest.TestCase):
     def __init__(self, methodName: str = "runTest") -> None:
@@ -15,7 +18,7 @@ class TestMcu32Builder_default(unittest.TestCase):
         min_version = mcu_builder.versiontobytes(mcu_builder.MIN_FORMAT_VERSION)
         max_version = mcu_builder.versiontobytes(mcu_builder.MAX_FORMAT_VERSION)
         # Versions are returned in little endian
-        self.assertEqual(max_version, bytes([0,0,1]), "versiontobytes Failed.")
+        self.assertEqual(max_version, bytes([0,3,1]), "versiontobytes Failed.")
         self.assertEqual(min_version, bytes([0,0,1]), "versiontobytes Failed.")
 
     def test_is_valid_version(self):
@@ -23,4 +26,48 @@ class TestMcu32Builder_default(unittest.TestCase):
         current_version = self.config['bootloader']['IMAGE_FORMAT_VERSION']
         self.assertTrue((mcu_builder.is_valid_version(current_version)),"Version Check Failed.")
         self.assertFalse((mcu_builder.is_valid_version("0.2.0")),"Version Check Failed.")
-        self.assertFalse((mcu_builder.is_valid_version("1.1.0")),"Version Check Failed.")
+        self.assertTrue((mcu_builder.is_valid_version("1.1.0")),"Version Check Failed.")
+        self.assertTrue((mcu_builder.is_valid_version("1.2.0")),"Version Check Failed.")
+        self.assertTrue((mcu_builder.is_valid_version("1.3.0")),"Version Check Failed.")
+        self.assertFalse((mcu_builder.is_valid_version("1.4.0")),"Version Check Failed.")
+
+    def test_build_blocks_reference_segment(self):
+        ihex = IntelHex()
+        ihex.fromfile(pic32cm_test_app, format='hex')
+        mcu_builder = FirmwareImageBuilderMcu32(self.config, Mcu32FirmwareImage)
+        image = mcu_builder.build(ihex)
+        flash_blocks = image.blocks[1:]
+        self.assertTrue(flash_blocks)
+        for block in flash_blocks:
+            self.assertIsInstance(block.data, memoryview)
+            self.assertEqual(bytes(block.data), ihex.tobinstr(start=block.address, size=len(block.data)))
+
+    def test_build_compressed(self):
+        ihex = IntelHex()
+        ihex.fromfile(pic32cm_test_app, format='hex')
+        image = FirmwareImageBuilderMcu32(self.config, Mcu32FirmwareImage).build(ihex)
+        compressed_config = toml.load(pic32cm_v3_test_config)
+        compressed_config['bootloader']['IMAGE_FORMAT_VERSION'] = "1.1.0"
+        compressed_image = FirmwareImageBuilderMcu32(compressed_config, Mcu32FirmwareImage).build(ihex)
+        data = compressed_image.to_bytes()
+        self.assertLess(len(data), len(image.to_bytes()))
+        decoded_image = Mcu32FirmwareImage.from_bytes(Mcu32ImageBlockBase, data)
+        self.assertEqual(decoded_image.to_bytes(), data)
+        self.assertEqual(len(decoded_image.blocks), len(image.blocks))
+        for block, decoded_block in zip(image.blocks[1:], decoded_image.blocks[1:]):
+            self.assertEqual(decoded_block.address, block.address)
+            self.assertEqual(bytes(decoded_block.data), bytes(block.data))
+
+    def test_build_pattern_fill(self):
+        ihex = IntelHex()
+        ihex.fromfile(pic32cm_test_app, format='hex')
+        image = FirmwareImageBuilderMcu32(self.config, Mcu32FirmwareImage).build(ihex, include_empty_blocks=True)
+        pattern_config = toml.load(pic32cm_v3_test_config)
+        for version, has_pattern_fill in (("1.1.0", False), ("1.2.0", True)):
+            pattern_config['bootloader']['IMAGE_FORMAT_VERSION'] = version
+            pattern_image = FirmwareImageBuilderMcu32(pattern_config, Mcu32FirmwareImage).build(
+                ihex, include_empty_blocks=True)
+            self.assertEqual(PatternFillBlock in [type(block) for block in pattern_image.blocks], has_pattern_fill)
+            decoded_image = Mcu32FirmwareImage.from_bytes(Mcu32ImageBlockBase, pattern_image.to_bytes())
+            self.assertEqual(b"".join(bytes(block.data) for block in decoded_image.blocks[1:]),
+                             b"".join(bytes(block.data) for block in image.blocks[1:]))
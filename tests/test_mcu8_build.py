@@ -4,19 +4,43 @@ Tests releated to mcu8builder module
 import unittest
 import os
 import io
+import pickle
+import tempfile
 from pathlib import Path
 import toml
 from mock import patch
 import intelhex
-from pyfwimagebuilder.mcu8builder import FirmwareImageBuilderMcu8, Mcu8FirmwareImage
+from pyfwimagebuilder.mcu8builder import FirmwareImageBuilderMcu8, Mcu8FirmwareImage, Mcu8ImageBlockBase, \
+    CompressedFlashWriteBlock, PatternFillBlock
 from pyfwimagebuilder.builder import builder_factory
+from pyfwimagebuilder.imagebuilder import BlockTable, ImageDecodingError
+from pyfwimagebuilder.decoder import decode_lazy
+from pyfwimagebuilder.observer import PipelineObserver
 
 pic18f_v3_test_config = os.path.join(os.path.dirname(os.path.abspath(__file__)),
                                      'data','MCU8','v0.3.0', 'configs',
                                      'bootloader_config_pic18.toml')
 
+pic16f_v3_test_config = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                     'data','MCU8','v0.3.0', 'configs',
+                                     'bootloader_config_pic16.toml')
+
 DATA_FOLDER = Path(__file__).parent.absolute() / 'data' / 'MCU8'
 
+def _flash_contents(image):
+    """Return the start address and the concatenated data of the flash blocks in an image"""
+    return image.blocks[1].address, b"".join(bytes(block.data) for block in image.blocks[1:])
+
+def _flash_pages(images, page_size, erased_page):
+    """Return the data of the pages that are not erased after writing the flash blocks of images in order"""
+    pages = {}
+    for image in images:
+        for block in image.blocks[1:]:
+            data = bytes(block.data)
+            for offset in range(0, len(data), page_size):
+                pages[block.address + offset] = data[offset:offset + page_size]
+    return {address: data for address, data in pages.items() if data != erased_page}
+
 class TestMcu8BuilderPic18(unittest.TestCase):
     """
     Testing FirmwareImageBuilderMcu8 for PIC18 parts
@@ -51,7 +75,7 @@ class TestMcu8BuilderPic18(unittest.TestCase):
         mcu8_builder = FirmwareImageBuilderMcu8(self.config, Mcu8FirmwareImage)
         min_version = mcu8_builder.versiontobytes(mcu8_builder.MIN_FORMAT_VERSION)
         max_version = mcu8_builder.versiontobytes(mcu8_builder.MAX_FORMAT_VERSION)
-        self.assertEqual(max_version, bytes([0,3,0]), "versiontobytes Failed.")
+        self.assertEqual(max_version, bytes([0,6,0]), "versiontobytes Failed.")
         self.assertEqual(min_version, bytes([0,3,0]), "versiontobytes Failed.")
 
     def test_is_valid_version(self):
@@ -61,7 +85,10 @@ class TestMcu8BuilderPic18(unittest.TestCase):
         current_version = self.config['bootloader']['IMAGE_FORMAT_VERSION']
         self.assertTrue((mcu8_builder.is_valid_version(current_version)),"Version Check Failed.")
         self.assertTrue((mcu8_builder.is_valid_version("0.3.0")),"Version Check Failed.")
-        self.assertFalse((mcu8_builder.is_valid_version("0.4.0")),"Version Check Failed.")
+        self.assertTrue((mcu8_builder.is_valid_version("0.4.0")),"Version Check Failed.")
+        self.assertTrue((mcu8_builder.is_valid_version("0.5.0")),"Version Check Failed.")
+        self.assertTrue((mcu8_builder.is_valid_version("0.6.0")),"Version Check Failed.")
+        self.assertFalse((mcu8_builder.is_valid_version("0.7.0")),"Version Check Failed.")
         self.assertFalse((mcu8_builder.is_valid_version("0.2.0")),"Version Check Failed.")
         self.assertFalse((mcu8_builder.is_valid_version("1.0.0")),"Version Check Failed.")
 
@@ -97,3 +124,292 @@ class TestMcu8BuilderPic18(unittest.TestCase):
         expected_message = f"Skipping segment from 0x{segment_start:08X}"
         log_messages = [call[0][1] for call in mock_log.call_args_list]
         self.assertTrue(any(expected_message in message for message in log_messages))
+
+    def test_build_to_stream(self):
+        """Test that streaming an image gives the same result as building it in memory
+        """
+        hexfile = DATA_FOLDER / 'applications' / 'PIC18F57Q43_App_checksum.hex'
+        ihex = intelhex.IntelHex()
+        ihex.fromfile(hexfile, format="hex")
+
+        builder = builder_factory(self.config['bootloader']['ARCH'], self.config)
+        for include_empty_blocks in [False, True]:
+            stream = io.BytesIO()
+            size = builder.build_to_stream(ihex, stream, include_empty_blocks=include_empty_blocks)
+            image = builder.build(ihex, include_empty_blocks=include_empty_blocks).to_bytes()
+            self.assertEqual(stream.getvalue(), image)
+            self.assertEqual(size, len(image))
+
+    def test_build_observer(self):
+        """Test the metrics and progress reported to an observer by the build and decode pipelines
+        """
+        class RecordingObserver(PipelineObserver):
+            """Observer keeping all events"""
+            progress_interval = 8
+
+            def __init__(self):
+                self.progress_blocks = []
+                self.phases = []
+                self.stats = None
+
+            def progress(self, stats):
+                self.progress_blocks.append(stats.blocks)
+
+            def phase_finished(self, name, seconds, stats):
+                self.phases.append(name)
+
+            def finished(self, stats):
+                self.stats = stats.to_dict()
+
+        hexfile = DATA_FOLDER / 'applications' / 'PIC18F57Q43_App_checksum.hex'
+        ihex = intelhex.IntelHex()
+        ihex.fromfile(hexfile, format="hex")
+        # Add a segment after the flash memory area
+        ihex[self.config["bootloader"]["FLASH_END"] + 1] = 0xaa
+
+        builder = builder_factory(self.config['bootloader']['ARCH'], self.config)
+        full_image = builder.build(ihex, include_empty_blocks=True)
+        observer = RecordingObserver()
+        image = builder.build(ihex, observer=observer)
+        data = image.to_bytes()
+        self.assertEqual(observer.phases, ['build'])
+        self.assertEqual(observer.stats['blocks'], len(image.blocks))
+        self.assertEqual(observer.stats['bytes_out'], len(data))
+        self.assertEqual(observer.stats['empty_blocks_skipped'], len(full_image.blocks) - len(image.blocks))
+        # Only the flash segment is built, the configuration segments and the added segment are skipped
+        self.assertEqual(observer.stats['segments_skipped'], len(ihex.segments()) - 1)
+        self.assertEqual(observer.stats['bytes_in'], sum(len(block.data) for block in full_image.blocks[1:]))
+        # Progress is reported in batches
+        self.assertEqual(observer.progress_blocks, list(range(8, len(image.blocks) + 1, 8)))
+
+        for engine in ['python', 'numpy']:
+            with self.subTest(engine=engine):
+                stream_observer = RecordingObserver()
+                builder.build_to_stream(ihex, io.BytesIO(), engine=engine, observer=stream_observer)
+                self.assertEqual({**stream_observer.stats, 'phase_seconds': None},
+                                 {**observer.stats, 'phase_seconds': None})
+
+        decode_observer = RecordingObserver()
+        Mcu8FirmwareImage.from_bytes(Mcu8ImageBlockBase, data, decode_observer)
+        self.assertEqual(decode_observer.phases, ['decode'])
+        self.assertEqual(decode_observer.stats['blocks'], len(image.blocks))
+        self.assertEqual(decode_observer.stats['bytes_in'], len(data))
+
+    def test_build_incremental(self):
+        """Test that an incremental build reuses unchanged blocks and gives the same result as a full build
+        """
+        hexfile = DATA_FOLDER / 'applications' / 'PIC18F57Q43_App_checksum.hex'
+        ihex = intelhex.IntelHex()
+        ihex.fromfile(hexfile, format="hex")
+
+        builder = builder_factory(self.config['bootloader']['ARCH'], self.config)
+        previous_image = Mcu8FirmwareImage.from_bytes(Mcu8ImageBlockBase, builder.build(ihex).to_bytes())
+        # Change one byte in the first page
+        changed_address = previous_image.blocks[1].address + 1
+        ihex[changed_address] = ihex[changed_address] ^ 0xFF
+
+        with patch.object(builder, '_generate_flash_write_block', wraps=builder._generate_flash_write_block) as mock_gen:
+            image = builder.build_incremental(ihex, previous_image)
+            # Only the changed page is generated
+            self.assertEqual(mock_gen.call_count, 1)
+        self.assertEqual(image.to_bytes(), builder.build(ihex).to_bytes())
+
+        # Images built with a different configuration are not reused
+        other_config = toml.load(pic18f_v3_test_config)
+        other_config['bootloader']['PAGE_ERASE_KEY'] = 0x1234
+        other_builder = builder_factory(other_config['bootloader']['ARCH'], other_config)
+        with patch.object(other_builder, '_generate_flash_write_block',
+                          wraps=other_builder._generate_flash_write_block) as mock_gen:
+            image = other_builder.build_incremental(ihex, previous_image)
+            self.assertEqual(mock_gen.call_count, len(image.blocks) - 1)
+        self.assertEqual(image.to_bytes(), other_builder.build(ihex).to_bytes())
+
+    def test_decoded_block_table(self):
+        """Test that decoded images create their blocks on access from a compact table
+        """
+        hexfile = DATA_FOLDER / 'applications' / 'PIC18F57Q43_App_checksum.hex'
+        ihex = intelhex.IntelHex()
+        ihex.fromfile(hexfile, format="hex")
+
+        builder = builder_factory(self.config['bootloader']['ARCH'], self.config)
+        image = builder.build(ihex, include_empty_blocks=True)
+        data = bytes(image.to_bytes())
+        decoded_image = pickle.loads(pickle.dumps(Mcu8FirmwareImage.from_bytes(Mcu8ImageBlockBase, data)))
+        self.assertIsInstance(decoded_image.blocks, BlockTable)
+        self.assertEqual(len(decoded_image.blocks), len(image.blocks))
+        self.assertEqual(list(decoded_image.blocks.addresses[1:]), [block.address for block in image.blocks[1:]])
+        self.assertEqual(decoded_image.to_bytes(), data)
+        self.assertEqual(str(decoded_image), str(Mcu8FirmwareImage.from_bytes(Mcu8ImageBlockBase, data)))
+        block = decoded_image.blocks[-1]
+        self.assertEqual(block.to_bytes(), image.blocks[-1].to_bytes())
+        self.assertIsInstance(block.data, memoryview)
+        self.assertFalse(hasattr(block, '__dict__'))
+
+    def test_decode_lazy(self):
+        """Test random access to the blocks of a memory mapped image by index and by address
+        """
+        configfile = DATA_FOLDER / 'v0.3.0' / 'configs' / 'bootloader_config_pic16.toml'
+        imagefile = DATA_FOLDER / 'v0.3.0' / 'PIC16F18875_App_checksum_v0_3_0.image'
+        image = Mcu8FirmwareImage.from_bytes(Mcu8ImageBlockBase, imagefile.read_bytes())
+        with decode_lazy(imagefile, configfile) as lazy_image:
+            self.assertEqual(len(lazy_image.blocks), len(image.blocks))
+            self.assertEqual(lazy_image.metadata.to_bytes(), image.blocks[0].to_bytes())
+            self.assertEqual(lazy_image.blocks[-1].to_bytes(), image.blocks[-1].to_bytes())
+            for block in image.blocks[1:]:
+                # Word addresses, the last word of the block is still inside it
+                last_address = block.address + len(block.data) // 2 - 1
+                self.assertEqual(lazy_image.block_at_address(last_address).to_bytes(), block.to_bytes())
+            self.assertIsNone(lazy_image.block_at_address(image.blocks[1].address - 1))
+            last = image.blocks[-1]
+            self.assertIsNone(lazy_image.block_at_address(last.address + len(last.data) // 2))
+            block = lazy_image.blocks[1]
+        # Decoded blocks stay valid after the image is closed
+        self.assertEqual(block.to_bytes(), image.blocks[1].to_bytes())
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            corrupt = Path(tempdir) / 'corrupt.image'
+            corrupt.write_bytes(imagefile.read_bytes()[:-1])
+            with self.assertRaises(ImageDecodingError):
+                decode_lazy(corrupt, configfile)
+
+    def test_build_delta(self):
+        """Test that a delta image only holds the blocks that differ from the baseline
+        """
+        hexfile = DATA_FOLDER / 'applications' / 'PIC18F57Q43_App_checksum.hex'
+        ihex = intelhex.IntelHex()
+        ihex.fromfile(hexfile, format="hex")
+
+        config = toml.load(pic18f_v3_test_config)
+        config['bootloader']['IMAGE_FORMAT_VERSION'] = "0.6.0"
+        builder = builder_factory(config['bootloader']['ARCH'], config)
+        full_image = builder.build(ihex)
+        baseline_image = Mcu8FirmwareImage.from_bytes(Mcu8ImageBlockBase, full_image.to_bytes())
+        self.assertFalse(baseline_image.blocks[0].delta)
+        delta_image = builder.build_delta(ihex, baseline_image)
+        self.assertEqual(len(delta_image.blocks), 1)
+
+        # The metadata marks the image as a delta image
+        metadata = Mcu8FirmwareImage.from_bytes(Mcu8ImageBlockBase, delta_image.to_bytes()).blocks[0]
+        self.assertTrue(metadata.delta)
+        self.assertIn("Flags: 0x01 (delta image)", str(metadata))
+        self.assertEqual(metadata.to_bytes(), delta_image.blocks[0].to_bytes())
+
+        # Change one byte in the first page
+        changed_address = baseline_image.blocks[1].address + 1
+        ihex[changed_address] = ihex[changed_address] ^ 0xFF
+        delta_image = builder.build_delta(ihex, baseline_image)
+        full_image = builder.build(ihex)
+        self.assertEqual(len(delta_image.blocks), 2)
+        self.assertEqual(delta_image.blocks[1].to_bytes(), full_image.blocks[1].to_bytes())
+
+        # Pages that are no longer in the hexfile are erased
+        last = baseline_image.blocks[-1]
+        del ihex[last.address:last.address + len(last.data)]
+        delta_image = builder.build_delta(ihex, baseline_image)
+        erase_block = delta_image.blocks[-1]
+        self.assertEqual(erase_block.address, last.address)
+        self.assertEqual(bytes(erase_block.data), builder.empty_block(builder.write_block_size))
+        erased_page = builder.empty_block(builder.write_block_size)
+        self.assertEqual(_flash_pages([baseline_image, delta_image], builder.write_block_size, erased_page),
+                         _flash_pages([builder.build(ihex)], builder.write_block_size, erased_page))
+
+        # Format versions without the delta flag cannot hold delta images
+        old_builder = builder_factory(self.config['bootloader']['ARCH'], self.config)
+        with self.assertRaises(ValueError):
+            old_builder.build_delta(ihex, old_builder.build(ihex))
+
+        # The baseline must be built with the same configuration
+        other_config = toml.load(pic18f_v3_test_config)
+        other_config['bootloader']['IMAGE_FORMAT_VERSION'] = "0.6.0"
+        other_config['bootloader']['PAGE_ERASE_KEY'] = 0x1234
+        other_builder = builder_factory(other_config['bootloader']['ARCH'], other_config)
+        with self.assertRaises(ValueError):
+            other_builder.build_delta(ihex, baseline_image)
+
+    def test_build_pattern_fill(self):
+        """Test that runs of pages with a repeated pattern are merged into pattern fill blocks
+        """
+        hexfile = DATA_FOLDER / 'applications' / 'PIC16F18875_App_checksum.hex'
+        ihex = intelhex.IntelHex()
+        ihex.fromfile(hexfile, format="hex")
+
+        config = toml.load(pic16f_v3_test_config)
+        builder = builder_factory(config['bootloader']['ARCH'], config)
+        config = toml.load(pic16f_v3_test_config)
+        config['bootloader']['IMAGE_FORMAT_VERSION'] = "0.5.0"
+        pattern_builder = builder_factory(config['bootloader']['ARCH'], config)
+
+        image = builder.build(ihex, include_empty_blocks=True)
+        pattern_image = pattern_builder.build(ihex, include_empty_blocks=True)
+        fill_blocks = [block for block in pattern_image.blocks if isinstance(block, PatternFillBlock)]
+        self.assertTrue(fill_blocks)
+        self.assertTrue(all(block.pattern == b"\xFF\x3F" for block in fill_blocks))
+        self.assertTrue(any(block.page_count > 1 for block in fill_blocks))
+
+        data = pattern_image.to_bytes()
+        self.assertLess(len(data), len(image.to_bytes()) // 10)
+        decoded_image = Mcu8FirmwareImage.from_bytes(Mcu8ImageBlockBase, data)
+        self.assertEqual(decoded_image.to_bytes(), data)
+        self.assertEqual(_flash_contents(decoded_image), _flash_contents(image))
+        for block in fill_blocks:
+            self.assertEqual(block.data_length, len(block.data))
+
+        # Lookups by address use the page count of pattern fill blocks
+        with tempfile.TemporaryDirectory() as tempdir:
+            imagefile = Path(tempdir) / 'pattern.img'
+            imagefile.write_bytes(data)
+            with decode_lazy(imagefile, pic16f_v3_test_config) as lazy_image:
+                block = max(fill_blocks, key=lambda block: block.page_count)
+                # Word addresses, the last word of the last page is still inside the block
+                last_address = block.address + block.data_length // 2 - 1
+                self.assertEqual(lazy_image.block_at_address(last_address).to_bytes(), block.to_bytes())
+
+    def test_build_compressed(self):
+        """Test that compressed images decode to the same flash data as uncompressed images
+        """
+        hexfile = DATA_FOLDER / 'applications' / 'PIC18F57Q43_App_checksum.hex'
+        ihex = intelhex.IntelHex()
+        ihex.fromfile(hexfile, format="hex")
+
+        builder = builder_factory(self.config['bootloader']['ARCH'], self.config)
+        compressed_config = toml.load(pic18f_v3_test_config)
+        compressed_config['bootloader']['IMAGE_FORMAT_VERSION'] = "0.4.0"
+        compressed_builder = builder_factory(compressed_config['bootloader']['ARCH'], compressed_config)
+        for include_empty_blocks in [False, True]:
+            image = builder.build(ihex, include_empty_blocks=include_empty_blocks)
+            compressed_image = compressed_builder.build(ihex, include_empty_blocks=include_empty_blocks)
+            data = compressed_image.to_bytes()
+            self.assertLess(len(data), len(image.to_bytes()))
+            self.assertIn(CompressedFlashWriteBlock, [type(block) for block in compressed_image.blocks])
+            # Pattern fill blocks need a later format version
+            self.assertNotIn(PatternFillBlock, [type(block) for block in compressed_image.blocks])
+
+            decoded_image = Mcu8FirmwareImage.from_bytes(Mcu8ImageBlockBase, data)
+            self.assertEqual(decoded_image.to_bytes(), data)
+            self.assertEqual(_flash_contents(decoded_image), _flash_contents(image))
+
+    def test_empty_pages(self):
+        """Test that only complete write blocks with the empty pattern are reported as empty
+        """
+        builder = builder_factory(self.config['bootloader']['ARCH'], self.config)
+        page_size = builder.write_block_size
+        empty = b'\xff' * page_size
+        used = b'\x00' * page_size
+        # Empty pattern that is not aligned to a write block must not be detected
+        unaligned = b'\x00' * (page_size // 2) + b'\xff' * page_size + b'\x00' * (page_size // 2)
+        segment = empty + used + unaligned + empty + b'\xff' * 4
+        self.assertEqual(builder.empty_pages(segment), [0, 4, 5])
+        self.assertIs(builder.empty_block(page_size), builder.empty_block(page_size))
+
+    def test_empty_pages_pic16(self):
+        """Test empty write block detection with the PIC16 word pattern
+        """
+        config = toml.load(pic16f_v3_test_config)
+        builder = builder_factory(config['bootloader']['ARCH'], config)
+        page_size = builder.write_block_size
+        empty = b'\xff\x3f' * (page_size // 2)
+        segment = b'\xff' * page_size + empty + empty
+        self.assertEqual(builder.empty_pages(segment), [1, 2])
+        # PIC16 can only write complete pages
+        with self.assertRaises(ValueError):
+            builder.empty_pages(segment + b'\xff\x3f')
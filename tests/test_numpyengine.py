@@ -0,0 +1,74 @@
+"""
+Tests related to the NumPy build engine
+"""
+import unittest
+import io
+import tempfile
+from pathlib import Path
+import toml
+import intelhex
+from mock import patch
+from pyfwimagebuilder import numpyengine
+from pyfwimagebuilder.builder import build, builder_factory
+
+DATA_FOLDER = Path(__file__).parent.absolute() / 'data'
+
+TEST_APPLICATIONS = [
+    ('MCU8/applications/PIC18F57Q43_App_checksum.hex', 'MCU8/v0.3.0/configs/bootloader_config_pic18.toml'),
+    ('MCU8/applications/PIC16F18875_App_checksum.hex', 'MCU8/v0.3.0/configs/bootloader_config_pic16.toml'),
+    ('MCU8/applications/AVR128DA48_App_checksum.hex', 'MCU8/v0.3.0/configs/bootloader_config_avr.toml'),
+    ('MCU32/applications/PIC32_TestApp.X.production.hex', 'MCU32/v1.0.0/configs/bootloader_config_pic32cm.toml'),
+]
+
+def _load(appfile, configfile):
+    config = toml.load(DATA_FOLDER / configfile)
+    hexfile = intelhex.IntelHex()
+    hexfile.fromfile(DATA_FOLDER / appfile, format='hex')
+    builder = builder_factory(config['bootloader']['ARCH'], config)
+    return builder, hexfile
+
+class TestNumpyEngine(unittest.TestCase):
+    """Testing the NumPy build engine
+    """
+    @unittest.skipUnless(numpyengine.is_available(), "NumPy is not installed")
+    def test_identical_output(self):
+        """Test that the NumPy engine output is identical to the python engine output
+        """
+        for appfile, configfile in TEST_APPLICATIONS:
+            builder, hexfile = _load(appfile, configfile)
+            for include_empty_blocks in [False, True]:
+                with self.subTest(appfile=appfile, include_empty_blocks=include_empty_blocks):
+                    python_stream = io.BytesIO()
+                    numpy_stream = io.BytesIO()
+                    builder.build_to_stream(hexfile, python_stream, include_empty_blocks, engine="python")
+                    size = builder.build_to_stream(hexfile, numpy_stream, include_empty_blocks, engine="numpy")
+                    self.assertEqual(numpy_stream.getvalue(), python_stream.getvalue())
+                    self.assertEqual(size, len(numpy_stream.getvalue()))
+
+    def test_fallback_without_numpy(self):
+        """Test that the python engine is used when NumPy is not installed
+        """
+        builder, hexfile = _load(*TEST_APPLICATIONS[0])
+        expected = io.BytesIO()
+        builder.build_to_stream(hexfile, expected, engine="python")
+        stream = io.BytesIO()
+        with patch.object(numpyengine, 'np', None):
+            with self.assertLogs('pyfwimagebuilder.imagebuilder', level='WARNING'):
+                builder.build_to_stream(hexfile, stream, engine="numpy")
+        self.assertEqual(stream.getvalue(), expected.getvalue())
+
+    def test_unsupported_build_modes(self):
+        """Test that the NumPy engine is rejected for builds that need the complete image
+        """
+        appfile, configfile = TEST_APPLICATIONS[0]
+        with tempfile.TemporaryDirectory() as tempdir:
+            outputfile = Path(tempdir) / 'output.img'
+            dumpfile = Path(tempdir) / 'output.txt'
+            previousfile = DATA_FOLDER / 'MCU8' / 'v0.3.0' / 'PIC18F57Q43_App_checksum_v0_3_0.image'
+            for options in [{'hexdump_filename': dumpfile}, {'previous_filename': previousfile},
+                            {'baseline_filename': previousfile}]:
+                with self.subTest(options=options):
+                    with self.assertRaises(ValueError):
+                        build(DATA_FOLDER / appfile, DATA_FOLDER / configfile, outputfile, engine="numpy", **options)
+                    self.assertFalse(outputfile.exists())
+                    self.assertFalse(dumpfile.exists())
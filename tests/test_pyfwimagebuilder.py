@@ -4,14 +4,21 @@ Integration tests using the pyfwimagebuilder CLI
 import unittest
 import sys
 import io
+import csv
+import hashlib
+import json
+import pstats
 import tempfile
 from pathlib import Path
 import pytest
 from mock import patch
 from pyfwimagebuilder import __version__ as VERSION
 from pyfwimagebuilder import BUILD_DATE
+import pyfwimagebuilder
 
-from pyfwimagebuilder.pyfwimagebuilder import main
+from pyfwimagebuilder.pyfwimagebuilder import main, _read_logging_config
+from pyfwimagebuilder.decoder import decode
+from pyfwimagebuilder.hexfile import HexFile
 
 DATA_FOLDER = Path(__file__).parent.absolute() / 'data'
 
@@ -166,6 +173,134 @@ class TestPyfwimagebuilder(unittest.TestCase):
 
         self._decode_and_verify(imagefile, referencefile, configfile)
 
+    def test_decoding_records(self):
+        """Test decoding an image to JSON Lines and CSV block records
+        """
+        imagefile = DATA_FOLDER / 'MCU8' / 'v0.3.0' / 'AVR128DA48_App_checksum_v0_3_0.image'
+        configfile = DATA_FOLDER / 'MCU8' / 'v0.3.0' / 'configs' / 'bootloader_config_avr.toml'
+        image = decode(imagefile, configfile)
+
+        mock_stdout = self._mock_stdout()
+        testargs = ["pyfwimagebuilder", "decode", "-i", str(imagefile), "-c", str(configfile),
+                    "--format", "jsonl", "--hash", "sha256", "-v", "warning"]
+        with patch.object(sys, 'argv', testargs):
+            retval = main()
+        self.assertEqual(retval, 0)
+        records = [json.loads(line) for line in mock_stdout.getvalue().splitlines()]
+        self.assertEqual(len(records), len(image.blocks))
+        self.assertEqual(records[0]['type'], 'METADATA')
+        self.assertIsNone(records[0]['payload_length'])
+        block = image.blocks[1]
+        self.assertEqual(records[1], {
+            'index': 1, 'type': 'FLASH_OPERATION', 'size': block.block_size, 'address': block.address,
+            'page_erase_key': block.page_erase_key, 'page_write_key': block.page_write_key,
+            'byte_write_key': block.byte_write_key, 'page_read_key': block.page_read_key,
+            'payload_length': len(block.data), 'payload_hash': hashlib.sha256(block.data).hexdigest()})
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            outputfile = Path(tempdir) / 'records.csv'
+            testargs = ["pyfwimagebuilder", "decode", "-i", str(imagefile), "-c", str(configfile),
+                        "--format", "csv", "-o", str(outputfile)]
+            with patch.object(sys, 'argv', testargs):
+                retval = main()
+            self.assertEqual(retval, 0)
+            with outputfile.open('r', newline='') as csvfile:
+                rows = list(csv.DictReader(csvfile))
+        self.assertEqual(len(rows), len(image.blocks))
+        self.assertEqual(rows[1]['address'], str(block.address))
+        self.assertEqual(rows[1]['payload_hash'], '')
+
+    def test_decoding_to_hex(self):
+        """Test rebuilding the flash contents of a PIC16 image as Intel HEX and raw binary
+        """
+        appfile = DATA_FOLDER / 'MCU8' / 'applications' / 'PIC16F18875_App_checksum.hex'
+        imagefile = DATA_FOLDER / 'MCU8' / 'v0.3.0' / 'PIC16F18875_App_checksum_v0_3_0.image'
+        configfile = DATA_FOLDER / 'MCU8' / 'v0.3.0' / 'configs' / 'bootloader_config_pic16.toml'
+        with tempfile.TemporaryDirectory() as tempdir:
+            hexfilename = Path(tempdir) / 'flash.hex'
+            binfilename = Path(tempdir) / 'flash.bin'
+            testargs = ["pyfwimagebuilder", "decode", "-i", str(imagefile), "-c", str(configfile),
+                        "--to-hex", str(hexfilename), "--to-bin", str(binfilename), "--base", "0x2000"]
+            with patch.object(sys, 'argv', testargs):
+                retval = main()
+            self.assertEqual(retval, 0)
+            flash = HexFile.fromfile(hexfilename)
+            binary = binfilename.read_bytes()
+
+        # The image blocks use word addresses, the rebuilt hex file byte addresses like the application
+        application = HexFile.fromfile(appfile)
+        self.assertEqual(flash.segments()[0][0], application.segments()[0][0])
+        self.assertEqual(binary, flash.tobinarray(0x2000, flash.segments()[-1][1] - 1))
+        for start, end in flash.segments():
+            self.assertEqual(flash.tobinarray(start, end - 1), application.tobinarray(start, end - 1))
+
+    def test_profile(self):
+        """Test the phase profile of the build and decode actions
+        """
+        appfile = DATA_FOLDER / 'MCU8' / 'applications' / 'AVR128DA48_App_checksum.hex'
+        referencefile = DATA_FOLDER / 'MCU8' / 'v0.3.0' / 'AVR128DA48_App_checksum_v0_3_0.image'
+        configfile = DATA_FOLDER / 'MCU8' / 'v0.3.0' / 'configs' / 'bootloader_config_avr.toml'
+        with tempfile.TemporaryDirectory() as tempdir:
+            imagefile = Path(tempdir) / 'app.img'
+            reportfile = Path(tempdir) / 'build.json'
+            testargs = ["pyfwimagebuilder", "build", "-i", str(appfile), "-c", str(configfile),
+                        "-o", str(imagefile), "-D", str(Path(tempdir) / 'app.txt'),
+                        "--profile-output", str(reportfile)]
+            with patch.object(sys, 'argv', testargs), patch('sys.stderr', new_callable=io.StringIO) as stderr:
+                retval = main()
+            self.assertEqual(retval, 0)
+            self.assertEqual(imagefile.read_bytes(), referencefile.read_bytes())
+            with reportfile.open('r', encoding='utf-8') as report_file:
+                report = json.load(report_file)
+            self.assertEqual([phase['name'] for phase in report['phases']],
+                             ['load config', 'load hex', 'build', 'write image', 'dump'])
+            self.assertIn('write image', stderr.getvalue())
+
+            statsfile = Path(tempdir) / 'decode.pstats'
+            testargs = ["pyfwimagebuilder", "decode", "-i", str(imagefile), "-c", str(configfile),
+                        "-o", str(Path(tempdir) / 'decoded.txt'), "--profile-output", str(statsfile)]
+            with patch.object(sys, 'argv', testargs), patch('sys.stderr', new_callable=io.StringIO) as stderr:
+                retval = main()
+            self.assertEqual(retval, 0)
+            self.assertIn('decode and write', stderr.getvalue())
+            self.assertGreater(pstats.Stats(str(statsfile)).total_calls, 0)
+
+    def test_batch_build(self):
+        """
+        Test building a batch of images from a manifest, with one failing image
+        """
+        images = [
+            ('MCU8/applications/PIC18F57Q43_App_checksum.hex', 'MCU8/v0.3.0/configs/bootloader_config_pic18.toml',
+             'MCU8/v0.3.0/PIC18F57Q43_App_checksum_v0_3_0.image'),
+            ('MCU8/applications/PIC16F18875_App_checksum.hex', 'MCU8/v0.3.0/configs/bootloader_config_pic16.toml',
+             'MCU8/v0.3.0/PIC16F18875_App_checksum_v0_3_0.image'),
+            ('MCU32/applications/PIC32_TestApp.X.production.hex', 'MCU32/v1.0.0/configs/bootloader_config_pic32cm.toml',
+             'MCU32/v1.0.0/PIC32_TestApp.image'),
+        ]
+        with tempfile.TemporaryDirectory() as tempdir:
+            manifest = ""
+            for index, (appfile, configfile, _) in enumerate(images):
+                manifest += "[[image]]\n" + \
+                    f"input = '{(DATA_FOLDER / appfile).as_posix()}'\n" + \
+                    f"config = '{(DATA_FOLDER / configfile).as_posix()}'\n" + \
+                    f"output = 'image{index}.img'\n"
+            manifest += "[[image]]\n" + \
+                "input = 'missing.hex'\n" + \
+                f"config = '{(DATA_FOLDER / images[0][1]).as_posix()}'\n" + \
+                "output = 'missing.img'\n"
+            manifestfile = Path(tempdir) / 'manifest.toml'
+            manifestfile.write_text(manifest, encoding="utf-8")
+
+            testargs = ["pyfwimagebuilder", "batch", "-m", str(manifestfile), "-j", "2"]
+            with patch.object(sys, 'argv', testargs):
+                retval = main()
+            self.assertEqual(retval, 1)
+
+            for index, (_, _, referencefile) in enumerate(images):
+                output = (Path(tempdir) / f'image{index}.img').read_bytes()
+                self.assertEqual(output, (DATA_FOLDER / referencefile).read_bytes())
+            self.assertFalse((Path(tempdir) / 'missing.img').exists())
+
     def test_decode_cmd_help(self):
         """Test CLI help for decode action
         """
@@ -209,3 +344,19 @@ class TestPyfwimagebuilder(unittest.TestCase):
         self.assertEqual(retval, 0)
         self.assertIn(f"pyfwimagebuilder version {VERSION}", mock_stdout.getvalue())
         self.assertIn(f"Build date:  {BUILD_DATE}", mock_stdout.getvalue())
+
+    def test_logging_config_cache(self):
+        """Test that the parsed logging config is cached until the YAML file changes"""
+        with tempfile.TemporaryDirectory() as tempdir:
+            config_path = Path(tempdir) / 'logging.yaml'
+            config_path.write_text((Path(pyfwimagebuilder.__file__).parent / 'logging.yaml').read_text())
+            with patch('appdirs.user_cache_dir', return_value=str(Path(tempdir) / 'cache')):
+                config, _ = _read_logging_config(str(config_path))
+                with patch('yaml.safe_load') as mock_load:
+                    self.assertEqual(_read_logging_config(str(config_path))[0], config)
+                    mock_load.assert_not_called()
+
+                # A modified config file is parsed again
+                config_path.write_text(config_path.read_text().replace("level: WARNING", "level: ERROR", 1))
+                config, _ = _read_logging_config(str(config_path))
+                self.assertEqual(config['handlers']['console']['level'], "ERROR")
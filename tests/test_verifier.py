@@ -0,0 +1,93 @@
+"""
+Tests related to the verifier module
+"""
+import unittest
+import tempfile
+from pathlib import Path
+from mock import patch
+from pyfwimagebuilder.builder import build_with_config, load_config
+from pyfwimagebuilder.verifier import verify, verify_with_config
+from pyfwimagebuilder.hexfile import load_hexfile
+
+DATA_FOLDER = Path(__file__).parent.absolute() / 'data'
+
+APPFILE = DATA_FOLDER / 'MCU8' / 'applications' / 'AVR128DA48_App_checksum.hex'
+CONFIGFILE = DATA_FOLDER / 'MCU8' / 'v0.3.0' / 'configs' / 'bootloader_config_avr.toml'
+IMAGEFILE = DATA_FOLDER / 'MCU8' / 'v0.3.0' / 'AVR128DA48_App_checksum_v0_3_0.image'
+# Offset of the first data byte of the second flash write block in IMAGEFILE
+SECOND_PAGE_DATA_OFFSET = 2 * 527 + 15
+
+class TestVerifier(unittest.TestCase):
+    """Test verification of images against their hex file and configuration
+    """
+    def test_reference_images(self):
+        """Test that the reference images match their hex files
+        """
+        images = [
+            ('MCU8', 'PIC18F57Q43_App_checksum', 'v0.3.0/PIC18F57Q43_App_checksum_v0_3_0.image', 'pic18'),
+            ('MCU8', 'PIC16F18875_App_checksum', 'v0.3.0/PIC16F18875_App_checksum_v0_3_0.image', 'pic16'),
+            ('MCU8', 'AVR128DA48_App_checksum', 'v0.3.0/AVR128DA48_App_checksum_v0_3_0.image', 'avr'),
+            ('MCU32', 'PIC32_TestApp.X.production', 'v1.0.0/PIC32_TestApp.image', 'pic32cm'),
+        ]
+        for family, app, image, config in images:
+            with self.subTest(image=image):
+                configfile = DATA_FOLDER / family / image.split('/')[0] / 'configs' / f'bootloader_config_{config}.toml'
+                result = verify(DATA_FOLDER / family / image, DATA_FOLDER / family / 'applications' / f'{app}.hex',
+                                configfile, jobs=1)
+                self.assertEqual(result.errors, [])
+                self.assertTrue(result.ok)
+                self.assertGreater(result.pages_checked, 0)
+
+    def test_compressed_image(self):
+        """Test that verification does not depend on the block types used in the image
+        """
+        config = load_config(DATA_FOLDER / 'MCU8' / 'v0.3.0' / 'configs' / 'bootloader_config_pic16.toml')
+        config['bootloader']['IMAGE_FORMAT_VERSION'] = "0.4.0"
+        appfile = DATA_FOLDER / 'MCU8' / 'applications' / 'PIC16F18875_App_checksum.hex'
+        with tempfile.TemporaryDirectory() as tempdir:
+            imagefile = Path(tempdir) / 'app.img'
+            build_with_config(appfile, config, imagefile, include_empty_blocks=True)
+            result = verify_with_config(imagefile, load_hexfile(appfile), config, jobs=1)
+        self.assertEqual(result.errors, [])
+
+    def test_mismatches(self):
+        """Test reporting of metadata, data and coverage mismatches
+        """
+        config = load_config(CONFIGFILE)
+        hexfile = load_hexfile(APPFILE)
+        data = IMAGEFILE.read_bytes()
+        with tempfile.TemporaryDirectory() as tempdir:
+            imagefile = Path(tempdir) / 'app.img'
+
+            other_config = load_config(CONFIGFILE)
+            other_config['bootloader']['DEVICE_ID'] = 0x1234
+            result = verify_with_config(IMAGEFILE, hexfile, other_config, jobs=1)
+            self.assertFalse(result.ok)
+            self.assertIn("Device ID", result.errors[0])
+
+            corrupt = bytearray(data)
+            corrupt[SECOND_PAGE_DATA_OFFSET + 3] ^= 0xFF
+            imagefile.write_bytes(corrupt)
+            result = verify_with_config(imagefile, hexfile, config, jobs=1)
+            self.assertEqual(len(result.errors), 1)
+            self.assertIn("0x0000C203", result.errors[0])
+
+            # Leave out the last page
+            imagefile.write_bytes(data[:-527])
+            result = verify_with_config(imagefile, hexfile, config, jobs=1)
+            self.assertEqual(len(result.errors), 1)
+            self.assertIn("not written by the image", result.errors[0])
+
+            # Small hex files are compared in this process even if more jobs are allowed
+            imagefile.write_bytes(corrupt)
+            with patch('concurrent.futures.ProcessPoolExecutor') as mock_executor:
+                with self.assertLogs('pyfwimagebuilder.verifier', level='INFO') as logs:
+                    serial_result = verify_with_config(imagefile, hexfile, config, jobs=2, hex_filename=APPFILE)
+            mock_executor.assert_not_called()
+            self.assertIn("Ignoring 2 jobs", logs.output[0])
+
+            # Address ranges are compared in worker processes, the results must be the same
+            with patch('pyfwimagebuilder.verifier.PARALLEL_MIN_BYTES', 0):
+                parallel_result = verify_with_config(imagefile, hexfile, config, jobs=2, hex_filename=APPFILE)
+            self.assertEqual(parallel_result.errors, serial_result.errors)
+            self.assertEqual(parallel_result.pages_checked, serial_result.pages_checked)